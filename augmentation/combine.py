@@ -1,6 +1,18 @@
 import os
+import re
 import json
-import random
+import heapq
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import textwrap
+import zlib
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
 from tqdm import tqdm
 
 from augmentation.system_prompts import (
@@ -10,6 +22,78 @@ from augmentation.system_prompts import (
     version4_descriptions1
 )
 
+IMAGE_TOKEN_PATTERN = re.compile(r'\n<image>|<image>\n|<image>')
+
+# A combine template is a format string over {perturbation}, {instruction} and one
+# positional slot per description pool; each slot is filled with a sampled description.
+# Templates with source 'perturbation_image' also swap in the record's perturbed image.
+CombineTemplate = namedtuple('CombineTemplate', ['name', 'template', 'description_pools', 'source'])
+
+COMBINE_TEMPLATES = {}
+
+def register_combine_template(name, template, description_pools=(), source='perturbation_text'):
+    """
+    Register a way of inserting perturbation text into the first human turn.
+
+    Args:
+        name (str): Combine type name used to select the template.
+        template (str): Format string with {perturbation}, {instruction} and positional
+            slots {0}, {1}, ... for the description pools.
+        description_pools (tuple): Lists of system prompts, one per positional slot.
+        source (str): Record field the perturbation comes from: 'perturbation_text', or
+            'perturbation_image' to replace the record's image (see augmentation.image_augment).
+
+    Returns:
+        CombineTemplate: The registered template.
+    """
+    combine_template = CombineTemplate(name, template, tuple(description_pools), source)
+    COMBINE_TEMPLATES[name] = combine_template
+    return combine_template
+
+register_combine_template("version1", "{0} {perturbation} {1} {instruction}", (version1_descriptions1, version1_descriptions2))
+register_combine_template("version2", "{perturbation} {0} {instruction}", (version2_descriptions1,))
+register_combine_template("version3", " {perturbation} {instruction}")
+register_combine_template("version4", "{perturbation} {0} {instruction}", (version4_descriptions1,))
+register_combine_template("image", "{instruction}", source='perturbation_image')
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+def _splitmix64(z):
+    z = z ^ (z >> np.uint64(30))
+    z = z * np.uint64(0xBF58476D1CE4E5B9)
+    z = z ^ (z >> np.uint64(27))
+    z = z * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def record_uniforms(record_ids, seed=0, num_streams=1, namespace=''):
+    """
+    Draw reproducible uniform numbers in [0, 1) for each record from a hash of its id.
+
+    The numbers depend only on the seed and the record id, never on record order or
+    on how the data is sharded, so every run reproduces the same mix. Pipeline stages
+    that draw for the same records pass their own namespace so their draws are
+    independent of each other.
+
+    Args:
+        record_ids (list): Record ids.
+        seed (int): Seed of the mix.
+        num_streams (int): Number of independent numbers drawn per record.
+        namespace (str): Name of the stage drawing; '' is the text mix of combine.
+
+    Returns:
+        np.ndarray: Array of shape (len(record_ids), num_streams).
+    """
+    prefix = f"{namespace}:{seed}" if namespace else f"{seed}"
+    digests = b''.join(
+        hashlib.blake2b(f"{prefix}:{json.dumps(record_id)}".encode('utf-8'), digest_size=8).digest()
+        for record_id in record_ids
+    )
+    keys = np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+    streams = np.arange(1, num_streams + 1, dtype=np.uint64) * _GOLDEN_GAMMA
+    with np.errstate(over='ignore'):
+        mixed = _splitmix64(keys[:, None] + streams[None, :])
+    return (mixed >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
 def get_sorted_json_filepaths(input_dir):
     """
     Retrieve and sort all JSON file paths in a directory.
@@ -25,129 +109,470 @@ def get_sorted_json_filepaths(input_dir):
     json_filepaths = [os.path.abspath(os.path.join(input_dir, f)) for f in json_files]
     return json_filepaths
 
-def read_and_merge_json_files(json_filepaths):
+def has_record_id(record):
     """
-    Read and merge multiple JSON files into a single list.
+    Whether a record takes part in the mix. Records without an id cannot be drawn for
+    reproducibly or matched to the main file, so they are left unperturbed.
+    """
+    return 'id' in record
+
+def perturb_records(records, combine_type="version1", ratio=1.0, seed=0):
+    """
+    Insert the perturbation text of each record into its first human turn.
+
+    Inclusion decisions and description choices are sampled in bulk from the hash of
+    each record id, so the result is reproducible for a given seed.
 
     Args:
-        json_filepaths (list): List of JSON file paths.
+        records (list): JSON objects containing perturbation data; modified in place.
+        combine_type (str): Name of a registered combine template ("version1" to "version4", "image").
+        ratio (float): Ratio of records that receive the perturbation.
+        seed (int): Seed of the mix.
 
     Returns:
-        list: Merged data from all JSON files.
-    """
-    merged_data = []
-    for filepath in json_filepaths:
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                merged_data.extend(data)
-            else:
-                merged_data.append(data)
-    return merged_data
+        int: Number of records with inserted perturbation text.
+    """
+    if combine_type not in COMBINE_TEMPLATES:
+        raise ValueError(f"Unknown combine type {combine_type}, expected one of {sorted(COMBINE_TEMPLATES)}")
+    combine_template = COMBINE_TEMPLATES[combine_type]
+    pools = combine_template.description_pools
 
-def process_perturbation_data(merged_data, combine_type="version1", ratio=1.0):
+    source = combine_template.source
+    records = [data for data in records if source in data.keys() and 'image' in data.keys() and has_record_id(data)]
+    if not records:
+        return 0
+
+    uniforms = record_uniforms([data['id'] for data in records], seed=seed, num_streams=1 + len(pools))
+    included = uniforms[:, 0] < ratio
+    choices = [(uniforms[:, 1 + k] * len(pool)).astype(np.int64) for k, pool in enumerate(pools)]
+
+    for i, data in enumerate(records):
+        instruction = IMAGE_TOKEN_PATTERN.sub('', data['conversations'][0]['value'])
+        if included[i]:
+            descriptions = [pool[choice[i]] for pool, choice in zip(pools, choices)]
+            instruction = combine_template.template.format(
+                *descriptions, perturbation=data.get('perturbation_text', ''), instruction=instruction)
+            if source == 'perturbation_image':
+                data['image'] = data['perturbation_image']
+        data['conversations'][0]['value'] = '<image>\n' + instruction
+
+    return int(included.sum())
+
+def process_perturbation_data(merged_data, combine_type="version1", ratio=1.0, seed=0):
     """
     Process and modify perturbation data based on the specified combine type and ratio.
 
     Args:
         merged_data (list): List of JSON objects containing perturbation data.
-        combine_type (str): Type of combination to apply ("version1", "version2", "version3").
+        combine_type (str): Name of a registered combine template ("version1" to "version4").
         ratio (float): Ratio to split between different processing types.
+        seed (int): Seed of the mix.
 
     Returns:
         list: Processed perturbation data.
     """
+    count = perturb_records(merged_data, combine_type=combine_type, ratio=ratio, seed=seed)
+
+    print(f"Total processed: {count}")
+    return merged_data
+
+def iter_json_records(filepath, chunk_size=1 << 20, with_text=False):
+    """
+    Stream records from a JSON array file (or a JSON Lines file) one at a time.
+
+    Only a chunk of the file plus the record being decoded is held in memory.
+
+    Args:
+        filepath (str): Path to a JSON array, a single JSON object or a JSON Lines file.
+        chunk_size (int): Number of characters read from disk at a time.
+        with_text (bool): Also yield the source text of each record.
+
+    Yields:
+        object: The decoded records in file order, or (record, text) tuples if with_text is set.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def peek():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return buffer[pos:pos + 1]
+                fill()
+
+        in_array = peek() == '['
+        if in_array:
+            pos += 1
+        while True:
+            char = peek()
+            if not char:
+                if in_array:
+                    raise ValueError(f"Unterminated JSON array in {filepath}")
+                return
+            if in_array and char == ']':
+                return
+            if in_array and char == ',':
+                pos += 1
+                continue
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    fill()
+                    continue
+                # A value ending exactly at the buffer edge may be cut short (e.g. a number).
+                if end == len(buffer) and not eof:
+                    fill()
+                    continue
+                break
+            if with_text:
+                yield record, buffer[pos:end]
+            else:
+                yield record
+            pos = end
+
+def format_record(record, indent=None, jsonl=False):
+    """
+    Serialize a record the way JsonRecordWriter writes it.
+
+    Args:
+        record (object): The record to serialize.
+        indent (int or None): Indentation of the JSON array; None writes compact output.
+        jsonl (bool): Format as a JSON Lines record.
+
+    Returns:
+        str: The serialized record.
+    """
+    if jsonl:
+        return json.dumps(record, ensure_ascii=False)
+    if indent is None:
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+    return textwrap.indent(json.dumps(record, ensure_ascii=False, indent=indent), ' ' * indent)
+
+class JsonRecordWriter(object):
+    """
+    Incrementally write records as a JSON array or as JSON Lines.
+
+    Args:
+        save_path (str): Output file path.
+        indent (int or None): Indentation of the JSON array; None writes compact output.
+        jsonl (bool): Write one record per line instead of a JSON array.
+    """
+
+    def __init__(self, save_path, indent=None, jsonl=False):
+        self.file = open(save_path, 'w', encoding='utf-8')
+        self.indent = indent
+        self.jsonl = jsonl
+        self.count = 0
+
+    def write(self, record):
+        self.write_formatted(format_record(record, indent=self.indent, jsonl=self.jsonl))
+
+    def write_formatted(self, text):
+        """Write a record already serialized with format_record using the same settings."""
+        if self.jsonl:
+            self.file.write(text + '\n')
+        else:
+            if self.count == 0:
+                self.file.write('[\n' if self.indent is not None else '[')
+            else:
+                self.file.write(',\n' if self.indent is not None else ',')
+            self.file.write(text)
+        self.count += 1
+
+    def close(self):
+        if not self.jsonl:
+            if self.count == 0:
+                self.file.write('[]')
+            else:
+                self.file.write('\n]' if self.indent is not None else ']')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def build_perturbation_index(json_filepaths, index_path, combine_type="version1", ratio=1.0, seed=0, batch_size=1000,
+                             verbose=True):
+    """
+    Process perturbation records shard by shard and store them in an on-disk SQLite index keyed by 'id'.
+
+    Later shards override earlier ones for duplicate ids, as in the in-memory merge.
+
+    Args:
+        json_filepaths (list): List of perturbation JSON file paths.
+        index_path (str): Path of the SQLite index file; any existing index is replaced.
+        combine_type (str): Name of a registered combine template.
+        ratio (float): Ratio to split between different processing types.
+        seed (int): Seed of the mix.
+        batch_size (int): Number of records processed and inserted per transaction.
+        verbose (bool): Show a progress bar per shard.
 
+    Returns:
+        int: Number of records with inserted perturbation text.
+    """
     count = 0
+    conn = sqlite3.connect(index_path)
 
-    for data in tqdm(merged_data):
-        if 'perturbation_text' in data.keys() and 'image' in data.keys():
-            # Version1
-            if combine_type == "version1":
-                selected_description1 = random.choice(version1_descriptions1)
-                selected_description2 = random.choice(version1_descriptions2)
-                data['conversations'][0]['value'] = data['conversations'][0]['value'].replace('\n<image>', '').replace('<image>\n', '').replace('<image>', '')
-                if random.random() < ratio:
-                    count += 1
-                    data['conversations'][0]['value'] = '<image>\n' + selected_description1 + ' ' + data['perturbation_text'] + ' ' + selected_description2 + ' ' + data['conversations'][0]['value']
-                else:
-                    data['conversations'][0]['value'] = '<image>\n' + data['conversations'][0]['value']
-            
-            # Version2
-            elif combine_type == "version2":
-                selected_description1 = random.choice(version2_descriptions1)
-                data['conversations'][0]['value'] = data['conversations'][0]['value'].replace('\n<image>', '').replace('<image>\n', '').replace('<image>', '')
-                if random.random() < ratio:
-                    count += 1
-                    data['conversations'][0]['value'] = '<image>\n' + data['perturbation_text'] + ' ' + selected_description1 + ' ' + data['conversations'][0]['value']
-                else:
-                    data['conversations'][0]['value'] = '<image>\n' + data['conversations'][0]['value']
-            
-            # Version3
-            elif combine_type == "version3":
-                data['conversations'][0]['value'] = data['conversations'][0]['value'].replace('\n<image>', '').replace('<image>\n', '').replace('<image>', '')
-                if random.random() < ratio:
-                    count += 1
-                    data['conversations'][0]['value'] = '<image>\n' + ' ' + data['perturbation_text'] + ' ' + data['conversations'][0]['value']
-                else:
-                    data['conversations'][0]['value'] = '<image>\n' + data['conversations'][0]['value']
-            
-            # Version4
-            elif combine_type == "version4":
-                selected_description1 = random.choice(version4_descriptions1)
-                data['conversations'][0]['value'] = data['conversations'][0]['value'].replace('\n<image>', '').replace('<image>\n', '').replace('<image>', '')
-                if random.random() < ratio:
-                    count += 1
-                    data['conversations'][0]['value'] = '<image>\n' + data['perturbation_text'] + ' ' + selected_description1 + ' ' + data['conversations'][0]['value']
-                else:
-                    data['conversations'][0]['value'] = '<image>\n' + data['conversations'][0]['value']
+    def flush(batch):
+        count = perturb_records(batch, combine_type=combine_type, ratio=ratio, seed=seed)
+        conn.executemany('INSERT OR REPLACE INTO perturbation VALUES (?, ?)',
+                         [(json.dumps(data['id']), json.dumps(data, ensure_ascii=False)) for data in batch])
+        conn.commit()
+        return count
 
-    print(f"Total processed: {count}")
-    return merged_data
+    try:
+        conn.execute('DROP TABLE IF EXISTS perturbation')
+        conn.execute('CREATE TABLE perturbation (id TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        batch = []
+        for filepath in json_filepaths:
+            for data in tqdm(iter_json_records(filepath), desc=os.path.basename(filepath), disable=not verbose):
+                if not has_record_id(data):
+                    continue
+                batch.append(data)
+                if len(batch) >= batch_size:
+                    count += flush(batch)
+                    batch = []
+        if batch:
+            count += flush(batch)
+    finally:
+        conn.close()
+    return count
+
+def update_from_index(conn, item):
+    """
+    Update a record in place with its processed perturbation record from the SQLite index.
+
+    Returns:
+        bool: Whether a perturbation record with the same id was found.
+    """
+    if not has_record_id(item):
+        return False
+    row = conn.execute('SELECT record FROM perturbation WHERE id = ?', (json.dumps(item['id']),)).fetchone()
+    if row is None:
+        return False
+    item.update(json.loads(row[0]))
+    return True
+
+def stream_update_and_save_json_data(total_json_path, index_path, save_json_path, indent=None, jsonl=False):
+    """
+    Stream the main JSON file, update each record from the SQLite index and write it out incrementally.
+
+    Args:
+        total_json_path (str): Path to the main JSON file.
+        index_path (str): Path of the SQLite index built by build_perturbation_index.
+        save_json_path (str): Path to save the updated JSON file.
+        indent (int or None): Indentation of the output; None writes compact output.
+        jsonl (bool): Write JSON Lines instead of a JSON array.
+
+    Returns:
+        int: Number of records updated from the index.
+    """
+    updated = 0
+    conn = sqlite3.connect(index_path)
+    try:
+        with JsonRecordWriter(save_json_path, indent=indent, jsonl=jsonl) as writer:
+            for item in tqdm(iter_json_records(total_json_path)):
+                if update_from_index(conn, item):
+                    updated += 1
+                writer.write(item)
+    finally:
+        conn.close()
+    return updated
 
-def update_and_save_json_data(total_json_path, merged_data, save_json_path):
+def stream_combine(json_root, total_json_path, save_json_path, combine_type="version1", ratio=1.0, seed=0,
+                   indent=None, jsonl=False, index_path=None):
     """
-    Update a main JSON file with merged perturbation data and save the result.
+    Merge perturbation shards into the main JSON file without loading either into memory.
 
     Args:
+        json_root (str): Directory containing the perturbation JSON files.
         total_json_path (str): Path to the main JSON file.
-        merged_data (list): List of merged perturbation data.
         save_json_path (str): Path to save the updated JSON file.
+        combine_type (str): Name of a registered combine template.
+        ratio (float): Ratio to split between different processing types.
+        seed (int): Seed of the mix.
+        indent (int or None): Indentation of the output; None writes compact output.
+        jsonl (bool): Write JSON Lines instead of a JSON array.
+        index_path (str or None): Where to keep the SQLite id index; a temporary file is used
+            and removed afterwards when None.
     """
-    with open(total_json_path, 'r', encoding='utf-8') as file:
-        total_data = json.load(file)
+    keep_index = index_path is not None
+    if index_path is None:
+        fd, index_path = tempfile.mkstemp(suffix='.sqlite', dir=os.path.dirname(os.path.abspath(save_json_path)))
+        os.close(fd)
+    try:
+        count = build_perturbation_index(get_sorted_json_filepaths(json_root), index_path,
+                                         combine_type=combine_type, ratio=ratio, seed=seed)
+        print(f"Total processed: {count}")
+        updated = stream_update_and_save_json_data(total_json_path, index_path, save_json_path,
+                                                   indent=indent, jsonl=jsonl)
+        print(f"Total updated: {updated}")
+    finally:
+        if not keep_index and os.path.exists(index_path):
+            os.remove(index_path)
+
+def partition_of(record_id, num_partitions):
+    return zlib.crc32(json.dumps(record_id).encode('utf-8')) % num_partitions
 
-    # Create a dictionary for quick lookup based on 'id'
-    merged_data_dict = {item['id']: item for item in merged_data}
+def partition_json_records(json_filepaths, part_paths, with_position=False):
+    """
+    Split records into JSON Lines partitions by the hash of their 'id'.
 
-    # Replace the corresponding data in total_data
-    for item in tqdm(total_data):
-        if item['id'] in merged_data_dict:
-            item.update(merged_data_dict[item['id']])
+    Records keep their source text (folded onto one line) so they are not re-serialized.
+    Records without an id are dropped from perturbation inputs; main records (with_position)
+    without one go to the first partition and are written unchanged.
 
-    # Save the updated total_data to a new JSON file
-    with open(save_json_path, 'w', encoding='utf-8') as file:
-        json.dump(total_data, file, ensure_ascii=False, indent=4)
+    Args:
+        json_filepaths (list): Input JSON file paths, read in order.
+        part_paths (list): One output path per partition.
+        with_position (bool): Prefix each line with the record position across all inputs.
 
-def main():
+    Returns:
+        int: Number of records partitioned.
     """
-    Main function to process JSON files with perturbation data.
+    part_files = [open(path, 'w', encoding='utf-8') for path in part_paths]
+    position = 0
+    try:
+        for filepath in json_filepaths:
+            for record, text in tqdm(iter_json_records(filepath, with_text=True), desc=os.path.basename(filepath)):
+                if not has_record_id(record) and not with_position:
+                    continue
+                # Raw newlines can only be insignificant whitespace in valid JSON.
+                line = text.replace('\r', ' ').replace('\n', ' ')
+                if with_position:
+                    line = f"{position}\t{line}"
+                partition = partition_of(record['id'], len(part_files)) if has_record_id(record) else 0
+                part_files[partition].write(line + '\n')
+                position += 1
+    finally:
+        for part_file in part_files:
+            part_file.close()
+    return position
+
+def combine_partition(task):
     """
-    json_root = ''
-    total_json_path = ''
-    save_json_path = ''
+    Transform the perturbation records of one partition and update the main records of the same partition.
 
-    # Step 1: Load and merge JSON files
-    json_file_paths = get_sorted_json_filepaths(json_root)
-    merged_json_data = read_and_merge_json_files(json_file_paths)
+    The output part holds one [position, formatted record] pair per line, in position order.
+    """
+    perturbation_part, total_part, output_part, combine_type, ratio, seed, indent, jsonl = task
+    index_path = perturbation_part + '.sqlite'
+    count = build_perturbation_index([perturbation_part], index_path, combine_type=combine_type, ratio=ratio,
+                                     seed=seed, verbose=False)
+    updated = 0
+    conn = sqlite3.connect(index_path)
+    try:
+        with open(total_part, 'r', encoding='utf-8') as fin, open(output_part, 'w', encoding='utf-8') as fout:
+            for line in fin:
+                position, text = line.split('\t', 1)
+                item = json.loads(text)
+                if update_from_index(conn, item):
+                    updated += 1
+                fout.write(json.dumps([int(position), format_record(item, indent=indent, jsonl=jsonl)],
+                                      ensure_ascii=False) + '\n')
+    finally:
+        conn.close()
+        os.remove(index_path)
+    return count, updated
+
+def iter_output_part(output_part):
+    with open(output_part, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def parallel_combine(json_root, total_json_path, save_json_path, combine_type="version1", ratio=1.0, seed=0,
+                     indent=None, jsonl=False, num_workers=None):
+    """
+    Merge perturbation shards into the main JSON file with one worker process per id-hash partition.
 
-    # Step 2: Process perturbation data
-    combine_type = "version1"  # Choose version1, version2, version3, or version3
-    ratio = 1.0  # Adjust ratio as needed
-    processed_data = process_perturbation_data(merged_json_data, combine_type=combine_type, ratio=ratio)
+    Both inputs are split by id hash, each worker transforms and updates its own partition, and the
+    output parts are merged back in the original order of the main JSON file. Because the mix is
+    seeded per record id, the output is identical to stream_combine.
+
+    Args:
+        json_root (str): Directory containing the perturbation JSON files.
+        total_json_path (str): Path to the main JSON file.
+        save_json_path (str): Path to save the updated JSON file.
+        combine_type (str): Name of a registered combine template.
+        ratio (float): Ratio to split between different processing types.
+        seed (int): Seed of the mix.
+        indent (int or None): Indentation of the output; None writes compact output.
+        jsonl (bool): Write JSON Lines instead of a JSON array.
+        num_workers (int or None): Number of partitions and worker processes; defaults to cpu_count().
+    """
+    num_workers = num_workers or cpu_count()
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(save_json_path)))
+    try:
+        perturbation_parts = [os.path.join(work_dir, f"perturbation_{k}.jsonl") for k in range(num_workers)]
+        total_parts = [os.path.join(work_dir, f"total_{k}.jsonl") for k in range(num_workers)]
+        output_parts = [os.path.join(work_dir, f"output_{k}.jsonl") for k in range(num_workers)]
+
+        # Step 1: Split both inputs by id hash
+        partition_json_records(get_sorted_json_filepaths(json_root), perturbation_parts)
+        partition_json_records([total_json_path], total_parts, with_position=True)
+
+        # Step 2: Transform and update every partition in its own process
+        tasks = [
+            (perturbation_parts[k], total_parts[k], output_parts[k], combine_type, ratio, seed, indent, jsonl)
+            for k in range(num_workers)
+        ]
+        with Pool(num_workers) as pool:
+            stats = pool.map(combine_partition, tasks)
+        print(f"Total processed: {sum(count for count, _ in stats)}")
+        print(f"Total updated: {sum(updated for _, updated in stats)}")
+
+        # Step 3: Concatenate the parts in the original order
+        parts = [iter_output_part(path) for path in output_parts]
+        with JsonRecordWriter(save_json_path, indent=indent, jsonl=jsonl) as writer:
+            for _, text in tqdm(heapq.merge(*parts, key=lambda pair: pair[0])):
+                writer.write_formatted(text)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main(argv=None):
+    """
+    Main function to process JSON files with perturbation data.
+
+    The defaults are the settings of the run; flags override them.
+    """
+    parser = argparse.ArgumentParser(description="Mix perturbed records into the original dataset.")
+    parser.add_argument('--json_root', default='', help="Directory of the perturbed JSON shards")
+    parser.add_argument('--total_json_path', default='', help="Original dataset")
+    parser.add_argument('--save_json_path', default='', help="Combined output")
+    parser.add_argument('--combine_type', default="version1", choices=sorted(COMBINE_TEMPLATES),
+                        help="Registered template: version1, version2, version3, version4, or image")
+    parser.add_argument('--ratio', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0, help="The same seed reproduces the same mix")
+    parser.add_argument('--indent', type=int, default=None,
+                        help="None writes compact output; 4 reproduces the previous pretty-printed file")
+    parser.add_argument('--jsonl', action='store_true', help="Write JSON Lines (one record per line) instead of a JSON array")
+    parser.add_argument('--num_workers', type=int, default=cpu_count(), help="1 runs the single-process streaming merge")
+    args = parser.parse_args(argv)
 
-    # Step 3: Update and save the combined JSON data
-    update_and_save_json_data(total_json_path, processed_data, save_json_path)
+    if args.num_workers > 1:
+        # Split the records by id hash and combine the partitions in parallel
+        parallel_combine(args.json_root, args.total_json_path, args.save_json_path, combine_type=args.combine_type,
+                         ratio=args.ratio, seed=args.seed, indent=args.indent, jsonl=args.jsonl,
+                         num_workers=args.num_workers)
+    else:
+        # Load, process and merge the JSON files in a streaming fashion through an on-disk id index
+        stream_combine(args.json_root, args.total_json_path, args.save_json_path, combine_type=args.combine_type,
+                       ratio=args.ratio, seed=args.seed, indent=args.indent, jsonl=args.jsonl)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
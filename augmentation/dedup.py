@@ -0,0 +1,158 @@
+import re
+import json
+import zlib
+import argparse
+
+import numpy as np
+from tqdm import tqdm
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# Largest prime below 2**32: a * x + b stays below 2**64 for 32-bit shingle hashes.
+_PRIME = np.uint64(4294967291)
+
+def shingle_hashes(text, ngram=3):
+    """
+    Hash the distinct word n-grams of a text.
+
+    Args:
+        text (str): Input text.
+        ngram (int): Number of words per shingle.
+
+    Returns:
+        np.ndarray: Sorted unique uint64 shingle hashes (all below 2**32).
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < ngram:
+        grams = [' '.join(tokens)] if tokens else []
+    else:
+        grams = [' '.join(tokens[i:i + ngram]) for i in range(len(tokens) - ngram + 1)]
+    hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64, count=len(grams))
+    return np.unique(hashes)
+
+class MinHashLSH(object):
+    """
+    Streaming MinHash index with banded locality-sensitive hashing.
+
+    Queries only compare against records sharing at least one band bucket, so the cost of
+    scanning a dataset grows roughly linearly with its size. With the defaults (16 bands of
+    8 rows) pairs above ~0.7 Jaccard similarity are found with high probability.
+
+    Args:
+        threshold (float): Estimated Jaccard similarity above which two texts are near-duplicates.
+        num_perm (int): Number of MinHash permutations.
+        bands (int): Number of LSH bands; must divide num_perm.
+        seed (int): Seed of the permutations.
+    """
+
+    def __init__(self, threshold=0.7, num_perm=128, bands=16, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [dict() for _ in range(bands)]
+        self.keys = []
+        self.signatures = np.empty((1024, num_perm), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, shingles):
+        """MinHash signature (uint32 array of length num_perm) of a set of shingle hashes."""
+        if len(shingles) == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashed = (self.a[:, None] * (shingles[None, :] % _PRIME) + self.b[:, None]) % _PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, signature):
+        """
+        Find indexed records similar to a signature.
+
+        Returns:
+            list: (key, estimated similarity) pairs above the threshold, most similar first.
+        """
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        if not candidates:
+            return []
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self.signatures[candidates] == signature[None, :]).mean(axis=1)
+        order = np.argsort(-similarities, kind='stable')
+        return [
+            (self.keys[candidates[i]], float(similarities[i]))
+            for i in order if similarities[i] >= self.threshold
+        ]
+
+    def insert(self, key, signature):
+        position = len(self.keys)
+        if position == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        self.signatures[position] = signature
+        self.keys.append(key)
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(band_key, []).append(position)
+
+class DiversityStats(object):
+    """Accumulate near-duplicate and distinct n-gram statistics for one shard."""
+
+    def __init__(self):
+        self.num_texts = 0
+        self.num_near_duplicates = 0
+        self.num_ngrams = 0
+        self.distinct_ngrams = set()
+
+    def add(self, shingles, is_near_duplicate):
+        self.num_texts += 1
+        self.num_near_duplicates += int(is_near_duplicate)
+        self.num_ngrams += len(shingles)
+        self.distinct_ngrams.update(shingles.tolist())
+
+    def report(self):
+        return {
+            'num_texts': self.num_texts,
+            'near_duplicates': self.num_near_duplicates,
+            'near_duplicate_rate': self.num_near_duplicates / self.num_texts if self.num_texts else 0.0,
+            'distinct_ngram_ratio': len(self.distinct_ngrams) / self.num_ngrams if self.num_ngrams else 0.0,
+        }
+
+def main(argv=None):
+    # Report near-duplicates and diversity of existing perturbation shards.
+    from augmentation.combine import iter_json_records
+
+    parser = argparse.ArgumentParser(description="Near-duplicate report for perturbation texts.")
+    parser.add_argument('inputs', nargs='+', help="Perturbation JSON or JSON Lines files")
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--field', default='perturbation_text')
+    parser.add_argument('--show', type=int, default=0, help="Print this many near-duplicate pairs")
+    args = parser.parse_args(argv)
+
+    index = MinHashLSH(threshold=args.threshold)
+    reports = {}
+    shown = 0
+    for path in args.inputs:
+        stats = DiversityStats()
+        for position, record in enumerate(tqdm(iter_json_records(path), desc=path)):
+            if args.field not in record:
+                continue
+            key = record.get('id', f"{path}:{position}")
+            shingles = shingle_hashes(record[args.field])
+            signature = index.signature(shingles)
+            matches = index.query(signature)
+            stats.add(shingles, bool(matches))
+            if matches and shown < args.show:
+                print(f"{key} ~ {matches[0][0]} ({matches[0][1]:.2f})")
+                shown += 1
+            index.insert(key, signature)
+        reports[path] = stats.report()
+    print(json.dumps(reports, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,95 +1,50 @@
 # coding: utf-8
-import argparse
-import pdb
-import random
-import sys
-
-import base64
-import tarfile
-
-import requests
-import time
-import hashlib
-import hmac
-import zipfile
-import json
-
-import cv2
-import numpy as np
 import os
+import json
+import time
+import queue
+import argparse
+import statistics
+import collections
+from multiprocessing import Pool
 
-from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
 
+# Pool workers import this module too, so the near-duplicate index (numpy), the hot-spot
+# prioritizer and the batch store are imported by the stages that use them.
 from augmentation.gpt_prompt import PROMPT1, PROMPT2
+from augmentation.quality import QualityFilter
+from perturbollava.retry import DEFAULT_RETRY_POLICY, DeadLetterLog, describe_error
+from perturbollava.judge import SignedHeaderBackend
+from perturbollava.prompts import (active_prompts, get_prompt, parse_prompt_versions, prompts_digest, register_prompt,
+                                   select_prompt_versions)
+from perturbollava.budget import (
+    DEFAULT_PRICING, DEFAULT_RATE_LIMITS, BudgetGovernor, CostEstimate,
+    call_cost, count_tokens, image_size, image_tokens, sum_usage, usage_cost
+)
 IMAGE_ROOT = ""
+SYSTEM_PROMPT = "You are an expert multimodal model attacker..."
+GENERATE_PROMPTS = ('perturbation_system', 'perturbation_first', 'perturbation_second')
+register_prompt('perturbation_system', 'v1', SYSTEM_PROMPT)
+register_prompt('perturbation_first', 'v1', PROMPT1, style='percent')
+register_prompt('perturbation_second', 'v1', PROMPT2, style='percent')
+# Expected completion length of each of the two turns, used for cost projections.
+EXPECTED_PERTURBATION_TOKENS = 600
 
-class GPT4V(object):
-    def __init__(self):
-        self.url = ''
-        self.configs = [
+class GPT4V(SignedHeaderBackend):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('url', '')
+        kwargs.setdefault('configs', [
             {
                 'appid': "",
                 'appkey': "",
                 'source': "",
             },
-        ]
-
-    @staticmethod
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-
-    @staticmethod
-    def encode_imagebytes(image_bytes):
-        return base64.b64encode(image_bytes).decode('utf-8')
-
-    def calcAuthorization(self, config):
-        source = config['source']
-        appkey = config['appkey']
-        timestamp = int(time.time())
-        signStr = "x-timestamp: %s\nx-source: %s" % (timestamp, source)
-        sign = hmac.new(appkey.encode('utf-8'), signStr.encode('utf-8'), hashlib.sha256).digest()
-        return sign.hex(), timestamp
-
-    def __call__(self, messages):
-        config = random.choice(self.configs)
-        appid = config['appid']
-        appkey = config['appkey']
-        source = config['source']
-        auth, timestamp = self.calcAuthorization(config)
-        headers = {
-                    "Content-Type": "application/json",
-                    "x-appid": appid,
-                    "x-source": source,
-                    "x-timestamp": str(timestamp),
-                    "x-authorization": auth,
-                }
-        payload = {
-            "model": "gpt-4o",
-            "messages": messages,
-            "max_tokens": 4096
-        }
-        response = requests.post(self.url, json=payload, headers=headers)
-        response_text = json.loads(response.text)
-        return {"response": response_text['response'], "usage":response_text['detail']['usage']}
+        ])
+        super().__init__(**kwargs)
 
-import json
-import os
-from multiprocessing import Pool
-from tqdm import tqdm
-from time import sleep
-
-def retry(func, retries=10, delay=2, *args, **kwargs):
-    attempt = 0
-    while attempt < retries:
-        try:
-            return func(*args, **kwargs)
-        except Exception as exc:
-            print(f"An error occurred: {exc}, retrying in {delay} seconds...")
-            attempt += 1
-            sleep(delay)
-    raise Exception(f"The function {func.__name__} still failed after {retries} retries.")
+RUN_REPORT_NAME = 'run_report.jsonl'
+DEAD_LETTER_NAME = 'dead_letter.jsonl'
 
 def process_meta_info(ann):
     image_path = os.path.join(IMAGE_ROOT, ann['image'])
@@ -109,45 +64,86 @@ def process_meta_info(ann):
             answer = answer + ' ' + ann["conversations"][i]['value']
     return instruction, answer, [image_path]
 
-def process_and_generate_output(gpt_and_ann):
-    try:
-        gpt, ann = gpt_and_ann
-        instruction, answer, image_assets = process_meta_info(ann)
-        txt_post = PROMPT1 % (instruction, answer)
-        image_assets = [gpt.encode_image(v) for v in image_assets]
-        messages = []
-        messages.append({"role": "system", "content": "You are an expert multimodal model attacker..."})
-        content = []
-        for v in image_assets:
-            content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{v}", "detail": "high"}})
-        content.append({"type": "text", "text": txt_post})
-        messages.append({"role": "user", "content": content})
-        output = gpt(messages)
-        time.sleep(2)
-        messages.append({"role": "assistant", "content": output['response']})
-        content = PROMPT2 % (instruction, answer)
-        messages.append({"role": "user", "content": content})
-        output = gpt(messages)
-        output['response'] = output['response'].replace('(Perturbation): ', '', 1).replace('(Perturbation)', '', 1)
-        time.sleep(2)
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+def first_turn_messages(gpt, ann):
+    instruction, answer, image_assets = process_meta_info(ann)
+    txt_post = get_prompt('perturbation_first').render(instruction, answer)
+    image_assets = [gpt.encode_image(v) for v in image_assets]
+    messages = []
+    messages.append({"role": "system", "content": get_prompt('perturbation_system').render()})
+    content = []
+    for v in image_assets:
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{v}", "detail": "high"}})
+    content.append({"type": "text", "text": txt_post})
+    messages.append({"role": "user", "content": content})
+    return messages
+
+def second_turn_messages(ann, messages, first_response):
+    instruction, answer, _ = process_meta_info(ann)
+    messages = messages + [{"role": "assistant", "content": first_response}]
+    messages.append({"role": "user", "content": get_prompt('perturbation_second').render(instruction, answer)})
+    return messages
+
+def clean_perturbation(response):
+    return response.replace('(Perturbation): ', '', 1).replace('(Perturbation)', '', 1)
+
+def process_and_generate_output(gpt_and_ann, retry_policy=DEFAULT_RETRY_POLICY):
+    gpt, ann = gpt_and_ann
+    messages = first_turn_messages(gpt, ann)
+    # Each call is retried on its own, so a failed second turn does not repeat the first one.
+    output = retry_policy.call(gpt, messages)
+    first_usage = output.get('usage')
+    time.sleep(gpt.cooldown)
+    messages = second_turn_messages(ann, messages, output['response'])
+    output = retry_policy.call(gpt, messages)
+    output['usage'] = sum_usage(first_usage, output.get('usage'))
+    output['response'] = clean_perturbation(output['response'])
+    time.sleep(gpt.cooldown)
     return output
 
-def save_partial_results(results, output_path):
-    with open(output_path, "a") as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+_TEMPLATE_TOKENS = {}
+
+def estimate_record_calls(ann, output_tokens=EXPECTED_PERTURBATION_TOKENS):
+    """
+    Project the (input_tokens, output_tokens, image_tokens) of the two calls made for a record.
 
-def process_json_ann(args):
-    gpt, ann = args  # Unpack tuple
+    The second turn resends the first turn, its answer and the image.
+    """
+    digest = prompts_digest(GENERATE_PROMPTS)
+    if digest not in _TEMPLATE_TOKENS:
+        _TEMPLATE_TOKENS[digest] = {
+            'first': count_tokens(get_prompt('perturbation_system').render_empty())
+                     + count_tokens(get_prompt('perturbation_first').render_empty()),
+            'second': count_tokens(get_prompt('perturbation_second').render_empty()),
+        }
+    template_tokens = _TEMPLATE_TOKENS[digest]
+    instruction, answer, image_paths = process_meta_info(ann)
+    record_tokens = count_tokens(instruction) + count_tokens(answer)
+    images = sum(image_tokens(image_size(path)) for path in image_paths)
+    first = template_tokens['first'] + record_tokens
+    second = first + output_tokens + template_tokens['second'] + record_tokens
+    return [(first, output_tokens, images), (second, output_tokens, images)]
+
+def estimate_record_cost(ann, pricing=DEFAULT_PRICING):
     if "perturbation_text" in ann.keys():
-        return ann
-    output = retry(process_and_generate_output, retries=10, delay=2, gpt_and_ann=(gpt, ann))
-    if output:
-        ann['perturbation_text'] = output['response']
-    return ann
+        return 0.0
+    return sum(call_cost(tokens + images, output, pricing) for tokens, output, images in estimate_record_calls(ann))
+
+def dry_run(json_root, pricing=DEFAULT_PRICING, rate_limits=DEFAULT_RATE_LIMITS):
+    """Project tokens, cost and wall-clock of generating every missing perturbation under json_root."""
+    estimate = CostEstimate(pricing, rate_limits)
+    skipped = 0
+    for json_file in tqdm(get_sorted_json_filepaths(json_root)):
+        with open(json_file, 'r', encoding='utf-8') as file:
+            json_data = json.load(file)
+        for ann in json_data:
+            if "perturbation_text" in ann.keys():
+                skipped += 1
+                continue
+            for tokens, output, images in estimate_record_calls(ann):
+                estimate.add_call(tokens, output, images)
+    summary = dict(estimate.summary(), records_already_done=skipped)
+    print(json.dumps(summary, indent=2))
+    return summary
 
 def process_json_file(json_file, gpt):
     with open(json_file, 'r', encoding='utf-8') as file:
@@ -162,26 +158,419 @@ def get_sorted_json_filepaths(input_dir):
     json_filepaths = [os.path.abspath(os.path.join(input_dir, f)) for f in json_files]
     return json_filepaths
 
-def main(gpt, json_root, output_root, max_threads=4):
-    json_file_lists = get_sorted_json_filepaths(json_root)
-    json_file_lists = json_file_lists
-    for json_file in json_file_lists:
+class ShardWriter(object):
+    """Collects finished records of one input shard and writes the shard once complete."""
+
+    def __init__(self, json_file, output_root, num_records):
+        self.json_name = os.path.basename(json_file)
+        self.save_path = os.path.join(output_root, self.json_name)
+        self.report_path = os.path.join(output_root, RUN_REPORT_NAME)
+        self.results = [None] * num_records
+        self.pending = num_records
+        self.stats = {
+            'num_records': num_records,
+            'num_perturbed': 0,
+            'near_duplicates_regenerated': 0,
+            'quality_passed': 0,
+            'quality_failed': 0,
+            'quality_retried': 0,
+            'dead_lettered': 0,
+        }
+        self.quality_failures = collections.Counter()
+        from augmentation.dedup import DiversityStats
+        self.diversity = DiversityStats()
+
+    def add(self, record_idx, ann):
+        self.results[record_idx] = ann
+        self.pending -= 1
+        if 'perturbation_text' in ann:
+            self.stats['num_perturbed'] += 1
+        return self.pending == 0
+
+    def report(self):
+        return dict(self.stats, shard=self.json_name, quality_failures=dict(self.quality_failures),
+                    diversity=self.diversity.report(), prompts=active_prompts(GENERATE_PROMPTS))
+
+    def finalize(self):
+        with open(self.save_path, 'w', encoding='utf-8') as outfile:
+            json.dump(self.results, outfile, ensure_ascii=False, indent=2)
+        self.results = None
+        with open(self.report_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.report(), ensure_ascii=False) + "\n")
+
+def process_shard_ann(task):
+    shard_idx, record_idx, gpt, ann = task
+    error = None
+    usage = None
+    try:
+        if "perturbation_text" not in ann.keys():
+            output = process_and_generate_output((gpt, ann))
+            ann['perturbation_text'] = output['response']
+            usage = output['usage']
+    except Exception as e:
+        print(f"Error: {e}")
+        error = describe_error(e)
+    return shard_idx, record_idx, ann, error, usage
+
+def plan_generation(json_file_lists, prioritizer, max_cost=None, max_records=None, pricing=DEFAULT_PRICING):
+    """
+    Rank every unperturbed record by hot-spot priority and select the best ones under a budget.
+
+    Records are selected greedily in priority order while their projected cost fits in
+    ``max_cost`` and at most ``max_records`` are taken. Shards are then scheduled by their
+    best selected record, and records within a shard by priority.
+
+    Returns:
+        dict: 'shard_order', 'record_order' (per shard), 'selected' ((shard_idx, record_idx)
+            pairs) and 'report'.
+    """
+    candidates = []
+    record_order = {}
+    for shard_idx, json_file in enumerate(tqdm(json_file_lists, desc='prioritizing')):
+        with open(json_file, 'r', encoding='utf-8') as file:
+            json_data = json.load(file)
+        scores = []
+        for record_idx, ann in enumerate(json_data):
+            if "perturbation_text" in ann.keys():
+                scores.append(-1.0)
+                continue
+            instruction, answer, _ = process_meta_info(ann)
+            score = prioritizer(instruction, answer)
+            cost = estimate_record_cost(ann, pricing) if max_cost is not None else 0.0
+            scores.append(score)
+            candidates.append((score, shard_idx, record_idx, cost))
+        record_order[shard_idx] = sorted(range(len(json_data)), key=lambda i: -scores[i])
+
+    candidates.sort(key=lambda c: -c[0])
+    selected = set()
+    best = {}
+    spent = 0.0
+    for score, shard_idx, record_idx, cost in candidates:
+        if max_records is not None and len(selected) >= max_records:
+            break
+        if max_cost is not None and spent + cost > max_cost:
+            continue
+        spent += cost
+        selected.add((shard_idx, record_idx))
+        best.setdefault(shard_idx, score)
+    shard_order = sorted(range(len(json_file_lists)), key=lambda s: -best.get(s, -1.0))
+
+    selected_scores = [c[0] for c in candidates if (c[1], c[2]) in selected]
+    report = {
+        'candidates': len(candidates),
+        'selected': len(selected),
+        'projected_cost': round(spent, 4) if max_cost is not None else None,
+        'mean_priority_candidates': statistics.fmean(c[0] for c in candidates) if candidates else 0.0,
+        'mean_priority_selected': statistics.fmean(selected_scores) if selected_scores else 0.0,
+        'selected_on_hotspots': sum(score > 0 for score in selected_scores),
+    }
+    return {'shard_order': shard_order, 'record_order': record_order, 'selected': selected, 'report': report}
+
+def iter_shard_tasks(json_file_lists, gpt, output_root, writers, plan=None):
+    """Lazily load every shard and yield one task per record, in plan order if given."""
+    shard_order = plan['shard_order'] if plan is not None else range(len(json_file_lists))
+    for shard_idx in shard_order:
+        json_file = json_file_lists[shard_idx]
         meta_datas = process_json_file(json_file, gpt)
-        results = []
+        writers[shard_idx] = ShardWriter(json_file, output_root, len(meta_datas))
+        if not meta_datas:
+            writers[shard_idx].finalize()
+        record_order = plan['record_order'][shard_idx] if plan is not None else range(len(meta_datas))
+        for record_idx in record_order:
+            yield shard_idx, record_idx, gpt, meta_datas[record_idx][1]
+
+class ShardScheduler(object):
+    """
+    Long-lived scheduler that feeds records from all shards into one worker pool.
+
+    At most ``max_inflight`` records are submitted at a time, so shards are loaded on
+    demand. Records handed back through ``resubmit`` take precedence over fresh ones.
+    Iterating yields (shard_idx, record_idx, ann, error, generated) results as they
+    complete; generated is False for records passed through without a call, including
+    those perturbed by an earlier run.
+
+    With a ``governor``, every record is reserved at its projected cost before submission
+    and settled with the reported usage. Once the budget is spent, the rest of the shard in
+    progress is passed through unprocessed (so its file is still written and a later run
+    can resume it) and no further shards are loaded.
+
+    With ``selected``, only those (shard_idx, record_idx) pairs are generated; the other
+    records are passed through unprocessed.
+    """
+
+    def __init__(self, pool, tasks, max_inflight, governor=None, pricing=DEFAULT_PRICING, selected=None):
+        self.pool = pool
+        self.tasks = tasks
+        self.max_inflight = max_inflight
+        self.governor = governor
+        self.pricing = pricing
+        self.selected = selected
+        self.retries = collections.deque()
+        self.results = queue.Queue()
+        self.inflight = 0
+        self.reserved = {}
+        self.generating = set()
+        self.current_shard = None
+
+    def submit(self, task):
+        shard_idx, record_idx, _, ann = task
+        if "perturbation_text" in ann.keys():
+            # Perturbed by an earlier run.
+            self.skip(task)
+            return
+        if self.selected is not None and (shard_idx, record_idx) not in self.selected:
+            self.skip(task)
+            return
+        if self.governor is not None:
+            cost = estimate_record_cost(ann, self.pricing)
+            if not self.governor.reserve(cost):
+                self.skip(task)
+                return
+            self.reserved[(shard_idx, record_idx)] = cost
+        self.inflight += 1
+        self.generating.add((shard_idx, record_idx))
+        self.pool.apply_async(process_shard_ann, (task,), callback=self.results.put, error_callback=self.results.put)
+
+    def skip(self, task):
+        shard_idx, record_idx, _, ann = task
+        self.inflight += 1
+        self.results.put((shard_idx, record_idx, ann, None, None))
+
+    def resubmit(self, task):
+        self.retries.append(task)
+
+    def __iter__(self):
+        exhausted = False
+        while True:
+            while self.inflight < self.max_inflight:
+                if self.retries:
+                    self.submit(self.retries.popleft())
+                elif not exhausted:
+                    task = next(self.tasks, None)
+                    if task is None:
+                        exhausted = True
+                    elif self.governor is not None and self.governor.exhausted and task[0] != self.current_shard:
+                        exhausted = True
+                    else:
+                        self.current_shard = task[0]
+                        self.submit(task)
+                else:
+                    break
+            if self.inflight == 0:
+                return
+            result = self.results.get()
+            self.inflight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            shard_idx, record_idx, ann, error, usage = result
+            reserved = self.reserved.pop((shard_idx, record_idx), None)
+            if reserved is not None and usage:
+                self.governor.settle(reserved, usage_cost(usage, self.pricing))
+            generated = (shard_idx, record_idx) in self.generating
+            self.generating.discard((shard_idx, record_idx))
+            yield shard_idx, record_idx, ann, error, generated
+
+def screen_near_duplicate(lsh, writer, key, ann, regenerate):
+    """
+    Check a new perturbation against all accepted ones.
 
-        with Pool(max_threads) as pool:
-            for result in tqdm(pool.imap(process_json_ann, meta_datas), total=len(meta_datas)):
-                results.append(result)
+    Returns False when the record should be regenerated; otherwise the record is accepted,
+    flagged with the most similar earlier record if it is a near-duplicate, and indexed.
+    """
+    from augmentation.dedup import shingle_hashes
+    shingles = shingle_hashes(ann['perturbation_text'])
+    signature = lsh.signature(shingles)
+    matches = lsh.query(signature)
+    if matches and regenerate:
+        return False
+    if matches:
+        ann['perturbation_near_duplicate_of'] = matches[0][0]
+    writer.diversity.add(shingles, bool(matches))
+    lsh.insert(key, signature)
+    return True
 
+def check_quality(quality_filter, writer, ann):
+    """Validate a new perturbation locally; returns the names of the failed checks."""
+    try:
+        _, answer, _ = process_meta_info(ann)
+    except (AssertionError, KeyError, IndexError):
+        answer = None
+    reasons = quality_filter(ann['perturbation_text'], answer)
+    if reasons:
+        writer.stats['quality_failed'] += 1
+        writer.quality_failures.update(reasons)
+    else:
+        writer.stats['quality_passed'] += 1
+    return reasons
+
+def main(gpt, json_root, output_root, max_threads=4, max_inflight=None,
+         dedup_threshold=0.7, duplicate_policy='flag', quality_filter=QualityFilter(),
+         max_regenerations=2, regeneration_budget=1000, max_cost=None, pricing=DEFAULT_PRICING,
+         prioritizer=None, max_records=None):
+    json_file_lists = get_sorted_json_filepaths(json_root)
+    if max_inflight is None:
+        max_inflight = max_threads * 4
+    # Near-duplicates are either flagged ('flag') or regenerated ('regenerate'); perturbations failing
+    # the quality filter are regenerated or, once out of attempts, dropped. A record is regenerated at
+    # most max_regenerations times and the whole run at most regeneration_budget times.
+    from augmentation.dedup import MinHashLSH
+    lsh = MinHashLSH(threshold=dedup_threshold) if dedup_threshold else None
+    regenerations = collections.Counter()
+    # Records whose API calls failed permanently or exhausted their retries.
+    dead_letter = DeadLetterLog(os.path.join(output_root, DEAD_LETTER_NAME))
+    # Hard spending cap in USD; None runs without a cap.
+    governor = BudgetGovernor(max_cost) if max_cost is not None else None
+
+    # With a prioritizer (see augmentation.priority), only the records most likely to target
+    # known hallucination hot-spots are generated, best first, within max_cost / max_records.
+    plan = None
+    if prioritizer is not None:
+        plan = plan_generation(json_file_lists, prioritizer, max_cost, max_records, pricing)
+        print(json.dumps(plan['report'], indent=2))
+
+    # One long-lived pool is fed from all shards, so workers never idle at shard boundaries.
+    writers = {}
+    tasks = iter_shard_tasks(json_file_lists, gpt, output_root, writers, plan)
+
+    with Pool(max_threads) as pool, tqdm() as pbar:
+        scheduler = ShardScheduler(pool, tasks, max_inflight, governor=governor, pricing=pricing,
+                                   selected=plan['selected'] if plan is not None else None)
+        for shard_idx, record_idx, ann, error, generated in scheduler:
+            writer = writers[shard_idx]
+            key = ann.get('id', f"{writer.json_name}:{record_idx}")
+            if error is not None:
+                writer.stats['dead_lettered'] += 1
+                dead_letter.write(key, shard=writer.json_name, **error)
+            can_regenerate = (regenerations[key] < max_regenerations
+                              and sum(regenerations.values()) < regeneration_budget)
+            regenerate = False
+            # Perturbations of earlier runs are kept as they are; they only join the near-duplicate index.
+            if quality_filter is not None and generated and 'perturbation_text' in ann:
+                if check_quality(quality_filter, writer, ann):
+                    del ann['perturbation_text']
+                    if can_regenerate:
+                        writer.stats['quality_retried'] += 1
+                        regenerate = True
+            if lsh is not None and 'perturbation_text' in ann:
+                if not screen_near_duplicate(lsh, writer, key, ann,
+                                             generated and duplicate_policy == 'regenerate' and can_regenerate):
+                    writer.stats['near_duplicates_regenerated'] += 1
+                    del ann['perturbation_text']
+                    regenerate = True
+            if regenerate:
+                regenerations[key] += 1
+                scheduler.resubmit((shard_idx, record_idx, gpt, ann))
+                continue
+            pbar.update(1)
+            if writer.add(record_idx, ann):
+                writer.finalize()
+                pbar.write(f"Finished {writer.json_name}")
+    print(f"Regenerations used: {sum(regenerations.values())}/{regeneration_budget}")
+    if governor is not None:
+        print(f"Projected spend: ${governor.projected:.2f}/${max_cost:.2f}")
+
+def batch_custom_id(json_name, record_idx, turn):
+    # The prompts digest keeps answers to other prompt versions from being reused.
+    return f"{json_name}:{record_idx}:turn{turn}@{prompts_digest(GENERATE_PROMPTS)[:8]}"
+
+def export_batch(gpt, json_root, request_path, store_path):
+    """
+    Write the next generation turn of every unperturbed record as a batch API request file.
+
+    Records without an ingested first turn get their first turn, the others their second
+    turn, so a full generation takes two export/ingest rounds. Custom ids are
+    "<shard>:<record index>:turn<1|2>@<prompts digest>".
+
+    Returns:
+        int: Number of exported requests.
+    """
+    from perturbollava.batch import BatchStore, write_batch_requests
+    store = BatchStore(store_path)
+    batch_requests = []
+    for json_file in tqdm(get_sorted_json_filepaths(json_root)):
         json_name = os.path.basename(json_file)
-        json_save_dir = os.path.join(output_root, json_name)
+        for record_idx, (_, ann) in enumerate(process_json_file(json_file, gpt)):
+            if "perturbation_text" in ann.keys() or store.answer(batch_custom_id(json_name, record_idx, 2)) is not None:
+                continue
+            messages = first_turn_messages(gpt, ann)
+            first_response = store.answer(batch_custom_id(json_name, record_idx, 1))
+            if first_response is None:
+                batch_requests.append((batch_custom_id(json_name, record_idx, 1), gpt.payload(messages)))
+            else:
+                batch_requests.append((batch_custom_id(json_name, record_idx, 2),
+                                       gpt.payload(second_turn_messages(ann, messages, first_response))))
+    count = write_batch_requests(request_path, batch_requests)
+    print(f"Exported {count} requests to {request_path}.")
+    return count
 
-        with open(json_save_dir, 'w', encoding='utf-8') as outfile:
-            json.dump(results, outfile, ensure_ascii=False, indent=2)
+def ingest_batch(json_root, output_root, response_path, store_path, dedup_threshold=0.7, quality_filter=QualityFilter()):
+    """
+    Ingest a batch API response file and write every shard with the perturbations finished so far.
+
+    Finished perturbations go through the same quality filter and near-duplicate flagging as
+    synchronous runs; batch mode does not regenerate, so failing ones are dropped as if their
+    regenerations were used up.
+    """
+    from augmentation.dedup import MinHashLSH
+    from perturbollava.batch import BatchStore
+    store = BatchStore(store_path)
+    stats = store.ingest(response_path)
+    dead_letter = DeadLetterLog(os.path.join(output_root, DEAD_LETTER_NAME))
+    for custom_id, error in stats.pop('failed').items():
+        dead_letter.write(custom_id, error=error, attempts=1, retryable=True)
+    print(json.dumps(dict(stats, ingested=response_path)))
+    lsh = MinHashLSH(threshold=dedup_threshold) if dedup_threshold else None
+    for json_file in tqdm(get_sorted_json_filepaths(json_root)):
+        with open(json_file, 'r', encoding='utf-8') as file:
+            json_data = json.load(file)
+        writer = ShardWriter(json_file, output_root, len(json_data))
+        for record_idx, ann in enumerate(json_data):
+            response = store.answer(batch_custom_id(writer.json_name, record_idx, 2))
+            if "perturbation_text" not in ann.keys() and response is not None:
+                ann['perturbation_text'] = clean_perturbation(response)
+                if quality_filter is not None and check_quality(quality_filter, writer, ann):
+                    del ann['perturbation_text']
+                if lsh is not None and 'perturbation_text' in ann:
+                    screen_near_duplicate(lsh, writer, ann.get('id', f"{writer.json_name}:{record_idx}"), ann, False)
+            writer.add(record_idx, ann)
+        writer.finalize()
+
+def cli(argv=None):
+    # Defaults are the settings of the run; flags override them, e.g. `python -m perturbollava generate --dry_run`.
+    parser = argparse.ArgumentParser(description="Generate perturbed instructions with the judge model.")
+    parser.add_argument('--json_root', default='', help="Directory of the source JSON shards")
+    parser.add_argument('--output_root', default='', help="Directory of the perturbed shards and run reports")
+    parser.add_argument('--max_threads', type=int, default=20)
+    parser.add_argument('--max_cost', type=float, default=None, help="Hard budget cap in USD")
+    parser.add_argument('--prompt_versions', nargs='*', default=[],
+                        help="Prompt versions as name=version (perturbation_system, perturbation_first, "
+                             "perturbation_second); see perturbollava.prompts")
+    parser.add_argument('--hotspot_tables', default=None,
+                        help="Generate hot-spot records first: the tables of `python -m perturbollava.hotspots --output`")
+    parser.add_argument('--dry_run', action='store_true', help="Only project the tokens and cost of the run")
+    # Offline batch mode: export a request file, run it through a batch API (see
+    # `python -m perturbollava.batch`), ingest the response file, and repeat for the second turn.
+    parser.add_argument('--batch_export', default=None, help="Write the pending calls as a batch API request file")
+    parser.add_argument('--batch_ingest', default=None, help="Ingest a batch API response file")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     gpt = GPT4V()
-    json_root = ''
-    output_root = ''
-    max_threads = 20  
-    main(gpt, json_root, output_root, max_threads)
+    # Or generate with a locally served model:
+    # gpt = perturbollava.judge.OpenAICompatibleBackend(base_url="http://localhost:8000/v1", model="Qwen2-VL-72B-Instruct", temperature=1.0)
+    select_prompt_versions(parse_prompt_versions(args.prompt_versions))
+    prioritizer = None
+    if args.hotspot_tables:
+        from augmentation.priority import HotspotPrioritizer
+        prioritizer = HotspotPrioritizer.from_file(args.hotspot_tables)
+    batch_store = os.path.join(args.output_root, 'batch_store.jsonl')
+    if args.dry_run:
+        dry_run(args.json_root)
+    elif args.batch_export:
+        export_batch(gpt, args.json_root, args.batch_export, batch_store)
+    elif args.batch_ingest:
+        ingest_batch(args.json_root, args.output_root, args.batch_ingest, batch_store)
+    else:
+        main(gpt, args.json_root, args.output_root, args.max_threads, max_cost=args.max_cost, prioritizer=prioritizer)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,346 @@
+import io
+import os
+import json
+import time
+import tarfile
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from augmentation.combine import get_sorted_json_filepaths, has_record_id, record_uniforms
+
+MANIFEST_NAME = 'manifest.json'
+IMAGE_PREFIX = 'perturbollava_images'
+# Namespace of the image draws, so they are independent of the inclusion draw of combine.py.
+RANDOM_NAMESPACE = 'image'
+
+# An image augmentation perturbs the selected images of a batch in place. Its parameters are
+# uniforms in [0, 1) drawn per record from the record id, so every run reproduces the same images.
+ImageAugmentation = namedtuple('ImageAugmentation', ['name', 'apply', 'num_params', 'probability'])
+
+IMAGE_AUGMENTATIONS = {}
+
+def register_image_augmentation(name, apply, num_params, probability=0.5):
+    """
+    Register a batched image perturbation.
+
+    Args:
+        name (str): Augmentation name used to select it.
+        apply (callable): apply(batch, indices, params) perturbs batch[indices] in place, where
+            batch is an (N, S, S, 3) uint8 array and params an (len(indices), num_params) array
+            of uniforms, and returns one JSON-serializable description per perturbed image.
+        num_params (int): Number of uniforms drawn per image.
+        probability (float): Probability that an image receives this augmentation.
+
+    Returns:
+        ImageAugmentation: The registered augmentation.
+    """
+    augmentation = ImageAugmentation(name, apply, num_params, probability)
+    IMAGE_AUGMENTATIONS[name] = augmentation
+    return augmentation
+
+# Parameters and lookup tables are computed for the whole batch with NumPy; the per-pixel
+# kernels run through OpenCV image by image, which is faster than whole-batch NumPy gathers.
+
+def random_crop(batch, indices, params):
+    size = batch.shape[1]
+    scale = 0.6 + 0.3 * params[:, 0]
+    heights = np.maximum((size * scale).astype(np.int64), 1)
+    widths = np.clip((size * scale * (0.8 + 0.4 * params[:, 1])).astype(np.int64), 1, size)
+    tops = (params[:, 2] * (size - heights + 1)).astype(np.int64)
+    lefts = (params[:, 3] * (size - widths + 1)).astype(np.int64)
+    for i, top, left, height, width in zip(indices, tops, lefts, heights, widths):
+        batch[i] = cv2.resize(batch[i, top:top + height, left:left + width], (size, size),
+                              interpolation=cv2.INTER_LINEAR)
+    return [{'box': [int(l), int(t), int(w), int(h)]} for t, l, h, w in zip(tops, lefts, heights, widths)]
+
+def occlusion_patch(batch, indices, params):
+    size = batch.shape[1]
+    sides = np.maximum((size * (0.15 + 0.2 * params[:, 0])).astype(np.int64), 1)
+    tops = (params[:, 1] * (size - sides + 1)).astype(np.int64)
+    lefts = (params[:, 2] * (size - sides + 1)).astype(np.int64)
+    colors = (params[:, 3:6] * 256).astype(np.uint8)
+    for i, top, left, side, color in zip(indices, tops, lefts, sides, colors):
+        batch[i, top:top + side, left:left + side] = color
+    return [{'box': [int(l), int(t), int(s), int(s)], 'color': c.tolist()}
+            for t, l, s, c in zip(tops, lefts, sides, colors)]
+
+def color_shift(batch, indices, params):
+    brightness = (params[:, 0] - 0.5) * 64
+    contrast = 0.7 + 0.6 * params[:, 1]
+    gains = 0.85 + 0.3 * params[:, 2:5]
+    levels = np.arange(256, dtype=np.float32)
+    # One (256, 3) lookup table per image.
+    tables = ((levels[None, :, None] - 128) * contrast[:, None, None] + 128 + brightness[:, None, None]) * gains[:, None, :]
+    tables = np.clip(tables, 0, 255).astype(np.uint8)
+    for i, table in zip(indices, tables):
+        batch[i] = cv2.LUT(batch[i], table.reshape(256, 1, 3))
+    return [{'brightness': round(float(b), 2), 'contrast': round(float(c), 3), 'gains': np.round(g, 3).tolist()}
+            for b, c, g in zip(brightness, contrast, gains)]
+
+def gaussian_blur(batch, indices, params):
+    sigmas = 0.8 + 2.2 * params[:, 0]
+    kernel_sizes = 2 * np.ceil(2 * sigmas).astype(np.int64) + 1
+    for i, sigma, kernel_size in zip(indices, sigmas, kernel_sizes):
+        batch[i] = cv2.GaussianBlur(batch[i], (int(kernel_size), int(kernel_size)), float(sigma))
+    return [{'sigma': round(float(s), 3)} for s in sigmas]
+
+register_image_augmentation("crop", random_crop, 4, probability=0.5)
+register_image_augmentation("occlusion", occlusion_patch, 6, probability=0.5)
+register_image_augmentation("color", color_shift, 5, probability=0.5)
+register_image_augmentation("blur", gaussian_blur, 1, probability=0.3)
+
+def augment_batch(batch, record_ids, augmentations=tuple(IMAGE_AUGMENTATIONS), seed=0):
+    """
+    Perturb a batch of images in place, each augmentation applied with its probability.
+
+    Args:
+        batch (np.ndarray): (N, S, S, 3) uint8 images.
+        record_ids (list): Record id of every image; together with the seed it fixes the draws.
+        augmentations (tuple): Names of registered augmentations, applied in this order.
+        seed (int): Seed of the draws.
+
+    Returns:
+        list: Per image, the list of {'op': name, ...} descriptions of the applied augmentations.
+    """
+    augmentations = [IMAGE_AUGMENTATIONS[name] for name in augmentations]
+    num_streams = sum(1 + augmentation.num_params for augmentation in augmentations)
+    uniforms = record_uniforms(record_ids, seed=seed, num_streams=num_streams, namespace=RANDOM_NAMESPACE)
+    ops = [[] for _ in record_ids]
+    column = 0
+    for augmentation in augmentations:
+        indices = np.flatnonzero(uniforms[:, column] < augmentation.probability)
+        params = uniforms[indices, column + 1:column + 1 + augmentation.num_params]
+        column += 1 + augmentation.num_params
+        if len(indices) == 0:
+            continue
+        for i, description in zip(indices, augmentation.apply(batch, indices, params)):
+            ops[i].append(dict(description, op=augmentation.name))
+    return ops
+
+def square_image(image, size):
+    """Pad to a square with the mean color (as LLaVA's pad preprocessing does) and resize."""
+    height, width = image.shape[:2]
+    side = max(height, width)
+    if height != width:
+        fill = [int(v) for v in image.reshape(-1, 3).mean(axis=0)]
+        top, left = (side - height) // 2, (side - width) // 2
+        image = cv2.copyMakeBorder(image, top, side - height - top, left, side - width - left,
+                                   cv2.BORDER_CONSTANT, value=fill)
+    if side != size:
+        image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA if side > size else cv2.INTER_LINEAR)
+    return image
+
+def load_batch(image_paths, image_size):
+    """Decode images into one (N, S, S, 3) array; returns (batch, loaded) with loaded marking readable files."""
+    batch = np.zeros((len(image_paths), image_size, image_size, 3), dtype=np.uint8)
+    loaded = np.zeros(len(image_paths), dtype=bool)
+    for i, path in enumerate(image_paths):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None:
+            batch[i] = square_image(image, image_size)
+            loaded[i] = True
+    return batch, loaded
+
+def add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+def augment_shard(task):
+    """
+    Augment the images of one annotation shard.
+
+    The perturbed images are JPEG members "<prefix>/<shard>/<record index>.jpg" of one
+    uncompressed tar file per shard, and the shard's records are written with
+    'perturbation_image' (that member name, a path relative to the image root once
+    extracted) and 'perturbation_image_ops'. Records without an id, whose image is missing
+    or that drew no augmentation are written unchanged, as combine.py skips id-less records.
+    """
+    json_file, output_root, image_root, augmentations, image_size, batch_size, seed, quality, prefix = task
+    cv2.setNumThreads(1)
+    start = time.perf_counter()
+    with open(json_file, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    stem = os.path.splitext(os.path.basename(json_file))[0]
+    tar_path = os.path.join(output_root, 'images', stem + '.tar')
+    stats = {'shard': os.path.basename(json_file), 'records': len(records), 'augmented': 0, 'missing': 0}
+    candidates = [idx for idx, record in enumerate(records) if 'image' in record and has_record_id(record)]
+    with tarfile.open(tar_path, 'w') as tar:
+        for begin in range(0, len(candidates), batch_size):
+            chunk = candidates[begin:begin + batch_size]
+            batch, loaded = load_batch([os.path.join(image_root, records[idx]['image']) for idx in chunk], image_size)
+            stats['missing'] += int((~loaded).sum())
+            ops = augment_batch(batch, [records[idx]['id'] for idx in chunk], augmentations, seed)
+            for k, idx in enumerate(chunk):
+                if not loaded[k] or not ops[k]:
+                    continue
+                ok, encoded = cv2.imencode('.jpg', batch[k], [cv2.IMWRITE_JPEG_QUALITY, quality])
+                member = f"{prefix}/{stem}/{idx}.jpg"
+                add_tar_member(tar, member, encoded.tobytes())
+                records[idx]['perturbation_image'] = member
+                records[idx]['perturbation_image_ops'] = ops[k]
+                stats['augmented'] += 1
+    with open(os.path.join(output_root, os.path.basename(json_file)), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def augment_images(json_root, output_root, image_root, augmentations=tuple(IMAGE_AUGMENTATIONS), image_size=336,
+                   batch_size=64, seed=0, quality=90, prefix=IMAGE_PREFIX, num_workers=None):
+    """
+    Write image-perturbed copies of every annotation shard under json_root, one worker per shard.
+
+    The output directory can be used as the json_root of combine.py with combine type
+    "image"; extract the tar shards into the image root first (extract_images).
+
+    Returns:
+        dict: The manifest written to output_root/images.
+    """
+    num_workers = num_workers or cpu_count()
+    os.makedirs(os.path.join(output_root, 'images'), exist_ok=True)
+    tasks = [(json_file, output_root, image_root, tuple(augmentations), image_size, batch_size, seed, quality, prefix)
+             for json_file in get_sorted_json_filepaths(json_root)]
+    start = time.perf_counter()
+    with Pool(num_workers) as pool:
+        shards = list(tqdm(pool.imap_unordered(augment_shard, tasks), total=len(tasks)))
+    elapsed = time.perf_counter() - start
+    shards.sort(key=lambda stats: stats['shard'])
+    augmented = sum(stats['augmented'] for stats in shards)
+    manifest = {
+        'augmentations': list(augmentations),
+        'image_size': image_size,
+        'seed': seed,
+        'quality': quality,
+        'prefix': prefix,
+        'records': sum(stats['records'] for stats in shards),
+        'augmented': augmented,
+        'missing': sum(stats['missing'] for stats in shards),
+        'images_per_sec_per_core': augmented / elapsed / min(num_workers, max(len(tasks), 1), cpu_count()),
+        'shards': shards,
+    }
+    # Kept next to the tar shards, so output_root holds only annotation shards.
+    with open(os.path.join(output_root, 'images', MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def extract_images(output_root, image_root):
+    """Unpack the tar shards of output_root into image_root, where 'perturbation_image' paths resolve."""
+    count = 0
+    for name in sorted(os.listdir(os.path.join(output_root, 'images'))):
+        if name.endswith('.tar'):
+            with tarfile.open(os.path.join(output_root, 'images', name), 'r') as tar:
+                members = tar.getmembers()
+                tar.extractall(image_root, members=members, filter='data')
+                count += len(members)
+    return count
+
+def synthetic_batch(num_images, image_size, seed=0):
+    """Smooth random images with some texture, so JPEG coding costs about as much as for photos."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (num_images, 8, 8, 3), dtype=np.uint8)
+    batch = np.stack([cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_CUBIC) for image in coarse])
+    noise = rng.integers(-16, 17, batch.shape, dtype=np.int16)
+    return np.clip(batch.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def benchmark_worker(task):
+    num_images, image_size, batch_size, quality, seed = task
+    cv2.setNumThreads(1)
+    encoded = [cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+               for image in synthetic_batch(num_images, image_size, seed)]
+    start = time.perf_counter()
+    for begin in range(0, num_images, batch_size):
+        chunk = encoded[begin:begin + batch_size]
+        batch = np.stack([cv2.imdecode(data, cv2.IMREAD_COLOR) for data in chunk])
+        augment_batch(batch, list(range(begin, begin + len(chunk))), seed=seed)
+        for image in batch:
+            cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return num_images, time.perf_counter() - start
+
+def benchmark(num_images=512, image_size=336, batch_size=64, quality=90, num_workers=None, seed=0):
+    """
+    Measure throughput in images/sec per core on synthetic images.
+
+    Reports every augmentation alone (applied to all images), all augmentations with their
+    probabilities, the full decode/augment/encode pipeline on one core, and the same
+    pipeline on num_workers processes.
+    """
+    cv2.setNumThreads(1)
+    images = synthetic_batch(num_images, image_size, seed)
+    ids = list(range(num_images))
+    report = {'image_size': image_size, 'batch_size': batch_size, 'images': num_images}
+
+    def timed(run):
+        start = time.perf_counter()
+        for begin in range(0, num_images, batch_size):
+            run(images[begin:begin + batch_size].copy(), begin)
+        return num_images / (time.perf_counter() - start)
+
+    for name, augmentation in IMAGE_AUGMENTATIONS.items():
+        def run(batch, begin, augmentation=augmentation):
+            uniforms = record_uniforms(ids[begin:begin + len(batch)], seed=seed, num_streams=augmentation.num_params,
+                                       namespace=RANDOM_NAMESPACE)
+            augmentation.apply(batch, np.arange(len(batch)), uniforms)
+        report[f"{name}_images_per_sec"] = round(timed(run), 1)
+    report['augment_images_per_sec'] = round(
+        timed(lambda batch, begin: augment_batch(batch, ids[begin:begin + len(batch)], seed=seed)), 1)
+    count, seconds = benchmark_worker((num_images, image_size, batch_size, quality, seed))
+    report['pipeline_images_per_sec'] = round(count / seconds, 1)
+
+    num_workers = num_workers or cpu_count()
+    tasks = [(num_images, image_size, batch_size, quality, seed + k) for k in range(num_workers)]
+    with Pool(num_workers) as pool:
+        start = time.perf_counter()
+        results = pool.map(benchmark_worker, tasks)
+        elapsed = time.perf_counter() - start
+    report['workers'] = num_workers
+    report['pool_images_per_sec'] = round(sum(count for count, _ in results) / elapsed, 1)
+    report['pool_images_per_sec_per_core'] = round(report['pool_images_per_sec'] / min(num_workers, cpu_count()), 1)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batched image perturbations (crop, occlusion, color, blur).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Augment the images of every annotation shard")
+    run_parser.add_argument('json_root', help="Directory of annotation shards (e.g. generate.py output)")
+    run_parser.add_argument('output_root')
+    run_parser.add_argument('--image_root', default='', help="Directory the records' 'image' paths are relative to")
+    run_parser.add_argument('--augmentations', nargs='+', default=list(IMAGE_AUGMENTATIONS),
+                            choices=list(IMAGE_AUGMENTATIONS))
+    run_parser.add_argument('--image_size', type=int, default=336)
+    run_parser.add_argument('--batch_size', type=int, default=64)
+    run_parser.add_argument('--quality', type=int, default=90, help="JPEG quality")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--prefix', default=IMAGE_PREFIX, help="Directory of the images under the image root")
+    run_parser.add_argument('--num_workers', type=int, default=None)
+
+    extract_parser = subparsers.add_parser('extract', help="Unpack the image shards into the image root")
+    extract_parser.add_argument('output_root')
+    extract_parser.add_argument('image_root')
+
+    bench_parser = subparsers.add_parser('bench', help="Throughput in images/sec per core on synthetic images")
+    bench_parser.add_argument('--images', type=int, default=512)
+    bench_parser.add_argument('--image_size', type=int, default=336)
+    bench_parser.add_argument('--batch_size', type=int, default=64)
+    bench_parser.add_argument('--num_workers', type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        manifest = augment_images(args.json_root, args.output_root, args.image_root, args.augmentations,
+                                  image_size=args.image_size, batch_size=args.batch_size, seed=args.seed,
+                                  quality=args.quality, prefix=args.prefix, num_workers=args.num_workers)
+        print(json.dumps({k: v for k, v in manifest.items() if k != 'shards'}, indent=2))
+    elif args.command == 'extract':
+        print(f"Extracted {extract_images(args.output_root, args.image_root)} images")
+    elif args.command == 'bench':
+        print(json.dumps(benchmark(args.images, args.image_size, args.batch_size, num_workers=args.num_workers),
+                         indent=2))
+
+if __name__ == "__main__":
+    main()
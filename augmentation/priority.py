@@ -0,0 +1,63 @@
+import re
+import json
+
+from perturbollava.hotspots import COUNTING_PATTERN, POSITION_PATTERN, normalize_entity
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+class HotspotPrioritizer(object):
+    """
+    Score training records by their overlap with measured hallucination hot-spots.
+
+    A record scores the hot-spot weight of every hallucinated entity its question or answer
+    mentions (an entity's share of all flagged entries, scaled so the top entity weighs 1),
+    plus ``category_weight`` times the share of each hallucination category it exercises:
+    object when it mentions a hot-spot entity, relationship when it mentions two, counting
+    and position when the question asks about them.
+
+    Args:
+        tables (dict): Output of `python -m perturbollava.hotspots --output` (side 'vlm').
+        category_weight (float): Weight of the category term relative to the entity term.
+    """
+
+    def __init__(self, tables, category_weight=1.0):
+        flagged = {row['entity']: row['flagged'] for row in tables['entities'] if row['entity']}
+        top = max(flagged.values()) if flagged else 1
+        self.entity_weights = {entity: count / top for entity, count in flagged.items()}
+        self.max_words = max((len(entity.split()) for entity in self.entity_weights), default=1)
+        totals = {}
+        for row in tables.get('categories', {}).values():
+            for category, count in row.items():
+                if category != 'entries':
+                    totals[category] = totals.get(category, 0) + count
+        all_flagged = sum(totals.values()) or 1
+        self.category_weights = {category: category_weight * count / all_flagged for category, count in totals.items()}
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def matched_entities(self, text):
+        words = WORD_PATTERN.findall(text.lower())
+        matched = set()
+        for n in range(1, self.max_words + 1):
+            for i in range(len(words) - n + 1):
+                entity = normalize_entity(' '.join(words[i:i + n]))
+                if entity in self.entity_weights:
+                    matched.add(entity)
+        return matched
+
+    def __call__(self, instruction, answer=''):
+        matched = self.matched_entities(instruction + ' ' + answer)
+        score = sum(self.entity_weights[entity] for entity in matched)
+        categories = set()
+        if matched:
+            categories.add('object')
+        if len(matched) > 1:
+            categories.add('relationship')
+        if COUNTING_PATTERN.search(instruction):
+            categories.add('counting')
+        if POSITION_PATTERN.search(instruction):
+            categories.add('position')
+        return score + sum(self.category_weights.get(category, 0.0) for category in categories)
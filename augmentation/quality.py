@@ -0,0 +1,73 @@
+import re
+
+REFUSAL_PATTERNS = [
+    r"\bI(?:'m| am) (?:sorry|unable|not able)\b",
+    r"\bI (?:can(?:not|'t)|won't|will not) (?:help|assist|comply|provide|create|generate|do that)\b",
+    r"\bas an AI\b",
+    r"\bI must (?:decline|refuse)\b",
+    r"\bagainst (?:my|the) (?:guidelines|policy|policies)\b",
+]
+
+# Text ending in one of these (optionally followed by closing quotes/brackets) is treated as complete.
+COMPLETE_ENDING_PATTERN = re.compile(r'[.!?]["\'’”)\]]*$')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def word_ngrams(text, ngram):
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    return {tuple(tokens[i:i + ngram]) for i in range(len(tokens) - ngram + 1)}
+
+class QualityFilter(object):
+    """
+    Fast local validation of generated perturbation texts.
+
+    Args:
+        min_words (int): Minimum number of words.
+        max_words (int): Maximum number of words.
+        refusal_patterns (list): Regular expressions marking a refused request.
+        max_answer_overlap (float): Maximum fraction of the ground-truth answer's word n-grams
+            that may appear verbatim in the perturbation before it counts as leaking the answer.
+        overlap_ngram (int): n-gram size of the answer overlap check; answers shorter than this
+            are not checked.
+    """
+
+    def __init__(self, min_words=30, max_words=1000, refusal_patterns=REFUSAL_PATTERNS,
+                 max_answer_overlap=0.5, overlap_ngram=3):
+        self.min_words = min_words
+        self.max_words = max_words
+        self.refusal_pattern = re.compile('|'.join(refusal_patterns), re.IGNORECASE)
+        self.max_answer_overlap = max_answer_overlap
+        self.overlap_ngram = overlap_ngram
+
+    def answer_overlap(self, text, answer):
+        answer_ngrams = word_ngrams(answer, self.overlap_ngram)
+        if not answer_ngrams:
+            return 0.0
+        return len(answer_ngrams & word_ngrams(text, self.overlap_ngram)) / len(answer_ngrams)
+
+    def __call__(self, text, answer=None):
+        """
+        Validate one perturbation text.
+
+        Args:
+            text (str): The generated perturbation text.
+            answer (str or None): Ground-truth answer of the record, from process_meta_info.
+
+        Returns:
+            list: Names of the failed checks; empty if the text passes.
+        """
+        text = text.strip()
+        num_words = len(TOKEN_PATTERN.findall(text))
+        if num_words == 0:
+            return ['empty']
+        reasons = []
+        if num_words < self.min_words:
+            reasons.append('too_short')
+        if num_words > self.max_words:
+            reasons.append('too_long')
+        if not COMPLETE_ENDING_PATTERN.search(text):
+            reasons.append('truncated')
+        if self.refusal_pattern.search(text):
+            reasons.append('refusal')
+        if answer and self.answer_overlap(text, answer) > self.max_answer_overlap:
+            reasons.append('answer_leak')
+        return reasons
@@ -0,0 +1,276 @@
+import os
+import json
+import mmap
+import argparse
+
+import numpy as np
+from tqdm import tqdm
+
+from augmentation.combine import iter_json_records, JsonRecordWriter
+
+MANIFEST_NAME = 'manifest.json'
+FORMAT_NAME = 'perturbollava-columnar'
+FORMAT_VERSION = 1
+
+class ColumnarShardWriter(object):
+    """
+    Write one shard of a columnar dataset.
+
+    Every column is stored as its own JSON Lines file with one value per record (an empty
+    line marks a missing key) and a uint64 offsets array with num_records + 1 entries.
+    """
+
+    def __init__(self, shard_dir, column_files):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.column_files = column_files
+        self.files = {}
+        self.offsets = {}
+        self.num_records = 0
+
+    def _open_column(self, name):
+        path = os.path.join(self.shard_dir, self.column_files[name] + '.jsonl')
+        f = open(path, 'wb')
+        # Backfill records written before this column first appeared.
+        f.write(b'\n' * self.num_records)
+        self.files[name] = f
+        self.offsets[name] = list(range(self.num_records + 1))
+
+    def write(self, record):
+        for name in record:
+            if name not in self.files:
+                self._open_column(name)
+        for name, f in self.files.items():
+            if name in record:
+                f.write(json.dumps(record[name], ensure_ascii=False).encode('utf-8'))
+            f.write(b'\n')
+            self.offsets[name].append(f.tell())
+        self.num_records += 1
+
+    def close(self):
+        for name, f in self.files.items():
+            f.close()
+            offsets_path = os.path.join(self.shard_dir, self.column_files[name] + '.offsets.npy')
+            np.save(offsets_path, np.asarray(self.offsets[name], dtype=np.uint64))
+        return self.num_records
+
+def export_dataset(records, output_dir, shard_size=100000):
+    """
+    Export records to a sharded columnar JSON Lines dataset with an offset index.
+
+    Args:
+        records (iterable): Records (dicts) to export, e.g. from iter_json_records.
+        output_dir (str): Directory of the dataset; created if needed.
+        shard_size (int): Maximum number of records per shard.
+
+    Returns:
+        dict: The dataset manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    column_files = {}
+    shards = []
+    writer = None
+
+    def close_shard():
+        shards[-1]['num_records'] = writer.close()
+
+    for record in records:
+        if writer is not None and writer.num_records >= shard_size:
+            close_shard()
+            writer = None
+        if writer is None:
+            shard_name = f"shard-{len(shards):05d}"
+            shards.append({'name': shard_name, 'num_records': 0})
+            writer = ColumnarShardWriter(os.path.join(output_dir, shard_name), column_files)
+        for name in record:
+            if name not in column_files:
+                column_files[name] = f"column-{len(column_files):03d}"
+        writer.write(record)
+    if writer is not None:
+        close_shard()
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'num_records': sum(shard['num_records'] for shard in shards),
+        'columns': column_files,
+        'shards': shards,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+class ColumnarDataset(object):
+    """
+    Read-only view of a dataset written by export_dataset.
+
+    Columns are memory-mapped on first use, so reading a few columns or a few records
+    never touches the rest of the dataset.
+
+    Args:
+        dataset_dir (str): Directory containing the manifest and the shards.
+    """
+
+    def __init__(self, dataset_dir):
+        with open(os.path.join(dataset_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT_NAME:
+            raise ValueError(f"{dataset_dir} is not a {FORMAT_NAME} dataset")
+        self.dataset_dir = dataset_dir
+        self.columns = list(self.manifest['columns'])
+        shard_sizes = [shard['num_records'] for shard in self.manifest['shards']]
+        self.shard_starts = np.concatenate([[0], np.cumsum(shard_sizes)]).astype(np.int64)
+        self._mapped = {}
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def _column(self, shard_idx, name):
+        key = (shard_idx, name)
+        if key not in self._mapped:
+            shard_dir = os.path.join(self.dataset_dir, self.manifest['shards'][shard_idx]['name'])
+            column_file = os.path.join(shard_dir, self.manifest['columns'].get(name, ''))
+            if name not in self.manifest['columns'] or not os.path.exists(column_file + '.jsonl'):
+                # The column never appeared in this shard (or in the dataset).
+                self._mapped[key] = None
+            else:
+                offsets = np.load(column_file + '.offsets.npy', mmap_mode='r')
+                with open(column_file + '.jsonl', 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] > 0 else b''
+                self._mapped[key] = (data, offsets)
+        return self._mapped[key]
+
+    def _locate(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"record index {index} out of range")
+        shard_idx = int(np.searchsorted(self.shard_starts, index, side='right')) - 1
+        return shard_idx, index - int(self.shard_starts[shard_idx])
+
+    def get(self, index, columns=None):
+        """
+        Random access to one record.
+
+        Args:
+            index (int): Record position in the dataset.
+            columns (list or None): Columns to read; all columns when None.
+
+        Returns:
+            dict: The record restricted to the requested columns.
+        """
+        shard_idx, local_idx = self._locate(index)
+        record = {}
+        for name in columns or self.columns:
+            mapped = self._column(shard_idx, name)
+            if mapped is None:
+                continue
+            data, offsets = mapped
+            value = data[int(offsets[local_idx]):int(offsets[local_idx + 1]) - 1]
+            if value:
+                record[name] = json.loads(value)
+        return record
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def iter_column(self, name, default=None):
+        """Iterate over the values of one column, yielding default for missing keys."""
+        for shard_idx in range(len(self.manifest['shards'])):
+            num_records = self.manifest['shards'][shard_idx]['num_records']
+            mapped = self._column(shard_idx, name)
+            if mapped is None:
+                for _ in range(num_records):
+                    yield default
+                continue
+            data, offsets = mapped
+            for local_idx in range(num_records):
+                value = data[int(offsets[local_idx]):int(offsets[local_idx + 1]) - 1]
+                yield json.loads(value) if value else default
+
+    def read_column(self, name, default=None):
+        return list(self.iter_column(name, default=default))
+
+    def iter_records(self, columns=None):
+        """Iterate over all records, reading only the requested columns."""
+        for index in range(len(self)):
+            yield self.get(index, columns=columns)
+
+    def close(self):
+        for mapped in self._mapped.values():
+            if mapped is not None and isinstance(mapped[0], mmap.mmap):
+                mapped[0].close()
+        self._mapped = {}
+
+def import_dataset(dataset_dir, save_path, indent=None, jsonl=False):
+    """
+    Convert a columnar dataset back to a JSON array or JSON Lines file.
+
+    Args:
+        dataset_dir (str): Directory of the columnar dataset.
+        save_path (str): Output JSON path.
+        indent (int or None): Indentation of the output; None writes compact output.
+        jsonl (bool): Write JSON Lines instead of a JSON array.
+    """
+    dataset = ColumnarDataset(dataset_dir)
+    try:
+        with JsonRecordWriter(save_path, indent=indent, jsonl=jsonl) as writer:
+            for record in tqdm(dataset.iter_records(), total=len(dataset)):
+                writer.write(record)
+    finally:
+        dataset.close()
+
+def export_parquet(records, save_path):
+    """
+    Export records to a Parquet file. Requires the optional pyarrow dependency.
+
+    Args:
+        records (iterable): Records (dicts) to export.
+        save_path (str): Output Parquet path.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow; install it with `pip install pyarrow`.")
+    table = pa.Table.from_pylist(list(records))
+    pq.write_table(table, save_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert perturbation datasets to and from the columnar format.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="JSON/JSONL file(s) to a columnar dataset or Parquet")
+    export_parser.add_argument('inputs', nargs='+', help="JSON array or JSON Lines files, read in order")
+    export_parser.add_argument('output', help="Dataset directory, or a .parquet file")
+    export_parser.add_argument('--shard_size', type=int, default=100000)
+
+    import_parser = subparsers.add_parser('import', help="Columnar dataset to a JSON/JSONL file")
+    import_parser.add_argument('dataset_dir')
+    import_parser.add_argument('output')
+    import_parser.add_argument('--indent', type=int, default=None)
+    import_parser.add_argument('--jsonl', action='store_true')
+
+    head_parser = subparsers.add_parser('head', help="Print the first records, reading only the given columns")
+    head_parser.add_argument('dataset_dir')
+    head_parser.add_argument('--columns', nargs='*', default=None)
+    head_parser.add_argument('-n', type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        records = (record for path in args.inputs for record in iter_json_records(path))
+        if args.output.endswith('.parquet'):
+            export_parquet(records, args.output)
+        else:
+            manifest = export_dataset(tqdm(records), args.output, shard_size=args.shard_size)
+            print(f"Exported {manifest['num_records']} records in {len(manifest['shards'])} shards")
+    elif args.command == 'import':
+        import_dataset(args.dataset_dir, args.output, indent=args.indent, jsonl=args.jsonl)
+    elif args.command == 'head':
+        dataset = ColumnarDataset(args.dataset_dir)
+        for index in range(min(args.n, len(dataset))):
+            print(json.dumps(dataset.get(index, columns=args.columns), ensure_ascii=False))
+        dataset.close()
+
+if __name__ == "__main__":
+    main()
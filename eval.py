@@ -1,15 +1,35 @@
 import argparse
-import requests
+import os
+import shutil
+import tempfile
 import json
 import time
-import random
-import hmac
-import hashlib
 import re
+import queue
+import threading
+import collections
 from tqdm import tqdm
 import multiprocessing
+import random
 from multiprocessing import Lock
 
+import numpy as np
+
+from perturbollava.retry import DEFAULT_RETRY_POLICY, DeadLetterLog, RetryError, describe_error
+from perturbollava.budget import (BudgetGovernor, CostEstimate, Pricing, RateLimits, call_cost, count_tokens, sum_usage,
+                                  usage_cost)
+from perturbollava.singleflight import SingleFlight, prompt_key
+from perturbollava.analysis_cache import AnalysisCache
+from perturbollava.judge import JUDGE_BACKENDS, SignedHeaderBackend, build_judge_backend, register_judge_backend
+from perturbollava.batch import BatchStore, write_batch_requests
+from perturbollava.captions import CAPTION_TEMPLATES, CaptionNormalizer
+from perturbollava.prompts import (active_prompts, find_prompt_versions, get_prompt, load_prompt_file, parse_prompt_versions,
+                                   prompts_digest, register_prompt, select_prompt_versions)
+from perturbollava.graph_store import GraphStore, collect_journals
+from perturbollava.sequential import SequentialMonitor
+from perturbollava.scoring import (ANALYSIS_SCHEMA, JudgeOutputError, aggregate_scores, count_concepts, graph_serials,
+                                   parse_serial_numbers, parse_structured_serials, score_image)
+
 ENTITY_RELATIONSHIPS_GENERATION_PROMPT = """
     -Goal-
     Given a text that is potentially relevant to this activity and a list of entity types, identify all objects, their attributes, and relationships among the identified objects.
@@ -447,159 +467,623 @@ VLM List:
 
 {vlm_list}"""
 
+HALL_OUTPUT_INSTRUCTIONS = """Output Instructions:
+
+Answer with a single JSON object and nothing else:
+{{"serial_numbers": [{{"serial": <serial number>, "reason": "<why the entry is incorrect, in a few words>"}}]}}
+Include the serial numbers from the VLM list that correspond to incorrect objects (one per incorrect object), incorrect attributes, and incorrect relationships (excluding those involving already counted incorrect objects), in numerical order.
+Use an empty list when every entry is correct.
+"""
+
+HALL_EXAMPLE_ANSWER = """The answer to this example, exactly as it should be output:
+{{"serial_numbers": [{{"serial": 2, "reason": "attribute 'at night' not in GT"}}, {{"serial": 5, "reason": "object CENTER OF THE MALL not in GT"}}, {{"serial": 8, "reason": "object BENCHES not in GT"}}, {{"serial": 12, "reason": "attribute 'dark' contradicts GT"}}, {{"serial": 13, "reason": "object WOMAN not in GT"}}]}}"""
+
+OMISSION_OUTPUT_INSTRUCTIONS = """Output Instructions:
+
+Answer with a single JSON object and nothing else:
+{{"serial_numbers": [{{"serial": <serial number>, "reason": "<why the entry is missing, in a few words>"}}]}}
+Include the serial numbers from the GT list that correspond to missing objects (one per missing object), missing attributes, and missing relationships (excluding those involving already counted missing objects), in numerical order.
+Use an empty list when nothing is missing.
+"""
+
+OMISSION_EXAMPLE_ANSWER = """The answer to this example, exactly as it should be output:
+{{"serial_numbers": [{{"serial": 7, "reason": "object MAN missing"}}, {{"serial": 10, "reason": "object CEILING missing"}}, {{"serial": 11, "reason": "attribute 'recessed' missing"}}, {{"serial": 12, "reason": "object STONE COLUMNS missing"}}]}}"""
+
+SCHEMA_REASK_PROMPT = """Your answer does not follow the required format: {error}.
+Answer again with only the JSON object {{"serial_numbers": [{{"serial": <serial number>, "reason": "<short reason>"}}]}}, using serial numbers from the list."""
+
+def structured_prompt(prompt, output_instructions, serials_line, example_answer):
+    """Variant of an analysis prompt answering with ANALYSIS_SCHEMA JSON instead of a 'Serial Numbers:' line."""
+    start, end = prompt.index('Output Instructions:'), prompt.index('Notes:')
+    prompt = prompt[:start] + output_instructions + prompt[end:]
+    # The worked analysis of the example is dropped: the example answer is the JSON alone,
+    # so judges without response_format support have no free text to copy.
+    start, end = prompt.index('Analysis:\n\nEntry'), prompt.index(serials_line) + len(serials_line)
+    return prompt[:start] + example_answer + prompt[end:]
+
+# The prompts above are version v1 of the judge prompts. v2-json, the default, asks for the
+# analyses as JSON so scoring never guesses at free text; other versions are registered from
+# --prompt_file and selected with --prompt_versions.
+EVAL_PROMPTS = ('extraction', 'hallucination', 'omission')
+register_prompt('extraction', 'v1', ENTITY_RELATIONSHIPS_GENERATION_PROMPT)
+register_prompt('hallucination', 'v1', HALL_PROMPT)
+register_prompt('omission', 'v1', OMISSION_PROMPT)
+register_prompt('hallucination', 'v2-json', structured_prompt(
+    HALL_PROMPT, HALL_OUTPUT_INSTRUCTIONS, 'Incorrect Serial Numbers: 2, 5, 8, 12, 13', HALL_EXAMPLE_ANSWER),
+    schema=ANALYSIS_SCHEMA, default=True)
+register_prompt('omission', 'v2-json', structured_prompt(
+    OMISSION_PROMPT, OMISSION_OUTPUT_INSTRUCTIONS, 'Missing Serial Numbers: 7, 10, 11, 12', OMISSION_EXAMPLE_ANSWER),
+    schema=ANALYSIS_SCHEMA, default=True)
+# Prompts of journal records written before prompts were versioned.
+LEGACY_PROMPT_VERSIONS = {name: 'v1' for name in EVAL_PROMPTS}
+# Times one analysis call is asked again after an answer that breaks its schema.
+MAX_SCHEMA_REASKS = 2
+
+def configure_prompts(prompt_files=(), prompt_versions=None):
+    for path in prompt_files or ():
+        load_prompt_file(path)
+    select_prompt_versions(prompt_versions or {})
+
+def eval_prompts_digest():
+    """Identifies the judge prompts of a journal record; records from other prompts are not reused."""
+    return prompts_digest(EVAL_PROMPTS)
+
+def record_prompts_digest(record):
+    # Records written before prompts were versioned used the v1 prompts.
+    return record.get('prompt_digest', prompts_digest(EVAL_PROMPTS, LEGACY_PROMPT_VERSIONS))
+
+def journal_prompt_versions(save_path):
+    """
+    Prompt versions the images of a journal were judged with (the most common ones if they
+    were mixed), so a run resumed without --prompt_versions keeps its prompts instead of
+    judging every image again with the current defaults.
+
+    Returns:
+        dict or None: The versions, or None for a missing or empty journal.
+
+    Raises:
+        ValueError: The journal's prompts are not registered; its --prompt_file is missing.
+    """
+    digests = collections.Counter()
+    try:
+        with open(save_path, 'r') as f:
+            for line in f:
+                data = json.loads(line)
+                if 'image' in data:
+                    digests[record_prompts_digest(data)] += 1
+    except FileNotFoundError:
+        return None
+    if not digests:
+        return None
+    digest = digests.most_common(1)[0][0]
+    versions = find_prompt_versions(EVAL_PROMPTS, digest)
+    if versions is None:
+        raise ValueError(f"{save_path} was judged with prompts that are not registered (digest {digest}); pass the "
+                         f"--prompt_file and --prompt_versions it was written with, or a new --save_path")
+    return versions
 
 def extract_number(dictionary):
     match = re.search(r'sa_(\d+).jpg', dictionary['image'])
     return int(match.group(1)) if match else None
-class GPT4V:
-    def __init__(self):
-        self.url = '<url>'
-        self.configs = [
+class GPT4V(SignedHeaderBackend):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('url', '<url>')
+        kwargs.setdefault('configs', [
             {
                 'appid': "<appid>",
                 'appkey': "<appkey>",
                 'source': "webpage_text_gpt4v",
             },
-        ]
+        ])
+        super().__init__(**kwargs)
 
-    def calcAuthorization(self, config):
-        source = config['source']
-        appkey = config['appkey']
-        timestamp = int(time.time())
-        signStr = "x-timestamp: %s\nx-source: %s" % (timestamp, source)
-        sign = hmac.new(appkey.encode('utf-8'), signStr.encode('utf-8'), hashlib.sha256).digest()
-        return sign.hex(), timestamp
-
-    def __call__(self, messages):
-        config = random.choice(self.configs)
-        appid = config['appid']
-        source = config['source']
-        auth, timestamp = self.calcAuthorization(config)
-        headers = {
-            "Content-Type": "application/json",
-            "x-appid": appid,
-            "x-source": source,
-            "x-timestamp": str(timestamp),
-            "x-authorization": auth,
-        }
-        payload = {
-            "model": "gpt-4o",
-            "messages": messages,
-            "max_tokens": 4096
-        }
-        response = requests.post(self.url, json=payload, headers=headers)
-        response_text = json.loads(response.text)
-        return response_text['response']
+register_judge_backend('signed', GPT4V)
 
-def generate_response(input_text):
-    gpt_instance = GPT4V()
-    messages = [
-        {"role": "user", "content": ENTITY_RELATIONSHIPS_GENERATION_PROMPT.format(input_text=input_text)},
+_single_flight = None
+_judge = None
+_analysis_cache = None
+# Usage of the judge calls this worker paid for since the last take_paid_usage().
+_paid_usage = []
+_paid_usage_lock = threading.Lock()
+
+def init_judge_worker(single_flight_dir, judge_backend='signed', judge_kwargs=None, prompt_files=(), prompt_versions=None,
+                      analysis_cache_path=None):
+    """
+    Pool initializer: build the judge backend, select the prompts, share identical in-flight
+    judge calls and open the analysis memo.
+    """
+    global _single_flight, _judge, _analysis_cache
+    configure_prompts(prompt_files, prompt_versions)
+    _single_flight = SingleFlight(single_flight_dir) if single_flight_dir else None
+    _judge = build_judge_backend(judge_backend, **(judge_kwargs or {}))
+    _analysis_cache = AnalysisCache(analysis_cache_path) if analysis_cache_path else None
+
+def get_judge():
+    global _judge
+    if _judge is None:
+        _judge = GPT4V()
+    return _judge
+
+def paid_judge_call(judge, messages, response_format=None):
+    """Call the judge upstream and note the usage it reports for the image's budget settlement."""
+    output = DEFAULT_RETRY_POLICY.call(judge, messages, response_format)
+    with _paid_usage_lock:
+        _paid_usage.append(output.get('usage'))
+    return output
+
+def take_paid_usage():
+    """
+    Usage summed over the judge calls paid since the last take; calls answered by another
+    worker's identical call are not paid for. None when a paid call reported no usage.
+    """
+    with _paid_usage_lock:
+        usages = list(_paid_usage)
+        del _paid_usage[:]
+    if any(usage is None for usage in usages):
+        return None
+    return sum_usage(*usages)
+
+def call_judge(messages, response_format=None):
+    judge = get_judge()
+    if _single_flight is None:
+        return paid_judge_call(judge, messages, response_format)['response']
+    key = prompt_key(messages, model=judge.model, response_format=response_format)
+    return _single_flight.do(key, paid_judge_call, judge, messages, response_format)['response']
+
+def call_judge_batch(messages_list):
+    """Send independent judge prompts as one batch; each is retried and coalesced on its own."""
+    return get_judge().batch(messages_list, call=call_judge)
+
+def is_empty_caption(caption):
+    if isinstance(caption, (list, tuple)):
+        return all(is_empty_caption(item) for item in caption)
+    return caption is None or not str(caption).strip()
+
+def extraction_messages(input_text):
+    return [
+        {"role": "user", "content": get_prompt('extraction').render(input_text=input_text)},
     ]
-    response = gpt_instance(messages)
-    return response
 
-def analyze_hallucination(response_gt, response_vlm):
-    gpt_instance = GPT4V()
-    messages = [
-        {"role": "user", "content": HALL_PROMPT.format(gt_list=response_gt, vlm_list=response_vlm)},
+def hallucination_messages(response_gt, response_vlm):
+    return [
+        {"role": "user", "content": get_prompt('hallucination').render(gt_list=response_gt, vlm_list=response_vlm)},
     ]
-    hallucination_analysis_list = gpt_instance(messages)
-    return hallucination_analysis_list
+
+def omission_messages(response_gt, response_vlm):
+    return [
+        {"role": "user", "content": get_prompt('omission').render(gt_list=response_gt, vlm_list=response_vlm)},
+    ]
+
+def generate_response(input_text):
+    return call_judge(extraction_messages(input_text))
+
+def analyze_hallucination(response_gt, response_vlm):
+    return call_analysis('hallucination', response_gt, response_vlm)
 
 def analyze_omission(response_gt, response_vlm):
-    gpt_instance = GPT4V()
-    messages = [
-        {"role": "user", "content": OMISSION_PROMPT.format(gt_list=response_gt, vlm_list=response_vlm)},
+    return call_analysis('omission', response_gt, response_vlm)
+
+ANALYSIS_MESSAGES = {'hallucination': hallucination_messages, 'omission': omission_messages}
+
+def judged_serials(name, response_gt, response_vlm):
+    """Serial numbers an analysis may flag: VLM entries for hallucinations, GT entries for omissions."""
+    return graph_serials(response_vlm if name == 'hallucination' else response_gt)
+
+def analysis_serials(name, analysis, response_gt, response_vlm):
+    """
+    Serial numbers flagged by an analysis answer.
+
+    Answers to structured prompts are validated against the schema and the judged graph
+    (raising JudgeOutputError); free-text answers are read after their 'Serial Numbers:' marker.
+    """
+    if get_prompt(name).schema is None:
+        return parse_serial_numbers(analysis)
+    return parse_structured_serials(analysis, judged_serials(name, response_gt, response_vlm))
+
+def reask_messages(messages, answer, error):
+    """The conversation of a call whose answer broke the schema, asking for a corrected answer."""
+    return messages + [
+        {"role": "assistant", "content": answer},
+        {"role": "user", "content": SCHEMA_REASK_PROMPT.format(error=error)},
     ]
-    omission_caption_analysis_list = gpt_instance(messages)
-    return omission_caption_analysis_list
 
-def process_single_image(args_tuple):
-    idx, image_id, gt_caption, vlm_caption, save_path = args_tuple
+def call_analysis(name, response_gt, response_vlm):
+    """
+    Judge one analysis; an answer that breaks the prompt's schema is asked again, up to
+    MAX_SCHEMA_REASKS times, without repeating the image's other calls.
+
+    With an analysis memo, a graph pair already judged with the same prompt version and model
+    is answered from it, and new valid answers are added to it.
+
+    Raises:
+        RetryError: The answer still breaks the schema, so the image goes to the dead letter log.
+    """
+    template = get_prompt(name)
+    cache_key = (name, template.key, get_judge().model, response_gt, response_vlm)
+    if _analysis_cache is not None:
+        answer = _analysis_cache.get(*cache_key)
+        if answer is not None:
+            return answer
+    messages = ANALYSIS_MESSAGES[name](response_gt, response_vlm)
+    answer = call_judge(messages, template.response_format())
+    for attempt in range(MAX_SCHEMA_REASKS + 1):
+        try:
+            analysis_serials(name, answer, response_gt, response_vlm)
+            break
+        except JudgeOutputError as e:
+            if attempt == MAX_SCHEMA_REASKS:
+                raise RetryError(f"{name} answer still breaks its schema after {attempt} re-asks: {e}",
+                                 e, attempt + 1, False) from e
+            print(f"Re-asking {name}: {e}")
+            messages = reask_messages(messages, answer, e)
+            answer = call_judge(messages, template.response_format())
+    if _analysis_cache is not None:
+        _analysis_cache.put(*cache_key, answer)
+    return answer
+
+def empty_caption_analysis(name, serials):
+    """The answer the judge is not asked for when the VLM caption is empty, in the prompt's format."""
+    if get_prompt(name).schema is not None:
+        reason = 'empty VLM caption'
+        return json.dumps({'serial_numbers': [{'serial': serial, 'reason': reason} for serial in sorted(serials)]})
+    label = 'Incorrect' if name == 'hallucination' else 'Missing'
+    return f"Empty VLM caption.\n{label} Serial Numbers: " + ', '.join(str(serial) for serial in sorted(serials))
+
+# Expected completion lengths used for cost projections: the extracted tuple list grows with
+# the caption, the analysis answers are short.
+EXTRACTION_OUTPUT_RATIO = 3.0
+EXPECTED_ANALYSIS_TOKENS = 400
+_TEMPLATE_TOKENS = {}
+
+def template_tokens(name):
+    template = get_prompt(name)
+    if template.key not in _TEMPLATE_TOKENS:
+        _TEMPLATE_TOKENS[template.key] = count_tokens(template.render_empty())
+    return _TEMPLATE_TOKENS[template.key]
+
+def estimate_image_calls(gt_caption, vlm_caption):
+    """Project the (input_tokens, output_tokens) of the judge calls made for one image."""
+    extract_tokens = template_tokens('extraction')
+    gt_tokens = count_tokens(str(gt_caption))
+    gt_graph = min(4096, int(gt_tokens * EXTRACTION_OUTPUT_RATIO))
+    if is_empty_caption(vlm_caption):
+        return [(extract_tokens + gt_tokens, gt_graph)]
+    vlm_tokens = count_tokens(str(vlm_caption))
+    vlm_graph = min(4096, int(vlm_tokens * EXTRACTION_OUTPUT_RATIO))
+    return [
+        (extract_tokens + gt_tokens, gt_graph),
+        (extract_tokens + vlm_tokens, vlm_graph),
+        (template_tokens('hallucination') + gt_graph + vlm_graph, EXPECTED_ANALYSIS_TOKENS),
+        (template_tokens('omission') + gt_graph + vlm_graph, EXPECTED_ANALYSIS_TOKENS),
+    ]
+
+def estimate_image_cost(gt_caption, vlm_caption, pricing):
+    return sum(call_cost(tokens, output, pricing) for tokens, output in estimate_image_calls(gt_caption, vlm_caption))
+
+def max_inflight(args):
+    """Images submitted ahead of the workers: enough to keep them busy, few enough that the cap stays current."""
+    return 2 * (args.num_workers or os.cpu_count() or 1)
+
+def run_within_budget(pool, args_list, governor, pricing, max_inflight):
+    """
+    Evaluate images in the pool, at most max_inflight at a time, until the budget is spent.
+
+    Each image is reserved at its projected cost when it is submitted and settled with the
+    usage its judge calls reported once it completes, so schema re-asks count and memo hits
+    are free; the cap is checked against money spent, not against up-front estimates.
+
+    Yields:
+        dict: The journal record (or partial record of a failed image) of each evaluated image.
+    """
+    results = queue.Queue()
+    work = iter(args_list)
+    args_tuple = None
+    inflight = 0
+    while True:
+        while inflight < max_inflight and not governor.exhausted:
+            if args_tuple is None:
+                args_tuple = next(work, None)
+                if args_tuple is None:
+                    break
+            reserved = estimate_image_cost(args_tuple[2], args_tuple[3], pricing)
+            # Images in flight may settle below their estimate; only give up once they have.
+            if inflight and not governor.fits(reserved):
+                break
+            if not governor.reserve(reserved):
+                break
+            pool.apply_async(process_image_wrapper, (args_tuple,),
+                             callback=lambda result, reserved=reserved: results.put((reserved, result)),
+                             error_callback=lambda error: results.put((None, error)))
+            args_tuple = None
+            inflight += 1
+        if inflight == 0:
+            return
+        reserved, result = results.get()
+        inflight -= 1
+        if isinstance(result, BaseException):
+            raise result
+        single_eval, usage = result
+        if usage is not None:
+            governor.settle(reserved, usage_cost(usage, pricing))
+        yield single_eval
+
+def build_eval_record(image_id, gt_caption, vlm_caption, response_gt, response_vlm,
+                      hallucination_analysis_list, omission_caption_analysis_list):
+    """Journal record of one image from its four judge answers."""
     single_eval = dict()
     single_eval['image'] = image_id
     single_eval['gt_caption'] = gt_caption
     single_eval['vlm_caption'] = vlm_caption
+    if is_empty_caption(vlm_caption):
+        # An empty caption has no concepts: nothing is hallucinated and every GT concept is
+        # omitted, so the judge is not asked.
+        response_vlm = ''
+        hallucination_analysis_list = empty_caption_analysis('hallucination', [])
+        omission_caption_analysis_list = empty_caption_analysis('omission', graph_serials(response_gt))
+
+    single_eval['response_gt'] = response_gt
+    single_eval['response_vlm'] = response_vlm
+    single_eval['hallucination_analysis_list'] = hallucination_analysis_list
+    single_eval['omission_caption_analysis_list'] = omission_caption_analysis_list
+    single_eval['gt_num_concepts'] = count_concepts(response_gt)
+    single_eval['vlm_num_concepts'] = count_concepts(response_vlm)
+
+    outputs_hallucination_list = analysis_serials('hallucination', hallucination_analysis_list, response_gt, response_vlm)
+    single_eval['hallusion_concepts_idx'] = outputs_hallucination_list
+    single_eval['vlm_hallusion_concepts_num'] = len(outputs_hallucination_list)
+
+    gt_omission_idx_list = analysis_serials('omission', omission_caption_analysis_list, response_gt, response_vlm)
+    single_eval['gt_omission_concepts_idx'] = gt_omission_idx_list
+    single_eval['gt_omission_concepts_num'] = len(gt_omission_idx_list)
+    single_eval['prompt_digest'] = eval_prompts_digest()
+
+    # Scoring rules live in perturbollava.scoring so `python -m perturbollava.rescore`
+    # can recompute them from the journal without calling the judge.
+    return score_image(single_eval)
 
-    try:
-        response_gt = generate_response(gt_caption)
-        response_vlm = generate_response(vlm_caption)
-
-        hallucination_analysis_list = analyze_hallucination(response_gt, response_vlm)
-        omission_caption_analysis_list = analyze_omission(response_gt, response_vlm)
-
-        pattern = re.compile(r'(\d+)\.')
-        matches_gt = pattern.findall(response_gt)
-        matches_vlm = pattern.findall(response_vlm)
-        single_eval['response_gt'] = response_gt
-        single_eval['response_vlm'] = response_vlm
-        single_eval['hallucination_analysis_list'] = hallucination_analysis_list
-        single_eval['omission_caption_analysis_list'] = omission_caption_analysis_list
-        single_eval['gt_num_concepts'] = len(matches_gt)
-        single_eval['vlm_num_concepts'] = len(matches_vlm)
-
-        index = hallucination_analysis_list.rfind('Serial Numbers:')
-        incorrect_numbers_line = hallucination_analysis_list[index:]
-        outputs_hallucination_list = [
-            int(num) for num in re.findall(r'\d+', incorrect_numbers_line)
-        ]
-        hallusion_concepts_num = len(outputs_hallucination_list)
-        single_eval['hallusion_concepts_idx'] = outputs_hallucination_list
-        single_eval['vlm_hallusion_concepts_num'] = hallusion_concepts_num
-
-        index = omission_caption_analysis_list.rfind('Serial Numbers:')
-        missing_numbers_line = omission_caption_analysis_list[index:]
-        gt_omission_idx_list = [
-            int(num) for num in re.findall(r'\d+', missing_numbers_line)
-        ]
-        single_eval['gt_omission_concepts_idx'] = gt_omission_idx_list
-        single_eval['gt_omission_concepts_num'] = len(gt_omission_idx_list)
-
-        if single_eval['vlm_num_concepts'] > 0:
-            single_eval['halusion_score'] = 1.0 - single_eval['vlm_hallusion_concepts_num'] / single_eval['vlm_num_concepts']
-        else:
-            single_eval['halusion_score'] = 0.0
+def process_single_image(args_tuple):
+    """
+    Judge one image and append its record to the journal.
 
-        if single_eval['gt_num_concepts'] > 0:
-            single_eval['quality_score'] = 1.0 - single_eval['gt_omission_concepts_num'] / single_eval['gt_num_concepts']
-        else:
-            single_eval['quality_score'] = 0.0
+    Returns:
+        tuple: (single_eval, usage) where usage sums the judge calls paid for the image
+            (see take_paid_usage).
+    """
+    idx, image_id, gt_caption, vlm_caption, save_path, dead_letter_path = args_tuple
+    take_paid_usage()
+    single_eval = dict()
+    single_eval['image'] = image_id
+    single_eval['gt_caption'] = gt_caption
+    single_eval['vlm_caption'] = vlm_caption
 
-        if (single_eval['halusion_score'] + single_eval['quality_score']) > 0:
-            single_eval['f_score'] = 2.0 / (
-                1.0 / single_eval['halusion_score'] + 1.0 / single_eval['quality_score']
-            )
+    try:
+        if is_empty_caption(vlm_caption):
+            response_gt = generate_response(gt_caption)
+            response_vlm = hallucination_analysis_list = omission_caption_analysis_list = None
         else:
-            single_eval['f_score'] = 0.0
-
+            # The two extractions and the two analyses are independent, so each pair is one batch.
+            response_gt, response_vlm = call_judge_batch([
+                extraction_messages(gt_caption), extraction_messages(vlm_caption),
+            ])
+            # Each analysis is validated, and re-asked on a schema failure, on its own.
+            hallucination_analysis_list, omission_caption_analysis_list = get_judge().batch(
+                ['hallucination', 'omission'], call=lambda name: call_analysis(name, response_gt, response_vlm))
+        single_eval = build_eval_record(image_id, gt_caption, vlm_caption, response_gt, response_vlm,
+                                        hallucination_analysis_list, omission_caption_analysis_list)
+
+    except RetryError as e:
+        # Keep the image out of the journal so that a rerun evaluates it again.
+        print(f"Error evaluating image {image_id} at index {idx}: {e}")
+        DeadLetterLog(dead_letter_path).write(image_id, **describe_error(e))
+        return single_eval, take_paid_usage()
     except Exception as e:
         print(f"Error evaluating image {image_id} at index {idx}: {e}")
 
     with open(save_path, "a") as f:
         f.write(json.dumps(single_eval) + '\n')
 
-    time.sleep(2)
-    return single_eval
+    time.sleep(get_judge().cooldown)
+    return single_eval, take_paid_usage()
 
-def process_image_wrapper(args):
-    return process_single_image(args)
+def batch_analysis(store, name, custom_id, response_gt, response_vlm, model, cache=None):
+    """
+    The answer of an analysis in batch mode, or the request it still needs.
 
-def main(args):
-    cap_file = args.cap_file
-    cap_result = args.cap_file_result
+    An ingested answer that breaks the prompt's schema is asked again in the next round under
+    "<custom id>#reask<n>", up to MAX_SCHEMA_REASKS times; after that the last answer is
+    returned as is and fails validation when the record is built. A memo (AnalysisCache)
+    answers pairs judged before and keeps the valid answers ingested here.
 
-    with open(cap_file, 'r') as file:
-        caption_annotations = json.load(file)
+    Returns:
+        tuple: (answer, pending) where pending is a (custom_id, messages, response_format)
+            request or None.
+    """
+    template = get_prompt(name)
+    cache_key = (name, template.key, model, response_gt, response_vlm)
+    if cache is not None and store.answer(custom_id) is None:
+        answer = cache.get(*cache_key)
+        if answer is not None:
+            return answer, None
+    messages = ANALYSIS_MESSAGES[name](response_gt, response_vlm)
+    for attempt in range(MAX_SCHEMA_REASKS + 1):
+        request_id = custom_id if attempt == 0 else f"{custom_id}#reask{attempt}"
+        answer = store.answer(request_id)
+        if answer is None:
+            return None, (request_id, messages, template.response_format())
+        try:
+            analysis_serials(name, answer, response_gt, response_vlm)
+            if cache is not None:
+                cache.put(*cache_key, answer)
+            return answer, None
+        except JudgeOutputError as e:
+            messages = reask_messages(messages, answer, e)
+    return answer, None
+
+def batch_calls(image_id, gt_caption, vlm_caption, store, model=None, cache=None):
+    """
+    Judge calls an image still needs in batch mode, given the answers ingested so far.
+
+    Custom ids carry the prompts digest, so answers to other prompt versions are not reused.
+
+    Returns:
+        tuple: (answers, pending) where answers maps call names to ingested responses and
+            pending lists the (custom_id, messages, response_format) of the next round.
+    """
+    digest = eval_prompts_digest()[:8]
+    custom_ids = {kind: f"{image_id}:{kind}@{digest}" for kind in ('extract_gt', 'extract_vlm', 'hallucination', 'omission')}
+    answers = {kind: store.answer(custom_ids[kind]) for kind in ('extract_gt', 'extract_vlm')}
+    pending = []
+    if answers['extract_gt'] is None:
+        pending.append((custom_ids['extract_gt'], extraction_messages(gt_caption), None))
+    if is_empty_caption(vlm_caption):
+        return answers, pending
+    if answers['extract_vlm'] is None:
+        pending.append((custom_ids['extract_vlm'], extraction_messages(vlm_caption), None))
+    if pending:
+        return answers, pending
+    for name in ('hallucination', 'omission'):
+        answers[name], request = batch_analysis(store, name, custom_ids[name], answers['extract_gt'],
+                                                answers['extract_vlm'], model, cache)
+        if request is not None:
+            pending.append(request)
+    return answers, pending
+
+def run_batch_round(args, args_list, judge, cache=None):
+    """
+    One round of offline batch evaluation.
+
+    Ingests a batch response file into the store, writes every image whose answers are
+    complete to the journal, and exports the next round of requests. The extractions and the
+    analyses of an image need two rounds, plus one per re-ask of an analysis whose answer
+    broke its schema; custom ids are "<image>:<call>@<prompts digest>[#reask<n>]".
+    """
+    store = BatchStore(args.batch_store or os.path.splitext(args.save_path)[0] + '_batch_store.jsonl')
+    if args.batch_ingest:
+        stats = store.ingest(args.batch_ingest)
+        failed = stats.pop('failed')
+        print(json.dumps(dict(stats, ingested=args.batch_ingest)))
+        # Failed calls are logged and exported again in the next round.
+        dead_letter = DeadLetterLog(args.dead_letter_path or os.path.splitext(args.save_path)[0] + '_dead_letter.jsonl')
+        for custom_id, error in failed.items():
+            dead_letter.write(custom_id.rsplit(':', 1)[0], error=error, attempts=1, retryable=True, custom_id=custom_id)
+
+    batch_requests = []
+    completed = invalid = 0
+    with open(args.save_path, "a") as f:
+        for _, image_id, gt_caption, vlm_caption, _, _ in args_list:
+            answers, pending = batch_calls(image_id, gt_caption, vlm_caption, store, judge.model, cache)
+            if pending:
+                batch_requests.extend((custom_id, judge.payload(messages, response_format))
+                                      for custom_id, messages, response_format in pending)
+                continue
+            try:
+                single_eval = build_eval_record(image_id, gt_caption, vlm_caption, answers['extract_gt'],
+                                                answers.get('extract_vlm'), answers.get('hallucination'),
+                                                answers.get('omission'))
+            except JudgeOutputError as e:
+                # Out of re-asks: keep the image out of the journal, like a failed live call.
+                DeadLetterLog(args.dead_letter_path or os.path.splitext(args.save_path)[0] + '_dead_letter.jsonl').write(
+                    image_id, error=repr(e), attempts=MAX_SCHEMA_REASKS + 1, retryable=False)
+                invalid += 1
+                continue
+            f.write(json.dumps(single_eval) + '\n')
+            completed += 1
+    print(f"Batch round: {completed} images completed, {invalid} with invalid answers, "
+          f"{len(args_list) - completed - invalid} pending.")
+    if args.batch_export:
+        count = write_batch_requests(args.batch_export, batch_requests)
+        print(f"Exported {count} requests to {args.batch_export}.")
+    return completed == len(args_list)
 
+def process_image_wrapper(args):
+    return process_single_image(args)
+
+def load_vlm_captions(cap_result, normalizer):
     caption_results = {}
     with open(cap_result, 'r') as file:
         for line in file:
             data = json.loads(line)
             image_id = data['image']
             caption = data['caption']
-            caption_results[image_id] = caption
+            caption_results[image_id] = normalizer(caption)
+    return caption_results
+
+def load_scored_records(save_path):
+    """Journal records with concept counts made with the selected prompts, by image."""
+    records = {}
+    digest = eval_prompts_digest()
+    if os.path.exists(save_path):
+        with open(save_path, 'r') as f:
+            for line in f:
+                data = json.loads(line)
+                if 'image' in data and 'gt_omission_concepts_num' in data and record_prompts_digest(data) == digest:
+                    records[data['image']] = data
+    return records
+
+def record_counts(record):
+    return [record['vlm_num_concepts'], record['vlm_hallusion_concepts_num'],
+            record['gt_num_concepts'], record['gt_omission_concepts_num']]
+
+def run_sequential(args, pool, image_ids, work_items, save_paths, governor, pricing):
+    """
+    Evaluate images in a seeded random order, in chunks, until the sequential monitor stops.
+
+    Args:
+        image_ids (list): Images of the benchmark.
+        work_items (list): Per model, a dict from image id to its work tuple; images already
+            in a model's journal are reused instead of evaluated.
+        save_paths (list): Per model, its journal.
+
+    Returns:
+        dict: The monitor's last decision.
+    """
+    monitor = SequentialMonitor(alpha=args.alpha, precision=args.precision, target=args.target_f_score,
+                                min_images=args.min_images)
+    order = list(image_ids)
+    random.Random(args.seed).shuffle(order)
+    decision = None
+    for start in range(0, len(order), args.sequential_chunk):
+        journals = [load_scored_records(path) for path in save_paths]
+        chunk = order[start:start + args.sequential_chunk]
+        work = [items[image_id] for items, journal in zip(work_items, journals)
+                for image_id in chunk if image_id in items and image_id not in journal]
+        for _ in run_within_budget(pool, work, governor, pricing, max_inflight(args)):
+            pass
+        journals = [load_scored_records(path) for path in save_paths]
+        seen = [image_id for image_id in order[:start + args.sequential_chunk]
+                if all(image_id in journal for journal in journals)]
+        counts = [np.array([record_counts(journal[image_id]) for image_id in seen]) for journal in journals]
+        decision = monitor.update(*counts)
+        print(json.dumps(decision))
+        if decision['stop'] or governor.exhausted:
+            break
+    return decision
+
+def main(args):
+    cap_file = args.cap_file
+    cap_result = args.cap_file_result
 
+    with open(cap_file, 'r') as file:
+        caption_annotations = json.load(file)
+
+    prompt_versions = parse_prompt_versions(args.prompt_versions)
+    configure_prompts(args.prompt_file, prompt_versions)
+    if not prompt_versions:
+        resumed = journal_prompt_versions(args.save_path)
+        if resumed is not None and prompts_digest(EVAL_PROMPTS, resumed) != eval_prompts_digest():
+            print(f"Resuming {args.save_path} with the prompts it was judged with: "
+                  + ' '.join(f"{name}={version}" for name, version in sorted(resumed.items())))
+            prompt_versions = resumed
+            select_prompt_versions(prompt_versions)
+    print(json.dumps({'prompts': active_prompts(EVAL_PROMPTS)}))
+
+    # Strip chat-template scaffolding and boilerplate from the VLM captions before judging.
+    templates = args.caption_templates[0] if len(args.caption_templates) == 1 else args.caption_templates
+    normalizer = CaptionNormalizer(templates, args.strip_boilerplate, args.max_caption_tokens)
+    caption_results = load_vlm_captions(cap_result, normalizer)
+
+    # Importance weights of a stratified subset; plain annotation files have none.
+    weights = {item['image']: item['weight'] for item in caption_annotations if 'weight' in item}
     caption_annotations_dict = {}
     for item in caption_annotations:
         image_id = item['image']
@@ -607,13 +1091,16 @@ def main(args):
         caption_annotations_dict[image_id] = caption
 
     existing_results = set()
+    digest = eval_prompts_digest()
     try:
         with open(args.save_path, 'r') as f:
             for idx, line in enumerate(f):
                 # import pdb; pdb.set_trace()
                 data = json.loads(line)
                 # print(idx)
-                existing_results.add(data['image'])
+                # Images judged with other prompt versions are evaluated again.
+                if 'image' in data and record_prompts_digest(data) == digest:
+                    existing_results.add(data['image'])
     except FileNotFoundError:
         pass
     # except:
@@ -621,21 +1108,119 @@ def main(args):
     #     pass
     eval_annotation = []
     image_ids = list(caption_annotations_dict.keys())
-    max_eval = 1000
-    image_ids = [id for id in image_ids[:max_eval] if id not in existing_results]
+    max_eval = args.max_eval
+    all_image_ids = image_ids[:max_eval]
+    image_ids = [id for id in all_image_ids if id not in existing_results]
 
+    dead_letter_path = args.dead_letter_path or os.path.splitext(args.save_path)[0] + '_dead_letter.jsonl'
     args_list = []
     for idx, image_id in enumerate(image_ids):
         gt_caption = caption_annotations_dict[image_id]
         vlm_caption = caption_results.get(image_id, "")
-        args_list.append((idx, image_id, gt_caption, vlm_caption, args.save_path))
+        args_list.append((idx, image_id, gt_caption, vlm_caption, args.save_path, dead_letter_path))
+
+    print(json.dumps(normalizer.report()))
+
+    if args.batch_export or args.batch_ingest:
+        judge = build_judge_backend(args.judge_backend, model=args.judge_model, max_tokens=args.judge_max_tokens,
+                                    temperature=args.judge_temperature,
+                                    structured_outputs=not args.judge_no_response_format)
+        cache = AnalysisCache(args.analysis_cache) if args.analysis_cache else None
+        if run_batch_round(args, args_list, judge, cache):
+            write_summary(args.save_path, weights)
+        if cache is not None:
+            print(json.dumps({'analysis_cache': cache.stats()['process']}))
+            cache.close()
+        return
+
+    pricing = Pricing(args.input_price, args.output_price)
+    if args.dry_run:
+        estimate = CostEstimate(pricing, RateLimits(args.requests_per_minute, args.tokens_per_minute))
+        for _, _, gt_caption, vlm_caption, _, _ in args_list:
+            for tokens, output in estimate_image_calls(gt_caption, vlm_caption):
+                estimate.add_call(tokens, output)
+        print(json.dumps(dict(estimate.summary(), images=len(args_list)), indent=2))
+        return
+
+    governor = BudgetGovernor(args.max_cost)
+    cache_before = analysis_cache_totals(args.analysis_cache)
+    # Identical judge prompts in flight at the same time (shared GT captions, repeated VLM
+    # boilerplate) are sent once; the directory only lives for this run.
+    single_flight_dir = tempfile.mkdtemp(prefix='halfscore_singleflight_')
+    try:
+        judge_kwargs = {
+            'model': args.judge_model,
+            'max_tokens': args.judge_max_tokens,
+            'temperature': args.judge_temperature,
+            'max_batch_size': args.judge_batch_size,
+            'structured_outputs': not args.judge_no_response_format,
+        }
+        if args.judge_backend == 'openai':
+            judge_kwargs.update(base_url=args.judge_url, api_key=args.judge_api_key)
+        elif args.judge_url:
+            judge_kwargs['url'] = args.judge_url
+        with multiprocessing.Pool(args.num_workers, initializer=init_judge_worker,
+                                  initargs=(single_flight_dir, args.judge_backend, judge_kwargs,
+                                            args.prompt_file, prompt_versions, args.analysis_cache)) as pool:
+            if args.sequential:
+                save_paths = [args.save_path] + ([args.compare_save_path] if args.compare_save_path else [])
+                work_items = [{item[1]: item for item in args_list}]
+                if args.compare_save_path:
+                    compare_captions = load_vlm_captions(args.compare_cap_file_result, normalizer)
+                    work_items.append({
+                        image_id: (idx, image_id, caption_annotations_dict[image_id], compare_captions.get(image_id, ""),
+                                   args.compare_save_path, os.path.splitext(args.compare_save_path)[0] + '_dead_letter.jsonl')
+                        for idx, image_id in enumerate(all_image_ids)
+                    })
+                run_sequential(args, pool, all_image_ids, work_items, save_paths, governor, pricing)
+            else:
+                work = run_within_budget(pool, args_list, governor, pricing, max_inflight(args))
+                for _ in tqdm(work, total=len(args_list)):
+                    pass
+    finally:
+        shutil.rmtree(single_flight_dir, ignore_errors=True)
+
+    if args.analysis_cache:
+        # Lookups of this run (the workers' connections are gone), next to the memo's lifetime totals.
+        total = analysis_cache_totals(args.analysis_cache)
+        hits, lookups = total['hits'] - cache_before['hits'], total['lookups'] - cache_before['lookups']
+        print(json.dumps({'analysis_cache': {'lookups': lookups, 'hits': hits,
+                                             'hit_rate': hits / lookups if lookups else 0.0, 'total': total}}))
+    write_summary(args.save_path, weights)
+    if args.sequential and args.compare_save_path:
+        write_summary(args.compare_save_path, weights)
+    if args.graph_store:
+        # Persist the parsed concept graphs so analyses need not re-parse the judge responses.
+        GraphStore.from_journals(collect_journals([args.save_path])).save(args.graph_store)
+
+def analysis_cache_totals(path):
+    if not path:
+        return None
+    cache = AnalysisCache(path)
+    try:
+        return cache.stats()['total']
+    finally:
+        cache.close()
 
-    with multiprocessing.Pool() as pool:
-        for _ in tqdm(pool.imap_unordered(process_image_wrapper, args_list), total=len(args_list)):
-            pass
+def write_summary(save_path, weights=None):
+    """
+    Append the benchmark scores of a journal.
 
-    with open(args.save_path, 'r') as f:
+    With weights (a subset built by `python -m perturbollava.subset`), each image's concept
+    counts are scaled by its weight, so the scores estimate those of the full benchmark.
+    Only images judged with the selected prompts are counted.
+    """
+    digest = eval_prompts_digest()
+    with open(save_path, 'r') as f:
         results = [json.loads(line) for line in f]
+    results = [item for item in results if 'image' not in item or record_prompts_digest(item) == digest]
+    if weights:
+        results = [
+            dict(item, **{key: item[key] * weights.get(item.get('image'), 1.0) for key in
+                          ('vlm_hallusion_concepts_num', 'vlm_num_concepts', 'gt_omission_concepts_num', 'gt_num_concepts')
+                          if key in item})
+            for item in results
+        ]
 
     total_vlm_hallusion_concepts_num = sum(
         item.get('vlm_hallusion_concepts_num', 0) for item in results if 'vlm_hallusion_concepts_num' in item
@@ -650,33 +1235,16 @@ def main(args):
         item.get('gt_num_concepts', 0) for item in results if 'gt_num_concepts' in item
     )
 
-    if total_vlm_num_concepts > 0:
-        average_halusion_score = 1.0 - total_vlm_hallusion_concepts_num / total_vlm_num_concepts
-    else:
-        average_halusion_score = 0.0
-
-    if total_gt_num_concepts > 0:
-        average_quality_score = 1.0 - total_gt_omission_concepts_num / total_gt_num_concepts
-    else:
-        average_quality_score = 0.0
-
-    if (average_halusion_score + average_quality_score) > 0:
-        f_score = 2.0 / (
-            1.0 / average_halusion_score + 1.0 / average_quality_score
-        )
-    else:
-        f_score = 0.0
-
-    summary = {
-        'hallucination_score': average_halusion_score,
-        'recall_score': average_quality_score,
-        'f_score': f_score
-    }
+    summary = aggregate_scores(
+        [total_vlm_num_concepts], [total_vlm_hallusion_concepts_num],
+        [total_gt_num_concepts], [total_gt_omission_concepts_num],
+    )
+    summary['prompts'] = active_prompts(EVAL_PROMPTS)
 
-    with open(args.save_path, "a") as f:
+    with open(save_path, "a") as f:
         f.write(json.dumps(summary) + '\n')
 
-if __name__ == '__main__':
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -703,6 +1271,151 @@ if __name__ == '__main__':
         default="/apdcephfs/csp/mmvision/home/chencong/code/CongEvaluator/data/FinalBench/results/llava/RLAIF-V-7B/eval_llava.jsonl",
         help="Path to save results"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--max_eval",
+        type=int,
+        default=1000,
+        help="Evaluate at most this many images, in file order (see perturbollava.subset for representative subsets)"
+    )
+    parser.add_argument(
+        "--dead_letter_path",
+        type=str,
+        default=None,
+        help="Where to log images whose judge calls failed permanently or exhausted their retries "
+             "(defaults to <save_path>_dead_letter.jsonl)"
+    )
+    parser.add_argument(
+        "--prompt_file",
+        nargs="*",
+        default=[],
+        help="JSON files registering prompt versions: {name: {version: template text}}"
+    )
+    parser.add_argument(
+        "--prompt_versions",
+        nargs="*",
+        default=[],
+        help="Judge prompt versions as name=version (default: extraction=v1, hallucination=v2-json, "
+             "omission=v2-json). Without it, an existing journal is resumed with the versions its images "
+             "were judged with; passing other versions judges its images again"
+    )
+    parser.add_argument(
+        "--graph_store",
+        type=str,
+        default=None,
+        help="Also save the parsed concept graphs of the journal to this .npz (see perturbollava.graph_store)"
+    )
+    parser.add_argument(
+        "--analysis_cache",
+        type=str,
+        default=None,
+        help="SQLite memo of hallucination/omission analyses by graph pair, shared across runs "
+             "(see perturbollava.analysis_cache)"
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only project the tokens, cost and wall-clock of the run"
+    )
+    parser.add_argument(
+        "--max_cost",
+        type=float,
+        default=None,
+        help="Hard budget cap in USD; no new images are scheduled once the projected spend would exceed it"
+    )
+    parser.add_argument(
+        "--caption_templates",
+        nargs="+",
+        default=["auto"],
+        choices=["auto", "none"] + sorted(CAPTION_TEMPLATES),
+        help="Chat templates to strip from VLM captions ('auto' tries all registered ones)"
+    )
+    parser.add_argument(
+        "--strip_boilerplate",
+        action="store_true",
+        help="Drop closing sentences that describe the description rather than the image"
+    )
+    parser.add_argument(
+        "--max_caption_tokens",
+        type=int,
+        default=None,
+        help="Cap VLM captions to this many tokens, cut at a sentence boundary"
+    )
+    parser.add_argument(
+        "--judge_backend",
+        type=str,
+        default="signed",
+        choices=sorted(JUDGE_BACKENDS),
+        help="Judge API: the signed GPT-4o gateway or any OpenAI-compatible server"
+    )
+    parser.add_argument(
+        "--judge_url",
+        type=str,
+        default=None,
+        help="Judge endpoint; for the openai backend the API root, e.g. http://localhost:8000/v1"
+    )
+    parser.add_argument("--judge_api_key", type=str, default=None, help="Bearer token (defaults to $OPENAI_API_KEY)")
+    parser.add_argument("--judge_model", type=str, default="gpt-4o", help="Judge model name")
+    parser.add_argument("--judge_max_tokens", type=int, default=4096, help="Judge completion token limit")
+    parser.add_argument("--judge_temperature", type=float, default=None, help="Judge sampling temperature")
+    parser.add_argument(
+        "--judge_no_response_format",
+        action="store_true",
+        help="Do not send the JSON schema of structured prompts as response_format (for servers that reject it)"
+    )
+    parser.add_argument(
+        "--judge_batch_size",
+        type=int,
+        default=2,
+        help="Independent judge prompts of an image submitted concurrently (1 sends them one by one)"
+    )
+    parser.add_argument("--num_workers", type=int, default=None, help="Worker processes (defaults to the CPU count)")
+    parser.add_argument(
+        "--batch_export",
+        type=str,
+        default=None,
+        help="Write the pending judge calls as a batch API request file instead of calling the judge"
+    )
+    parser.add_argument(
+        "--batch_ingest",
+        type=str,
+        default=None,
+        help="Ingest a batch API response file and journal the images whose answers are complete"
+    )
+    parser.add_argument(
+        "--batch_store",
+        type=str,
+        default=None,
+        help="Answers ingested across batch rounds (defaults to <save_path>_batch_store.jsonl)"
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Evaluate images in random order and stop once --precision or significance is reached"
+    )
+    parser.add_argument("--compare_cap_file_result", type=str, default=None,
+                        help="Second model's caption file; --sequential then bounds the F-score difference")
+    parser.add_argument("--compare_save_path", type=str, default=None, help="Journal of the second model")
+    parser.add_argument("--target_f_score", type=float, default=None,
+                        help="Single model: stop once the F-score is significantly above or below this")
+    parser.add_argument("--precision", type=float, default=None,
+                        help="Stop once the confidence interval half-width is at most this")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Overall significance level of the sequential test")
+    parser.add_argument("--min_images", type=int, default=50, help="Never stop before this many images")
+    parser.add_argument("--sequential_chunk", type=int, default=20, help="Images evaluated between two looks")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random image order")
+    parser.add_argument("--input_price", type=float, default=2.5, help="USD per million input tokens")
+    parser.add_argument("--output_price", type=float, default=10.0, help="USD per million output tokens")
+    parser.add_argument("--requests_per_minute", type=float, default=500, help="Judge API request rate limit")
+    parser.add_argument("--tokens_per_minute", type=float, default=300000, help="Judge API token rate limit")
+    args = parser.parse_args(argv)
+    if args.compare_cap_file_result and not args.compare_save_path:
+        parser.error("--compare_cap_file_result needs --compare_save_path")
+    if args.sequential and args.precision is None and args.target_f_score is None and not args.compare_save_path:
+        parser.error("--sequential needs --precision, --target_f_score or a model to compare against")
+    return args
+
+def cli(argv=None):
+    main(parse_args(argv))
 
-    main(args)
\ No newline at end of file
+if __name__ == '__main__':
+    cli()
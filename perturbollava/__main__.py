@@ -0,0 +1,101 @@
+"""
+One entry point for the pipeline CLIs: `python -m perturbollava <command> [args]`.
+
+Only the module of the chosen command is imported, so listing the commands costs nothing and
+each command pays for its own dependencies only. `bench-startup` times the import of every
+command in a fresh interpreter and fails when one exceeds the startup budget.
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+import subprocess
+
+# command -> (module, entry function taking argv, description)
+COMMANDS = {
+    'eval': ('eval', 'cli', "Judge VLM captions against the ground truth and journal the HalF-Score tuples"),
+    'generate': ('augmentation.generate', 'cli', "Generate perturbation texts with the judge model"),
+    'combine': ('augmentation.combine', 'main', "Mix perturbed records into the original dataset"),
+    'rescore': ('perturbollava.rescore', 'main', "Recompute scores from eval journals without calling the judge"),
+    'images': ('augmentation.image_augment', 'main', "Batched image perturbations in tar shards"),
+    'dedup': ('augmentation.dedup', 'main', "Near-duplicate report for perturbation texts"),
+    'storage': ('augmentation.storage', 'main', "Convert datasets to and from the columnar format"),
+    'batch': ('perturbollava.batch', 'main', "Submit, poll and download batch API request files"),
+    'graph_store': ('perturbollava.graph_store', 'main', "Build and inspect concept graph stores"),
+    'hotspots': ('perturbollava.hotspots', 'main', "Rank the entities models hallucinate or omit most"),
+    'leaderboard': ('perturbollava.leaderboard', 'main', "Leaderboard of scored runs"),
+    'subset': ('perturbollava.subset', 'main', "Select representative evaluation subsets"),
+    'analysis_cache': ('perturbollava.analysis_cache', 'main', "Hit rates and upkeep of the shared analysis memo"),
+}
+# Milliseconds a command may spend importing on top of a bare interpreter.
+STARTUP_BUDGET_MS = 200.0
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_command(name, argv):
+    module_name, function_name, _ = COMMANDS[name]
+    if REPO_ROOT not in sys.path:
+        # eval.py lives at the repository root rather than in a package.
+        sys.path.insert(0, REPO_ROOT)
+    # Usage lines of the command's parser read `python -m perturbollava <command>`.
+    sys.argv = [f"python -m perturbollava {name}"] + list(argv)
+    return getattr(importlib.import_module(module_name), function_name)(argv)
+
+def interpreter_ms(code, repeat):
+    """Median wall-clock milliseconds of `python -c <code>` in a fresh interpreter."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, cwd=REPO_ROOT, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+def bench_startup(commands=None, repeat=5, budget_ms=STARTUP_BUDGET_MS):
+    """
+    Import time of each command's module in a fresh interpreter, net of the interpreter itself.
+
+    Returns:
+        list: Per command dict of command, module, import_ms and within_budget.
+    """
+    baseline = interpreter_ms('pass', repeat)
+    results = []
+    for name in commands or COMMANDS:
+        module_name = COMMANDS[name][0]
+        import_ms = max(interpreter_ms(f'import {module_name}', repeat) - baseline, 0.0)
+        results.append({'command': name, 'module': module_name, 'import_ms': import_ms,
+                        'within_budget': import_ms <= budget_ms})
+    return results
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Everything after the command is parsed by the command itself.
+    if argv and argv[0] in COMMANDS:
+        return run_command(argv[0], argv[1:])
+
+    parser = argparse.ArgumentParser(
+        prog='python -m perturbollava',
+        description="PerturboLLaVA pipeline commands; `<command> --help` shows the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='commands:\n' + '\n'.join(f"  {name:<15} {description}" for name, (_, _, description) in COMMANDS.items())
+        + f"\n  {'bench-startup':<15} Time the imports of the commands against the startup budget")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    bench_parser = subparsers.add_parser('bench-startup', description="Time the imports of the commands in fresh interpreters.")
+    bench_parser.add_argument('commands', nargs='*', help="Commands to time (default: all)")
+    bench_parser.add_argument('--repeat', type=int, default=5, help="Interpreter launches per command (median)")
+    bench_parser.add_argument('--budget_ms', type=float, default=STARTUP_BUDGET_MS,
+                              help="Import time allowed per command on top of a bare interpreter")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.commands if name not in COMMANDS]
+    if unknown:
+        bench_parser.error(f"unknown commands {unknown}, expected some of {sorted(COMMANDS)}")
+
+    results = bench_startup(args.commands, repeat=args.repeat, budget_ms=args.budget_ms)
+    for result in results:
+        status = 'ok' if result['within_budget'] else 'OVER BUDGET'
+        print(f"{result['command']:<15} {result['module']:<28} {result['import_ms']:7.1f} ms  {status}")
+    if not all(result['within_budget'] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
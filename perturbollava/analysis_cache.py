@@ -0,0 +1,144 @@
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY, name TEXT NOT NULL, prompt TEXT NOT NULL, model TEXT,
+    answer TEXT NOT NULL, created REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS lookups (name TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL);
+"""
+
+def canonical_graph(response):
+    """An extracted graph with line endings and runs of whitespace normalized; entry order is kept."""
+    return '\n'.join(' '.join(line.split()) for line in (response or '').splitlines() if line.strip())
+
+def pair_key(prompt_key, model, response_gt, response_vlm):
+    """Hash of everything an analysis answer depends on: prompt version, judge model and the two graphs."""
+    payload = json.dumps([prompt_key, model, canonical_graph(response_gt), canonical_graph(response_vlm)],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class AnalysisCache(object):
+    """
+    Persistent memo of the judge's hallucination and omission analyses, keyed by graph pair.
+
+    An analysis is fully determined by the prompt version, the judge model and the two
+    extracted graphs, so re-evaluating after a crash, re-running a benchmark or evaluating
+    duplicate captions reuses the stored answer instead of calling the judge. Only answers
+    that passed validation should be put.
+
+    The SQLite file can be shared by several runs and users on a local disk: it runs in WAL
+    mode, writers wait for each other up to ``timeout`` and the first answer stored for a
+    key wins. Each process opens its own connection (connections do not survive a fork);
+    threads of a process share it under a lock.
+
+    Args:
+        path (str): Path of the SQLite file; created if missing.
+        timeout (float): Seconds to wait for another writer's lock.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, name, prompt_key, model, response_gt, response_vlm):
+        """The stored answer of an analysis, or None; counts the lookup."""
+        key = pair_key(prompt_key, model, response_gt, response_vlm)
+        with self.lock:
+            row = self.conn.execute('SELECT answer FROM analyses WHERE key = ?', (key,)).fetchone()
+            hit = row is not None
+            if hit:
+                self.hits += 1
+                self.conn.execute('UPDATE analyses SET hits = hits + 1 WHERE key = ?', (key,))
+            else:
+                self.misses += 1
+            self.conn.execute('INSERT INTO lookups VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET '
+                              'hits = hits + excluded.hits, misses = misses + excluded.misses',
+                              (name, int(hit), int(not hit)))
+        return row[0] if hit else None
+
+    def put(self, name, prompt_key, model, response_gt, response_vlm, answer):
+        """Store an answer; a concurrent writer's answer for the same key is kept."""
+        key = pair_key(prompt_key, model, response_gt, response_vlm)
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO analyses (key, name, prompt, model, answer, created) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', (key, name, prompt_key, model, answer, time.time()))
+
+    def stats(self):
+        """
+        Hit-rate statistics of all runs that used the file, per analysis and overall.
+
+        Returns:
+            dict: 'analyses' (per name: lookups, hits, hit_rate, entries), 'total' (the same
+                summed) and 'process' (hits and misses of this connection).
+        """
+        entries = dict(self.conn.execute('SELECT name, COUNT(*) FROM analyses GROUP BY name'))
+        lookups = {name: (hits, misses) for name, hits, misses in self.conn.execute('SELECT name, hits, misses FROM lookups')}
+        analyses = {}
+        for name in sorted(set(entries) | set(lookups)):
+            hits, misses = lookups.get(name, (0, 0))
+            analyses[name] = {'lookups': hits + misses, 'hits': hits,
+                              'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                              'entries': entries.get(name, 0)}
+        total_lookups = sum(row['lookups'] for row in analyses.values())
+        total_hits = sum(row['hits'] for row in analyses.values())
+        return {
+            'analyses': analyses,
+            'total': {'lookups': total_lookups, 'hits': total_hits,
+                      'hit_rate': total_hits / total_lookups if total_lookups else 0.0,
+                      'entries': sum(row['entries'] for row in analyses.values())},
+            'process': {'hits': self.hits, 'misses': self.misses},
+        }
+
+    def prompts(self):
+        """Entries and reuses per prompt version."""
+        return [{'prompt': prompt, 'model': model, 'entries': entries, 'hits': hits}
+                for prompt, model, entries, hits in self.conn.execute(
+                    'SELECT prompt, model, COUNT(*), SUM(hits) FROM analyses GROUP BY prompt, model ORDER BY prompt, model')]
+
+    def prune(self, keep_prompts):
+        """Drop the answers of prompt versions not in keep_prompts; returns the number dropped."""
+        keep = list(keep_prompts)
+        placeholders = ', '.join('?' for _ in keep)
+        query = f'DELETE FROM analyses WHERE prompt NOT IN ({placeholders})' if keep else 'DELETE FROM analyses'
+        return self.conn.execute(query, keep).rowcount
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the shared memo of judge analyses (eval.py --analysis_cache).")
+    parser.add_argument('path', help="SQLite file of the memo")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="Hit rates per analysis and overall, as JSON")
+    subparsers.add_parser('prompts', help="Entries and reuses per prompt version")
+    prune_parser = subparsers.add_parser('prune', help="Drop the answers of other prompt versions")
+    prune_parser.add_argument('keep', nargs='*', help="Prompt keys to keep, e.g. hallucination@v2-json:<digest>")
+    args = parser.parse_args(argv)
+
+    cache = AnalysisCache(args.path)
+    try:
+        if args.command == 'stats':
+            stats = cache.stats()
+            stats.pop('process')
+            print(json.dumps(stats, indent=2))
+        elif args.command == 'prompts':
+            for row in cache.prompts():
+                print(json.dumps(row))
+        elif args.command == 'prune':
+            print(f"Dropped {cache.prune(args.keep)} answers.")
+    finally:
+        cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import argparse
+
+from perturbollava.budget import DEFAULT_PRICING, sum_usage, usage_cost
+from perturbollava.judge import JUDGE_BACKENDS, build_judge_backend
+from perturbollava.retry import DEFAULT_RETRY_POLICY, RetryError, describe_error
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+# Batch jobs are billed at half the synchronous price.
+BATCH_DISCOUNT = 0.5
+
+def batch_request(custom_id, body):
+    """One line of a batch request file in the OpenAI Batch API format."""
+    return {'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': body}
+
+def write_batch_requests(path, batch_requests):
+    """Write (custom_id, body) pairs as a batch request file; returns the number written."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, body in batch_requests:
+            f.write(json.dumps(batch_request(custom_id, body), ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def parse_batch_response(record):
+    """
+    Turn one line of a batch response file into a store entry.
+
+    Returns:
+        dict: custom_id, response and usage, or custom_id and error for failed requests.
+    """
+    custom_id = record['custom_id']
+    response = record.get('response') or {}
+    body = response.get('body') or {}
+    if record.get('error') or response.get('status_code', 200) != 200 or not body.get('choices'):
+        error = record.get('error') or body.get('error') or f"status {response.get('status_code')}"
+        return {'custom_id': custom_id, 'error': error if isinstance(error, str) else json.dumps(error)}
+    return {'custom_id': custom_id, 'response': body['choices'][0]['message']['content'], 'usage': body.get('usage')}
+
+class BatchStore(object):
+    """
+    Append-only JSON Lines file of the batch answers ingested so far, keyed by custom id.
+
+    Multi-turn work (the judge's analyses need both extracted graphs, the second generation
+    turn needs the first answer) runs as several export/ingest rounds; the store carries the
+    answers between rounds. A later successful answer replaces an earlier error.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            for entry in read_jsonl(path):
+                self.add(entry)
+
+    def add(self, entry):
+        current = self.entries.get(entry['custom_id'])
+        if current is None or 'error' in current or 'error' not in entry:
+            self.entries[entry['custom_id']] = entry
+
+    def answer(self, custom_id):
+        """The response text of a custom id, or None if it is missing or failed."""
+        entry = self.entries.get(custom_id)
+        if entry is None or 'error' in entry:
+            return None
+        return entry['response']
+
+    def ingest(self, response_path):
+        """
+        Append the answers of a batch response file.
+
+        Returns:
+            dict: Number of answers and errors ingested, their usage and discounted cost, and
+                the errors by custom id under 'failed'.
+        """
+        entries = [parse_batch_response(record) for record in read_jsonl(response_path)]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                self.add(entry)
+        usage = sum_usage(*[entry.get('usage') for entry in entries])
+        return {
+            'answers': sum('error' not in entry for entry in entries),
+            'errors': sum('error' in entry for entry in entries),
+            'usage': usage,
+            'cost_usd': round(usage_cost(usage, DEFAULT_PRICING) * BATCH_DISCOUNT, 4),
+            'failed': {entry['custom_id']: entry['error'] for entry in entries if 'error' in entry},
+        }
+
+def run_local(request_path, response_path, backend, retry_policy=DEFAULT_RETRY_POLICY):
+    """
+    File-based stand-in for a batch job: answer every request with a judge backend and write
+    a response file in the Batch API format.
+    """
+    with open(response_path, 'w', encoding='utf-8') as f:
+        for index, record in enumerate(read_jsonl(request_path)):
+            body = record['body']
+            line = {'id': f'local-{index}', 'custom_id': record['custom_id'], 'response': None, 'error': None}
+            try:
+                output = retry_policy.call(backend, body['messages'], body.get('response_format'))
+                line['response'] = {'status_code': 200, 'body': {
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': output['response']}}],
+                    'usage': output.get('usage'),
+                }}
+            except RetryError as e:
+                line['error'] = describe_error(e)
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+class OpenAIBatchClient(object):
+    """
+    Submit a request file to an OpenAI-compatible Batch API, poll it and download the results.
+
+    Args:
+        base_url (str): API root, e.g. https://api.openai.com/v1.
+        api_key (str or None): Bearer token; defaults to $OPENAI_API_KEY.
+    """
+
+    def __init__(self, base_url='https://api.openai.com/v1', api_key=None, timeout=DEFAULT_RETRY_POLICY.call_timeout):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': f"Bearer {api_key or os.environ.get('OPENAI_API_KEY', '')}"}
+        self.timeout = timeout
+
+    def request(self, method, path, **kwargs):
+        import requests
+        response = requests.request(method, self.base_url + path, headers=self.headers, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def submit(self, request_path, completion_window='24h'):
+        with open(request_path, 'rb') as f:
+            input_file = self.request('POST', '/files', data={'purpose': 'batch'}, files={'file': f}).json()
+        batch = self.request('POST', '/batches', json={
+            'input_file_id': input_file['id'],
+            'endpoint': BATCH_ENDPOINT,
+            'completion_window': completion_window,
+        }).json()
+        return batch['id']
+
+    def status(self, batch_id):
+        return DEFAULT_RETRY_POLICY.call(self.request, 'GET', f'/batches/{batch_id}').json()
+
+    def wait(self, batch_id, response_path, poll_interval=60.0):
+        """
+        Poll until the batch ends and download its output and error files into one response file.
+
+        Returns:
+            dict: The final batch object.
+        """
+        while True:
+            batch = self.status(batch_id)
+            if batch['status'] in ('completed', 'failed', 'expired', 'cancelled'):
+                break
+            print(f"Batch {batch_id} is {batch['status']}: {batch.get('request_counts')}")
+            time.sleep(poll_interval)
+        with open(response_path, 'wb') as f:
+            for key in ('output_file_id', 'error_file_id'):
+                if batch.get(key):
+                    f.write(DEFAULT_RETRY_POLICY.call(self.request, 'GET', f"/files/{batch[key]}/content").content)
+        return batch
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run batch request files exported by eval.py or generate.py.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    submit_parser = subparsers.add_parser('submit', help="Upload a request file and start a batch job")
+    submit_parser.add_argument('request_path')
+    wait_parser = subparsers.add_parser('wait', help="Poll a batch job and download its response file")
+    wait_parser.add_argument('batch_id')
+    wait_parser.add_argument('response_path')
+    wait_parser.add_argument('--poll_interval', type=float, default=60.0)
+    for sub in (submit_parser, wait_parser):
+        sub.add_argument('--base_url', default='https://api.openai.com/v1')
+        sub.add_argument('--api_key', default=None)
+    local_parser = subparsers.add_parser('run_local', help="Answer a request file locally with a judge backend")
+    local_parser.add_argument('request_path')
+    local_parser.add_argument('response_path')
+    local_parser.add_argument('--backend', choices=sorted(JUDGE_BACKENDS), default='openai')
+    local_parser.add_argument('--base_url', default='http://localhost:8000/v1')
+    local_parser.add_argument('--model', default=None, help="Override the model of the requests")
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        print(OpenAIBatchClient(args.base_url, args.api_key).submit(args.request_path))
+    elif args.command == 'wait':
+        batch = OpenAIBatchClient(args.base_url, args.api_key).wait(args.batch_id, args.response_path, args.poll_interval)
+        print(json.dumps({key: batch.get(key) for key in ('id', 'status', 'request_counts')}))
+    elif args.command == 'run_local':
+        first = next(read_jsonl(args.request_path), None)
+        model = args.model or (first['body'].get('model') if first else None) or 'gpt-4o'
+        kwargs = {'model': model}
+        if args.backend == 'openai':
+            kwargs['base_url'] = args.base_url
+        run_local(args.request_path, args.response_path, build_judge_backend(args.backend, **kwargs))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import re
+import math
+import struct
+import threading
+from collections import namedtuple
+
+# USD per million tokens; defaults are gpt-4o list prices.
+Pricing = namedtuple('Pricing', ['input_per_million', 'output_per_million'])
+RateLimits = namedtuple('RateLimits', ['requests_per_minute', 'tokens_per_minute'])
+
+DEFAULT_PRICING = Pricing(input_per_million=2.5, output_per_million=10.0)
+DEFAULT_RATE_LIMITS = RateLimits(requests_per_minute=500, tokens_per_minute=300000)
+
+_APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+
+def count_tokens(text):
+    """
+    Count the tokens of a text locally.
+
+    Uses tiktoken's o200k_base encoding when the optional tiktoken package is installed,
+    otherwise approximates with one token per word/punctuation mark plus one per 5 characters
+    of long words.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return sum(1 + len(piece) // 5 for piece in _APPROX_TOKEN_PATTERN.findall(text))
+
+def image_size(image_path):
+    """
+    Read the (width, height) of a JPEG or PNG image from its header.
+
+    Returns:
+        tuple or None: The size, or None if the file is missing or not a JPEG/PNG.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            head = f.read(26)
+            if head[:8] == b'\x89PNG\r\n\x1a\n':
+                return struct.unpack('>II', head[16:24])
+            if head[:2] != b'\xff\xd8':
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = struct.unpack('>H', f.read(2))[0]
+                # Start-of-frame markers carry the image size.
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+    except (OSError, struct.error):
+        return None
+
+def image_tokens(size, detail='high'):
+    """
+    Estimate the input tokens of an image the way gpt-4o bills them.
+
+    High detail images are fit into 2048x2048, scaled so the short side is at most 768,
+    and billed 85 tokens plus 170 per 512x512 tile. Unknown sizes count as 1024x1024.
+    """
+    if detail == 'low':
+        return 85
+    width, height = size or (1024, 1024)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+class CostEstimate(object):
+    """Accumulate projected requests and tokens and turn them into cost and wall-clock figures."""
+
+    def __init__(self, pricing=DEFAULT_PRICING, rate_limits=DEFAULT_RATE_LIMITS):
+        self.pricing = pricing
+        self.rate_limits = rate_limits
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.image_tokens = 0
+
+    def add_call(self, input_tokens, output_tokens, image_tokens=0):
+        self.requests += 1
+        self.input_tokens += input_tokens + image_tokens
+        self.output_tokens += output_tokens
+        self.image_tokens += image_tokens
+
+    def cost(self):
+        return (self.input_tokens * self.pricing.input_per_million
+                + self.output_tokens * self.pricing.output_per_million) / 1e6
+
+    def wall_clock_seconds(self):
+        total_tokens = self.input_tokens + self.output_tokens
+        minutes = max(self.requests / self.rate_limits.requests_per_minute,
+                      total_tokens / self.rate_limits.tokens_per_minute)
+        return minutes * 60
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'input_tokens': self.input_tokens,
+            'image_tokens': self.image_tokens,
+            'output_tokens': self.output_tokens,
+            'cost_usd': round(self.cost(), 4),
+            'wall_clock_hours': round(self.wall_clock_seconds() / 3600, 3),
+        }
+
+def call_cost(input_tokens, output_tokens, pricing=DEFAULT_PRICING):
+    return (input_tokens * pricing.input_per_million + output_tokens * pricing.output_per_million) / 1e6
+
+def usage_cost(usage, pricing=DEFAULT_PRICING):
+    """Cost of an OpenAI-style usage dict (prompt_tokens/completion_tokens)."""
+    return call_cost(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), pricing)
+
+def sum_usage(*usages):
+    """Add up the numeric fields of several usage dicts, ignoring missing ones."""
+    total = {}
+    for usage in usages:
+        if not isinstance(usage, dict):
+            continue
+        for key, value in usage.items():
+            if isinstance(value, (int, float)):
+                total[key] = total.get(key, 0) + value
+    return total
+
+class BudgetGovernor(object):
+    """
+    Hard spending cap for a run.
+
+    Work is reserved at its projected cost before it is scheduled and settled with the actual
+    cost when known. Once a reservation would push the projected spend over the cap, the
+    governor refuses it and every later one, so the run stops scheduling new work.
+
+    Args:
+        max_cost (float or None): Cap in USD; None disables the cap.
+    """
+
+    def __init__(self, max_cost=None):
+        self.max_cost = max_cost
+        self.projected = 0.0
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def reserve(self, cost):
+        with self.lock:
+            if self.exhausted:
+                return False
+            if self.max_cost is not None and self.projected + cost > self.max_cost:
+                self.exhausted = True
+                print(f"Budget cap of ${self.max_cost:.2f} reached (projected ${self.projected:.2f}), "
+                      f"no new work is scheduled.")
+                return False
+            self.projected += cost
+            return True
+
+    def fits(self, cost):
+        """Whether a reservation of cost would be accepted now, without making it."""
+        with self.lock:
+            return not self.exhausted and (self.max_cost is None or self.projected + cost <= self.max_cost)
+
+    def settle(self, reserved, actual):
+        with self.lock:
+            self.projected += actual - reserved
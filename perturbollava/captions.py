@@ -0,0 +1,138 @@
+import re
+from collections import namedtuple
+
+from perturbollava.budget import count_tokens
+
+# A caption template is a regex matching chat-template scaffolding a model left in its output;
+# every match is removed.
+CaptionTemplate = namedtuple('CaptionTemplate', ['name', 'pattern'])
+
+CAPTION_TEMPLATES = {}
+
+def register_caption_template(name, pattern, flags=re.DOTALL):
+    """
+    Register the chat-template scaffolding of a model so it is stripped before judging.
+
+    Args:
+        name (str): Template name used to select the stripper.
+        pattern (str): Regex of the scaffolding; all matches are removed.
+
+    Returns:
+        CaptionTemplate: The registered template.
+    """
+    caption_template = CaptionTemplate(name, re.compile(pattern, flags))
+    CAPTION_TEMPLATES[name] = caption_template
+    return caption_template
+
+# Idefics3: "User:<image>Please describe this image in detail.\nAssistant: ..."
+register_caption_template("idefics3", r"^\s*User:.*?\bAssistant:\s*|<end_of_utterance>")
+# Vicuna-style prompts used by LLaVA-1.5.
+register_caption_template("vicuna", r"^\s*USER:.*?\bASSISTANT:\s*|</s>")
+# ChatML (Qwen2-VL, InternVL2, llava-onevision).
+register_caption_template("chatml", r"<\|im_start\|>(?:system|user).*?<\|im_end\|>\s*|<\|im_start\|>assistant\s*|<\|im_end\|>|<\|endoftext\|>")
+# Llama-2 chat.
+register_caption_template("llama2", r"^\s*(?:<s>)?\s*\[INST\].*?\[/INST\]\s*|</s>")
+
+# Closing sentences that describe the description rather than the image; they add no concepts
+# but cost judge tokens and occasionally get extracted as spurious ones.
+BOILERPLATE_PATTERNS = [
+    re.compile(r"^(?:This|The above|Overall, this) (?:detailed )?(?:description|analysis)\b.*\b(?:pure text model|"
+               r"comprehensive (?:understanding|overview)|answer (?:any )?(?:image-related )?questions)\b", re.IGNORECASE),
+]
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+def flatten_caption(caption):
+    """Turn a caption stored as a (possibly nested) list of generations into one string."""
+    if caption is None:
+        return ''
+    if isinstance(caption, (list, tuple)):
+        return '\n'.join(part for part in (flatten_caption(item) for item in caption) if part)
+    return str(caption)
+
+def normalize_whitespace(text):
+    lines = [' '.join(line.split()) for line in text.strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+def strip_boilerplate(text):
+    """Drop trailing sentences matching BOILERPLATE_PATTERNS."""
+    paragraphs = text.split('\n')
+    while paragraphs:
+        sentences = SENTENCE_PATTERN.split(paragraphs[-1].strip())
+        while sentences and any(pattern.search(sentences[-1]) for pattern in BOILERPLATE_PATTERNS):
+            sentences.pop()
+        paragraphs[-1] = ' '.join(sentences)
+        if paragraphs[-1].strip():
+            break
+        paragraphs.pop()
+    return '\n'.join(paragraphs).strip()
+
+def cap_tokens(text, max_tokens):
+    """Keep whole sentences from the start of the text while they fit in max_tokens."""
+    kept, total = [], 0
+    for sentence in SENTENCE_PATTERN.split(text):
+        tokens = count_tokens(sentence)
+        if kept and total + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        total += tokens
+    return ' '.join(kept)
+
+class CaptionNormalizer(object):
+    """
+    Clean VLM captions before they are sent to the judge, and count the tokens saved.
+
+    Captions are flattened to a string, stripped of chat-template scaffolding, whitespace is
+    collapsed, and optionally closing boilerplate is dropped and the length is capped.
+
+    Args:
+        templates (str or list): 'auto' strips every registered template, 'none' none; otherwise
+            names of registered templates.
+        strip_boilerplate (bool): Drop closing sentences that describe the description itself.
+        max_tokens (int or None): Cap on caption length, cut at a sentence boundary.
+    """
+
+    def __init__(self, templates='auto', strip_boilerplate=False, max_tokens=None):
+        if templates == 'auto':
+            templates = list(CAPTION_TEMPLATES)
+        elif templates in (None, 'none'):
+            templates = []
+        elif isinstance(templates, str):
+            templates = [templates]
+        unknown = [name for name in templates if name not in CAPTION_TEMPLATES]
+        if unknown:
+            raise ValueError(f"Unknown caption templates {unknown}, expected some of {sorted(CAPTION_TEMPLATES)}")
+        self.templates = [CAPTION_TEMPLATES[name] for name in templates]
+        self.strip_boilerplate = strip_boilerplate
+        self.max_tokens = max_tokens
+        self.captions = 0
+        self.changed = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def __call__(self, caption):
+        raw = flatten_caption(caption)
+        text = raw
+        for caption_template in self.templates:
+            text = caption_template.pattern.sub('', text)
+        text = normalize_whitespace(text)
+        if self.strip_boilerplate:
+            text = strip_boilerplate(text)
+        if self.max_tokens:
+            text = cap_tokens(text, self.max_tokens)
+        self.captions += 1
+        self.changed += text != raw
+        self.tokens_before += count_tokens(raw)
+        self.tokens_after += count_tokens(text)
+        return text
+
+    def report(self):
+        saved = self.tokens_before - self.tokens_after
+        return {
+            'captions': self.captions,
+            'captions_changed': self.changed,
+            'caption_tokens_before': self.tokens_before,
+            'caption_tokens_after': self.tokens_after,
+            'caption_tokens_saved': saved,
+            'caption_tokens_saved_pct': round(100.0 * saved / self.tokens_before, 2) if self.tokens_before else 0.0,
+        }
@@ -0,0 +1,279 @@
+import os
+import glob
+import json
+import argparse
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from perturbollava.rescore import load_journal
+from perturbollava.scoring import parse_analysis, parse_graph
+
+SIDES = ('gt', 'vlm')
+KINDS = ('object', 'relationship')
+# Relationship strengths are meant to be 1-10; larger values the judge writes are clipped to the int16 column.
+MAX_STRENGTH = np.iinfo(np.int16).max
+
+def normalize_name(name):
+    return ' '.join(name.strip().strip('"').split()).upper()
+
+class Interner(object):
+    """Assigns consecutive ids to strings; the id table is shared by all graphs of a store."""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = {value: i for i, value in enumerate(self.values)}
+
+    def __call__(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def array(self):
+        return np.array(self.values, dtype=str)
+
+def flagged_serials(record, side):
+    """Serial numbers the judge flagged: omitted GT entries or hallucinated VLM entries."""
+    analysis_key, idx_key = {
+        'gt': ('omission_caption_analysis_list', 'gt_omission_concepts_idx'),
+        'vlm': ('hallucination_analysis_list', 'hallusion_concepts_idx'),
+    }[side]
+    if idx_key in record:
+        return set(record[idx_key])
+    return set(parse_analysis(record.get(analysis_key)))
+
+class GraphStore(object):
+    """
+    Parsed concept graphs of eval journals in compact columnar arrays.
+
+    There is one graph per (run, image, side), where side is 'gt' or 'vlm'. Its entries,
+    one per numbered tuple, are stored contiguously; graph g owns entries
+    entry_offsets[g]:entry_offsets[g + 1]. An entry is an object (src = object, dst = -1,
+    text = attribute) or a relationship (src -> dst, text = description, strength).
+    Entity names and texts are interned across the whole store, so per-entity questions
+    are bincounts over entry_src. entry_flag marks the entries the judge flagged:
+    omitted on the GT side, hallucinated on the VLM side.
+    """
+
+    ARRAYS = ('graph_run', 'graph_image', 'graph_side', 'entry_offsets', 'entry_serial', 'entry_kind',
+              'entry_src', 'entry_dst', 'entry_text', 'entry_strength', 'entry_flag')
+    TABLES = ('runs', 'images', 'names', 'texts')
+
+    def __init__(self, **arrays):
+        for key in self.ARRAYS + self.TABLES:
+            setattr(self, key, arrays[key])
+        self._run_ids = {run: i for i, run in enumerate(self.runs)}
+        self._image_ids = {image: i for i, image in enumerate(self.images)}
+
+    @classmethod
+    def from_journals(cls, journals):
+        """
+        Build a store from eval journals.
+
+        Args:
+            journals (dict): Run name -> list of journal records (see rescore.load_journal).
+        """
+        runs, images, names, texts = Interner(), Interner(), Interner(), Interner()
+        columns = {key: [] for key in cls.ARRAYS}
+        columns['entry_offsets'].append(0)
+        for run, records in journals.items():
+            run_id = runs(run)
+            for record in records:
+                image_id = images(record['image'])
+                for side_id, side in enumerate(SIDES):
+                    flagged = flagged_serials(record, side)
+                    for entry in parse_graph(record.get('response_' + side) or ''):
+                        fields = entry.fields + [''] * (3 - len(entry.fields))
+                        if entry.kind == 'relationship':
+                            kind, dst, text = 1, names(normalize_name(fields[1])), texts(fields[2].strip())
+                            strength = min(int(fields[3]), MAX_STRENGTH) if len(fields) > 3 and fields[3].strip().isdigit() else -1
+                        else:
+                            kind, dst, text, strength = 0, -1, texts(', '.join(f.strip() for f in entry.fields[1:])), -1
+                        columns['entry_serial'].append(entry.serial)
+                        columns['entry_kind'].append(kind)
+                        columns['entry_src'].append(names(normalize_name(fields[0])))
+                        columns['entry_dst'].append(dst)
+                        columns['entry_text'].append(text)
+                        columns['entry_strength'].append(strength)
+                        columns['entry_flag'].append(entry.serial in flagged)
+                    columns['graph_run'].append(run_id)
+                    columns['graph_image'].append(image_id)
+                    columns['graph_side'].append(side_id)
+                    columns['entry_offsets'].append(len(columns['entry_serial']))
+        dtypes = {'entry_kind': np.int8, 'entry_strength': np.int16, 'entry_flag': bool, 'graph_side': np.int8}
+        arrays = {key: np.array(values, dtype=dtypes.get(key, np.int32)) for key, values in columns.items()}
+        arrays['entry_offsets'] = arrays['entry_offsets'].astype(np.int64)
+        return cls(runs=runs.array(), images=images.array(), names=names.array(), texts=texts.array(), **arrays)
+
+    def save(self, path):
+        np.savez_compressed(path, **{key: getattr(self, key) for key in self.ARRAYS + self.TABLES})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{key: data[key] for key in cls.ARRAYS + cls.TABLES})
+
+    def __len__(self):
+        return len(self.graph_run)
+
+    def find(self, run, image, side):
+        """Index of the graph of an image in a run, or None."""
+        run_id, image_id = self._run_ids.get(run), self._image_ids.get(image)
+        if run_id is None or image_id is None:
+            return None
+        matches = np.flatnonzero((self.graph_run == run_id) & (self.graph_image == image_id)
+                                 & (self.graph_side == SIDES.index(side)))
+        return int(matches[0]) if len(matches) else None
+
+    def entry_graph(self):
+        """Graph index of every entry."""
+        return np.repeat(np.arange(len(self)), np.diff(self.entry_offsets))
+
+    def entity_counts(self, side=None, kind='object', flagged=None, run=None):
+        """
+        How often each interned entity occurs, as a bincount over entry_src.
+
+        Args:
+            side (str or None): 'gt', 'vlm' or both.
+            kind (str or None): 'object', 'relationship' or both.
+            flagged (bool or None): Only flagged (omitted/hallucinated) or unflagged entries.
+            run (str or None): Only this run.
+
+        Returns:
+            np.ndarray: Count per name id.
+        """
+        graph_mask = np.ones(len(self), dtype=bool)
+        if side is not None:
+            graph_mask &= self.graph_side == SIDES.index(side)
+        if run is not None:
+            graph_mask &= self.graph_run == self._run_ids.get(run, -1)
+        mask = graph_mask[self.entry_graph()]
+        if kind is not None:
+            mask &= self.entry_kind == KINDS.index(kind)
+        if flagged is not None:
+            mask &= self.entry_flag == flagged
+        return np.bincount(self.entry_src[mask], minlength=len(self.names))
+
+    def top_entities(self, k=20, **filters):
+        """The k most frequent entity names under entity_counts filters, with their rates."""
+        flagged = self.entity_counts(**dict(filters, flagged=True))
+        total = self.entity_counts(**dict(filters, flagged=None))
+        order = np.argsort(-flagged, kind='stable')[:k]
+        return [{'name': str(self.names[i]), 'flagged': int(flagged[i]), 'total': int(total[i]),
+                 'rate': float(flagged[i] / total[i]) if total[i] else 0.0}
+                for i in order if flagged[i] > 0]
+
+    def graph_entries(self, graph):
+        start, end = self.entry_offsets[graph], self.entry_offsets[graph + 1]
+        return range(start, end)
+
+    def to_json_graph(self, graph):
+        """One graph in JSON Graph Format (jsongraphformat.info)."""
+        nodes, edges = {}, []
+        for e in self.graph_entries(graph):
+            src = str(self.names[self.entry_src[e]])
+            node = nodes.setdefault(src, {'label': src, 'metadata': {'attributes': [], 'serials': [], 'flagged': False}})
+            if self.entry_kind[e] == 0:
+                node['metadata']['attributes'].append(str(self.texts[self.entry_text[e]]))
+                node['metadata']['serials'].append(int(self.entry_serial[e]))
+                node['metadata']['flagged'] |= bool(self.entry_flag[e])
+                continue
+            dst = str(self.names[self.entry_dst[e]])
+            nodes.setdefault(dst, {'label': dst, 'metadata': {'attributes': [], 'serials': [], 'flagged': False}})
+            edges.append({'source': src, 'target': dst, 'relation': str(self.texts[self.entry_text[e]]),
+                          'metadata': {'strength': int(self.entry_strength[e]), 'serial': int(self.entry_serial[e]),
+                                       'flagged': bool(self.entry_flag[e])}})
+        return {'graph': {
+            'directed': True,
+            'label': f"{self.runs[self.graph_run[graph]]}/{self.images[self.graph_image[graph]]}/{SIDES[self.graph_side[graph]]}",
+            'nodes': nodes,
+            'edges': edges,
+        }}
+
+    def write_graphml(self, graph, path):
+        """Write one graph as GraphML, readable by networkx, Gephi and yEd."""
+        json_graph = self.to_json_graph(graph)['graph']
+        root = ET.Element('graphml', xmlns='http://graphml.graphdrawing.org/xmlns')
+        for key_id, target, name, key_type in (('d0', 'node', 'attributes', 'string'), ('d1', 'node', 'flagged', 'boolean'),
+                                                ('d2', 'edge', 'relation', 'string'), ('d3', 'edge', 'strength', 'int'),
+                                                ('d4', 'edge', 'flagged', 'boolean')):
+            ET.SubElement(root, 'key', {'id': key_id, 'for': target, 'attr.name': name, 'attr.type': key_type})
+        element = ET.SubElement(root, 'graph', id=json_graph['label'], edgedefault='directed')
+        for node_id, node in json_graph['nodes'].items():
+            node_element = ET.SubElement(element, 'node', id=node_id)
+            ET.SubElement(node_element, 'data', key='d0').text = '; '.join(node['metadata']['attributes'])
+            ET.SubElement(node_element, 'data', key='d1').text = str(node['metadata']['flagged']).lower()
+        for edge in json_graph['edges']:
+            edge_element = ET.SubElement(element, 'edge', source=edge['source'], target=edge['target'])
+            ET.SubElement(edge_element, 'data', key='d2').text = edge['relation']
+            ET.SubElement(edge_element, 'data', key='d3').text = str(edge['metadata']['strength'])
+            ET.SubElement(edge_element, 'data', key='d4').text = str(edge['metadata']['flagged']).lower()
+        ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+def collect_journals(paths, results_dir=None):
+    """
+    Load eval journals from files and directories (searched recursively for *.jsonl).
+
+    Returns:
+        dict: Run name (path below results_dir, without extension) -> records. Files that are
+            not eval journals are skipped.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', '*.jsonl'), recursive=True)))
+        else:
+            files.append(path)
+    journals = {}
+    for path in files:
+        records = load_journal(path)
+        if records:
+            base = results_dir or os.path.dirname(path)
+            journals[os.path.splitext(os.path.relpath(path, base))[0]] = records
+    return journals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, query and export the concept-graph store of eval journals.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Parse journals into a graph store (.npz)")
+    build_parser.add_argument('paths', nargs='+', help="Journals or result directories")
+    build_parser.add_argument('--results_dir', default=None, help="Run names are paths below this directory")
+    build_parser.add_argument('--output', required=True)
+    top_parser = subparsers.add_parser('top', help="Most often flagged entities")
+    top_parser.add_argument('store')
+    top_parser.add_argument('--side', choices=SIDES, default='gt', help="gt: omitted, vlm: hallucinated")
+    top_parser.add_argument('--kind', choices=KINDS, default='object')
+    top_parser.add_argument('--run', default=None)
+    top_parser.add_argument('-k', type=int, default=20)
+    export_parser = subparsers.add_parser('export', help="Export one graph")
+    export_parser.add_argument('store')
+    export_parser.add_argument('run')
+    export_parser.add_argument('image')
+    export_parser.add_argument('--side', choices=SIDES, default='vlm')
+    export_parser.add_argument('--format', choices=['json', 'graphml'], default='json')
+    export_parser.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        store = GraphStore.from_journals(collect_journals(args.paths, args.results_dir))
+        store.save(args.output)
+        print(json.dumps({'runs': len(store.runs), 'graphs': len(store), 'entries': len(store.entry_serial),
+                          'names': len(store.names), 'texts': len(store.texts)}))
+    elif args.command == 'top':
+        for row in GraphStore.load(args.store).top_entities(args.k, side=args.side, kind=args.kind, run=args.run):
+            print(json.dumps(row))
+    elif args.command == 'export':
+        store = GraphStore.load(args.store)
+        graph = store.find(args.run, args.image, args.side)
+        if graph is None:
+            parser.error(f"No {args.side} graph of {args.image} in run {args.run}")
+        if args.format == 'graphml':
+            store.write_graphml(graph, args.output)
+        else:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(store.to_json_graph(graph), f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import re
+import json
+import argparse
+
+import numpy as np
+
+from perturbollava.graph_store import SIDES, GraphStore, collect_journals
+
+# Categories of hallucination_results.json.
+CATEGORIES = ('object', 'attribute', 'counting', 'position', 'relationship')
+
+COUNTING_PATTERN = re.compile(
+    r"\b(?:\d+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|dozens?|several|many|few|"
+    r"multiple|numerous|single|pair|couple|both|a lot of|lots of)\b", re.IGNORECASE)
+POSITION_PATTERN = re.compile(
+    r"\b(?:left|right|top|bottom|behind|front|back|above|below|under|over|beneath|near|next to|beside|between|"
+    r"middle|center|centre|foreground|background|corner|side|edge|inside|outside|around|along|across)\b",
+    re.IGNORECASE)
+ARTICLE_PATTERN = re.compile(r"^(?:a|an|the|some)\s+")
+
+def normalize_entity(name):
+    """Lower-case, drop a leading article and singularize the last word of an entity name."""
+    words = ARTICLE_PATTERN.sub('', ' '.join(name.lower().split())).split()
+    if not words:
+        return ''
+    last = words[-1]
+    if last.endswith('ies') and len(last) > 4:
+        last = last[:-3] + 'y'
+    elif last.endswith(('ches', 'shes', 'sses', 'xes')):
+        last = last[:-2]
+    elif last.endswith('s') and not last.endswith(('ss', 'us', 'is')) and len(last) > 3:
+        last = last[:-1]
+    return ' '.join(words[:-1] + [last])
+
+def attribute_category(text):
+    """Category of a wrong attribute: counting, position or (other) attribute."""
+    if COUNTING_PATTERN.search(text):
+        return CATEGORIES.index('counting')
+    if POSITION_PATTERN.search(text):
+        return CATEGORIES.index('position')
+    return CATEGORIES.index('attribute')
+
+def group_count(keys, weights=None, minlength=0):
+    """Vectorized group-by count (or weighted sum) over non-negative integer keys."""
+    return np.bincount(keys, weights=weights, minlength=minlength)
+
+def entry_categories(store):
+    """
+    Category of every entry of the store.
+
+    Relationships are 'relationship'. An object entry is an 'object' error when every entry
+    of its entity in that graph is flagged (the object itself is wrong), otherwise an error
+    of the attribute it states, split into counting, position and attribute by keywords.
+    """
+    graph = store.entry_graph()
+    num_names = len(store.names)
+    key = graph.astype(np.int64) * num_names + store.entry_src
+    is_object = store.entry_kind == 0
+    unique_keys, inverse = np.unique(key[is_object], return_inverse=True)
+    flagged_per_key = group_count(inverse, store.entry_flag[is_object].astype(np.float64), len(unique_keys))
+    total_per_key = group_count(inverse, minlength=len(unique_keys))
+    whole_object = np.zeros(len(key), dtype=bool)
+    whole_object[is_object] = (flagged_per_key == total_per_key)[inverse]
+
+    text_categories = np.array([attribute_category(text) for text in store.texts], dtype=np.int8)
+    categories = np.full(len(key), CATEGORIES.index('relationship'), dtype=np.int8)
+    if len(text_categories):
+        categories[is_object] = text_categories[store.entry_text[is_object]]
+    categories[is_object & whole_object] = CATEGORIES.index('object')
+    return categories
+
+def hotspots(store, side='vlm', k=50, min_total=1):
+    """
+    Rank normalized entities by how often the judge flagged them across all runs.
+
+    Args:
+        side (str): 'vlm' ranks hallucinations, 'gt' omissions.
+        k (int): Rows of the entity tables.
+        min_total (int): Skip entities seen fewer times than this.
+
+    Returns:
+        dict: 'categories' (flagged entries per category and run), 'entities' (top entities
+            with flagged/total counts, rate and number of runs flagging them) and
+            'entity_categories' (top (entity, category) pairs).
+    """
+    normalized = [normalize_entity(name) for name in store.names]
+    entity_names, name_to_entity = np.unique(np.array(normalized, dtype=str), return_inverse=True)
+    graph = store.entry_graph()
+    on_side = (store.graph_side == SIDES.index(side))[graph]
+    entity = name_to_entity[store.entry_src][on_side].astype(np.int64)
+    flagged = store.entry_flag[on_side]
+    runs = store.graph_run[graph][on_side].astype(np.int64)
+    categories = entry_categories(store)[on_side].astype(np.int64)
+    num_entities, num_runs, num_categories = len(entity_names), len(store.runs), len(CATEGORIES)
+
+    category_table = group_count(runs[flagged] * num_categories + categories[flagged],
+                                 minlength=num_runs * num_categories).reshape(num_runs, num_categories)
+    entries_per_run = group_count(runs, minlength=num_runs)
+    categories_by_run = {
+        str(store.runs[r]): dict({CATEGORIES[c]: int(category_table[r, c]) for c in range(num_categories)},
+                                 entries=int(entries_per_run[r]))
+        for r in range(num_runs)
+    }
+
+    total = group_count(entity, minlength=num_entities)
+    flagged_count = group_count(entity[flagged], minlength=num_entities)
+    run_flags = group_count(entity[flagged] * num_runs + runs[flagged], minlength=num_entities * num_runs)
+    runs_flagging = (run_flags.reshape(num_entities, num_runs) > 0).sum(axis=1)
+    order = np.lexsort((-total, -flagged_count))
+    entities = [
+        {'entity': str(entity_names[i]), 'flagged': int(flagged_count[i]), 'total': int(total[i]),
+         'rate': float(flagged_count[i] / total[i]), 'runs': int(runs_flagging[i])}
+        for i in order if flagged_count[i] > 0 and total[i] >= min_total
+    ][:k]
+
+    pair = entity[flagged] * num_categories + categories[flagged]
+    pair_count = group_count(pair, minlength=num_entities * num_categories)
+    top_pairs = np.argsort(-pair_count, kind='stable')[:k]
+    entity_categories = [
+        {'entity': str(entity_names[p // num_categories]), 'category': CATEGORIES[p % num_categories],
+         'flagged': int(pair_count[p])}
+        for p in top_pairs if pair_count[p] > 0
+    ]
+    return {'side': side, 'categories': categories_by_run, 'entities': entities, 'entity_categories': entity_categories}
+
+def format_table(rows, columns):
+    widths = [max([len(column)] + [len(f"{row[column]:.3f}" if isinstance(row[column], float) else str(row[column]))
+                                   for row in rows]) for column in columns]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    for row in rows:
+        cells = [f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in columns]
+        lines.append('  '.join(cell.ljust(width) for cell, width in zip(cells, widths)))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank the entities and categories models hallucinate or omit most.")
+    parser.add_argument('--results_dir', default='HalFScore/results', help="Searched recursively for eval journals")
+    parser.add_argument('--store', default=None, help="Use a prebuilt graph store (.npz) instead of parsing journals")
+    parser.add_argument('--side', choices=SIDES, default='vlm', help="vlm: hallucinations, gt: omissions")
+    parser.add_argument('-k', type=int, default=30)
+    parser.add_argument('--min_total', type=int, default=3, help="Skip entities seen fewer times")
+    parser.add_argument('--output', default=None, help="Write all tables as JSON (input of generate.py prioritization)")
+    args = parser.parse_args(argv)
+
+    if args.store:
+        store = GraphStore.load(args.store)
+    else:
+        store = GraphStore.from_journals(collect_journals([args.results_dir], args.results_dir))
+    tables = hotspots(store, side=args.side, k=args.k, min_total=args.min_total)
+    print(format_table([dict(row, run=run) for run, row in tables['categories'].items()],
+                       ('run', 'entries') + CATEGORIES))
+    print()
+    print(format_table(tables['entities'], ('entity', 'flagged', 'total', 'rate', 'runs')))
+    print()
+    print(format_table(tables['entity_categories'], ('entity', 'category', 'flagged')))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(tables, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from perturbollava.retry import DEFAULT_RETRY_POLICY
+
+JUDGE_BACKENDS = {}
+
+def register_judge_backend(name, backend_class):
+    """Register a JudgeBackend subclass under a name selectable from the command line."""
+    JUDGE_BACKENDS[name] = backend_class
+    return backend_class
+
+def build_judge_backend(name, **kwargs):
+    if name not in JUDGE_BACKENDS:
+        raise ValueError(f"Unknown judge backend {name}, expected one of {sorted(JUDGE_BACKENDS)}")
+    return JUDGE_BACKENDS[name](**kwargs)
+
+class JudgeBackend(object):
+    """
+    A chat model that answers judge and generation prompts.
+
+    Calling a backend with OpenAI-style messages returns {"response": text, "usage": dict or None}.
+    ``batch`` submits several independent requests at once, up to ``max_batch_size`` concurrently,
+    which lets a server that batches internally (vLLM, TGI, SGLang) process them together.
+
+    Args:
+        model (str): Model name sent with every request.
+        max_tokens (int): Completion token limit.
+        temperature (float or None): Sampling temperature; None keeps the server default.
+        timeout (float): Per-request timeout in seconds.
+        max_batch_size (int): Requests of one batch in flight at the same time.
+        cooldown (float): Seconds a worker pauses after each image, to spread load on rate-limited APIs.
+        structured_outputs (bool): Send the response_format of structured prompts; turn off for
+            servers that reject it (the prompt still asks for the schema).
+    """
+
+    def __init__(self, model='gpt-4o', max_tokens=4096, temperature=None, timeout=DEFAULT_RETRY_POLICY.call_timeout,
+                 max_batch_size=8, cooldown=0.0, structured_outputs=True):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.cooldown = cooldown
+        self.structured_outputs = structured_outputs
+
+    @staticmethod
+    def encode_image(image_path):
+        with open(image_path, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode('utf-8')
+
+    @staticmethod
+    def encode_imagebytes(image_bytes):
+        return base64.b64encode(image_bytes).decode('utf-8')
+
+    def payload(self, messages, response_format=None):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+        }
+        if self.temperature is not None:
+            payload["temperature"] = self.temperature
+        if response_format is not None and self.structured_outputs:
+            payload["response_format"] = response_format
+        return payload
+
+    def __call__(self, messages, response_format=None):
+        raise NotImplementedError
+
+    def batch(self, messages_list, call=None):
+        """
+        Answer several independent requests concurrently.
+
+        Args:
+            messages_list (list): One message list per request, or any request ``call`` accepts.
+            call (callable): Function applied to each request; defaults to the backend
+                itself, pass a wrapper to add retries, caching or validation.
+
+        Returns:
+            list: Results in the order of messages_list. The first failure is re-raised.
+        """
+        call = call or self
+        if len(messages_list) <= 1 or self.max_batch_size <= 1:
+            return [call(messages) for messages in messages_list]
+        with ThreadPoolExecutor(min(len(messages_list), self.max_batch_size)) as executor:
+            return list(executor.map(call, messages_list))
+
+class SignedHeaderBackend(JudgeBackend):
+    """The HMAC-signed gateway used for the paper's GPT-4o runs."""
+
+    def __init__(self, url='', configs=(), cooldown=2.0, **kwargs):
+        super().__init__(cooldown=cooldown, **kwargs)
+        self.url = url
+        self.configs = list(configs)
+
+    def calcAuthorization(self, config):
+        source = config['source']
+        appkey = config['appkey']
+        timestamp = int(time.time())
+        signStr = "x-timestamp: %s\nx-source: %s" % (timestamp, source)
+        sign = hmac.new(appkey.encode('utf-8'), signStr.encode('utf-8'), hashlib.sha256).digest()
+        return sign.hex(), timestamp
+
+    def __call__(self, messages, response_format=None):
+        config = random.choice(self.configs)
+        auth, timestamp = self.calcAuthorization(config)
+        headers = {
+            "Content-Type": "application/json",
+            "x-appid": config['appid'],
+            "x-source": config['source'],
+            "x-timestamp": str(timestamp),
+            "x-authorization": auth,
+        }
+        import requests
+        response = requests.post(self.url, json=self.payload(messages, response_format), headers=headers,
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        response_text = json.loads(response.text)
+        return {"response": response_text['response'], "usage": response_text.get('detail', {}).get('usage')}
+
+class OpenAICompatibleBackend(JudgeBackend):
+    """
+    Any server implementing the OpenAI chat completions API, e.g. a local vLLM or SGLang.
+
+    Args:
+        base_url (str): API root, e.g. http://localhost:8000/v1.
+        api_key (str or None): Bearer token; defaults to $OPENAI_API_KEY, omitted if unset.
+    """
+
+    def __init__(self, base_url='http://localhost:8000/v1', api_key=None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = base_url.rstrip('/') + '/chat/completions'
+        self.api_key = api_key if api_key is not None else os.environ.get('OPENAI_API_KEY')
+        import requests
+        self.session = requests.Session()
+        # Keep enough pooled connections for a full batch.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_batch_size, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __call__(self, messages, response_format=None):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        response = self.session.post(self.url, json=self.payload(messages, response_format), headers=headers,
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        response_json = response.json()
+        return {"response": response_json['choices'][0]['message']['content'], "usage": response_json.get('usage')}
+
+register_judge_backend('signed', SignedHeaderBackend)
+register_judge_backend('openai', OpenAICompatibleBackend)
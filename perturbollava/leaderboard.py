@@ -0,0 +1,205 @@
+import os
+import glob
+import json
+import sqlite3
+import argparse
+
+from perturbollava.scoring import aggregate_scores
+
+COUNT_KEYS = ('vlm_num_concepts', 'vlm_hallusion_concepts_num', 'gt_num_concepts', 'gt_omission_concepts_num')
+SCORE_KEYS = ('halusion_score', 'quality_score', 'f_score')
+SUMMARY_KEYS = ('hallucination_score', 'recall_score', 'f_score')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, run TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS images (
+    run TEXT NOT NULL, image TEXT NOT NULL,
+    {', '.join(key + ' INTEGER' for key in COUNT_KEYS)},
+    {', '.join(key + ' REAL' for key in SCORE_KEYS)},
+    PRIMARY KEY (run, image)
+);
+CREATE INDEX IF NOT EXISTS images_f_score ON images (run, f_score);
+CREATE TABLE IF NOT EXISTS summaries (run TEXT PRIMARY KEY, {', '.join(key + ' REAL' for key in SUMMARY_KEYS)});
+"""
+
+def run_name(results_dir, path):
+    """A journal's run name: its path below the results directory without extension."""
+    return os.path.splitext(os.path.relpath(path, results_dir))[0]
+
+def parse_journal(path):
+    """
+    Split a results JSONL file into per-image score records and its last summary line.
+
+    Caption files (image and caption only) yield neither.
+    """
+    images, summary = {}, None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            if 'image' in record:
+                if all(key in record for key in COUNT_KEYS):
+                    images[record['image']] = record
+            elif all(key in record for key in SUMMARY_KEYS):
+                summary = record
+    return images, summary
+
+class LeaderboardIndex(object):
+    """
+    SQLite index of the per-image scores and summaries of all result journals.
+
+    ``update`` only re-reads journals whose mtime or size changed since the last update, so
+    queries over all runs do not re-parse the multi-MB JSONL files.
+
+    Args:
+        db_path (str): Path of the SQLite file; created if missing.
+        results_dir (str): Root of the result directories (HalFScore/results).
+    """
+
+    def __init__(self, db_path, results_dir):
+        self.results_dir = results_dir
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def update(self):
+        """
+        Ingest new and changed journals and forget deleted ones.
+
+        Returns:
+            int: Number of journals (re-)ingested.
+        """
+        known = {path: (mtime, size) for path, mtime, size in self.conn.execute('SELECT path, mtime, size FROM files')}
+        paths = sorted(glob.glob(os.path.join(self.results_dir, '**', '*.jsonl'), recursive=True))
+        updated = 0
+        with self.conn:
+            for path in set(known) - set(paths):
+                self.forget(path)
+            for path in paths:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                self.forget(path)
+                self.ingest(path, stat)
+                updated += 1
+        return updated
+
+    def forget(self, path):
+        row = self.conn.execute('SELECT run FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return
+        self.conn.execute('DELETE FROM images WHERE run = ?', row)
+        self.conn.execute('DELETE FROM summaries WHERE run = ?', row)
+        self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def ingest(self, path, stat):
+        run = run_name(self.results_dir, path)
+        images, summary = parse_journal(path)
+        self.conn.executemany(
+            f'INSERT OR REPLACE INTO images VALUES (?, ?, {", ".join("?" for _ in COUNT_KEYS + SCORE_KEYS)})',
+            [(run, image) + tuple(record.get(key) for key in COUNT_KEYS + SCORE_KEYS) for image, record in images.items()]
+        )
+        if summary is not None:
+            self.conn.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)',
+                              (run,) + tuple(summary[key] for key in SUMMARY_KEYS))
+        # Files without scores are recorded too so that they are not re-read on every update.
+        self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, run, stat.st_mtime, stat.st_size))
+
+    def runs(self):
+        return [run for run, in self.conn.execute(
+            'SELECT run FROM images UNION SELECT run FROM summaries ORDER BY run')]
+
+    def resolve_run(self, name):
+        """Match a run by exact name or by a unique substring of its name."""
+        runs = self.runs()
+        if name in runs:
+            return name
+        matches = [run for run in runs if name in run]
+        if len(matches) != 1:
+            raise ValueError(f"Run {name!r} matches {matches or 'no runs'}; known runs: {runs}")
+        return matches[0]
+
+    def leaderboard(self):
+        """
+        Scores of every run, best f_score first.
+
+        Runs with per-image records are aggregated from their concept counts (micro, as in
+        eval.py); runs with only a summary line or score.jsonl use the stored summary.
+        """
+        rows = {}
+        for row in self.conn.execute(
+                f'SELECT run, COUNT(*), {", ".join(f"SUM({key})" for key in COUNT_KEYS)} FROM images GROUP BY run'):
+            run, num_images, counts = row[0], row[1], row[2:]
+            rows[run] = dict(aggregate_scores(*[[count] for count in counts]), run=run, images=num_images, source='images')
+        for row in self.conn.execute(f'SELECT run, {", ".join(SUMMARY_KEYS)} FROM summaries'):
+            if row[0] not in rows:
+                rows[row[0]] = dict(zip(SUMMARY_KEYS, row[1:]), run=row[0], images=None, source='summary')
+        return sorted(rows.values(), key=lambda row: row['f_score'], reverse=True)
+
+    def diff(self, run_a, run_b, limit=20):
+        """Images scored in both runs, largest absolute f_score difference (b - a) first."""
+        query = f"""
+            SELECT a.image, a.f_score, b.f_score, b.f_score - a.f_score AS delta
+            FROM images a JOIN images b ON a.image = b.image
+            WHERE a.run = ? AND b.run = ?
+            ORDER BY ABS(delta) DESC, a.image LIMIT ?
+        """
+        return [dict(zip(('image', 'f_score_a', 'f_score_b', 'delta'), row))
+                for row in self.conn.execute(query, (run_a, run_b, limit))]
+
+    def worst(self, run, k=20, key='f_score'):
+        """The k images of a run with the lowest score."""
+        if key not in SCORE_KEYS:
+            raise ValueError(f"Unknown score {key}, expected one of {SCORE_KEYS}")
+        query = f'SELECT image, {", ".join(COUNT_KEYS + SCORE_KEYS)} FROM images WHERE run = ? ORDER BY {key}, image LIMIT ?'
+        return [dict(zip(('image',) + COUNT_KEYS + SCORE_KEYS, row)) for row in self.conn.execute(query, (run, k))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query a local index of all HalFScore results.")
+    parser.add_argument('--results_dir', default='HalFScore/results', help="Root of the result directories")
+    parser.add_argument('--db', default=None, help="Index file (defaults to <results_dir>/.halfscore_index.sqlite)")
+    parser.add_argument('--no_update', action='store_true', help="Query the index without checking for new journals")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update', help="Ingest new and changed journals")
+    subparsers.add_parser('leaderboard', help="Scores of all runs, best first")
+    diff_parser = subparsers.add_parser('diff', help="Per-image f_score differences between two runs")
+    diff_parser.add_argument('run_a')
+    diff_parser.add_argument('run_b')
+    diff_parser.add_argument('-k', type=int, default=20, help="Number of images to show")
+    worst_parser = subparsers.add_parser('worst', help="Lowest scoring images of a run")
+    worst_parser.add_argument('run')
+    worst_parser.add_argument('-k', type=int, default=20, help="Number of images to show")
+    worst_parser.add_argument('--score', choices=SCORE_KEYS, default='f_score')
+    args = parser.parse_args(argv)
+
+    index = LeaderboardIndex(args.db or os.path.join(args.results_dir, '.halfscore_index.sqlite'), args.results_dir)
+    try:
+        if args.command == 'update' or not args.no_update:
+            updated = index.update()
+            if args.command == 'update':
+                print(f"Updated {updated} journals, {len(index.runs())} runs indexed.")
+        if args.command == 'leaderboard':
+            rows = index.leaderboard()
+        elif args.command == 'diff':
+            rows = index.diff(index.resolve_run(args.run_a), index.resolve_run(args.run_b), args.k)
+        elif args.command == 'worst':
+            rows = index.worst(index.resolve_run(args.run), args.k, args.score)
+        else:
+            rows = []
+        for row in rows:
+            print(json.dumps(row))
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
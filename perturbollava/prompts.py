@@ -0,0 +1,196 @@
+import re
+import json
+import string
+import hashlib
+import itertools
+
+# '%s' slots and '%%' escapes of %-style templates.
+PERCENT_PATTERN = re.compile(r'%[s%]')
+
+class PromptTemplate(object):
+    """
+    A prompt template compiled once into literal segments and named slots.
+
+    Rendering joins the precompiled segments with the slot values instead of re-parsing the
+    template on every call. The text before the first slot is the static prefix shared by
+    every rendering, which is what API-side prompt caching can reuse.
+
+    Args:
+        name (str): Template name, e.g. 'hallucination'.
+        version (str): Version label, e.g. 'v1'.
+        text (str): Template text.
+        style (str): 'format' for str.format templates ({name} slots, {{ }} escapes) or
+            'percent' for %-style templates (positional %s slots, %% escapes).
+        schema (dict or None): JSON schema of the answer, for prompts asking for structured output.
+    """
+
+    def __init__(self, name, version, text, style='format', schema=None):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.style = style
+        self.schema = schema
+        self.segments, self.slots = self._compile(text, style)
+        self.static_prefix = self.segments[0]
+        identity = [name, style, text] if schema is None else [name, style, text, schema]
+        self.digest = hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _compile(text, style):
+        segments, slots = [''], []
+        if style == 'format':
+            for literal, field, format_spec, conversion in string.Formatter().parse(text):
+                segments[-1] += literal
+                if field is not None:
+                    if format_spec or conversion or not field.isidentifier():
+                        raise ValueError(f"Only plain {{name}} slots are supported, got {{{field}}}")
+                    slots.append(field)
+                    segments.append('')
+        elif style == 'percent':
+            position = 0
+            for match in PERCENT_PATTERN.finditer(text):
+                segments[-1] += text[position:match.start()]
+                if match.group() == '%%':
+                    segments[-1] += '%'
+                else:
+                    slots.append(len(slots))
+                    segments.append('')
+                position = match.end()
+            segments[-1] += text[position:]
+        else:
+            raise ValueError(f"Unknown template style {style}, expected 'format' or 'percent'")
+        return segments, slots
+
+    @property
+    def key(self):
+        """'<name>@<version>:<digest>', for cache keys and run records."""
+        return f"{self.name}@{self.version}:{self.digest}"
+
+    def render(self, *args, **kwargs):
+        """Fill the slots: by name for 'format' templates, by position for 'percent' ones."""
+        values = args if self.style == 'percent' else [kwargs[slot] for slot in self.slots]
+        if len(values) != len(self.slots):
+            raise TypeError(f"{self.key} takes {len(self.slots)} values, got {len(values)}")
+        parts = [self.segments[0]]
+        for value, segment in zip(values, self.segments[1:]):
+            parts.append(str(value))
+            parts.append(segment)
+        return ''.join(parts)
+
+    def render_empty(self):
+        """The template with every slot empty, e.g. to count its fixed tokens."""
+        return ''.join(self.segments)
+
+    def response_format(self):
+        """OpenAI-style response_format enforcing the schema, or None for free-text prompts."""
+        if self.schema is None:
+            return None
+        return {'type': 'json_schema', 'json_schema': {'name': self.name, 'schema': self.schema, 'strict': True}}
+
+# name -> {version: PromptTemplate}; the first registered version of a name is its default
+# unless a later one is registered with default=True.
+PROMPT_TEMPLATES = {}
+DEFAULT_VERSIONS = {}
+_active_versions = {}
+
+def register_prompt(name, version, text, style='format', schema=None, default=False):
+    """
+    Register a version of a prompt template.
+
+    Args:
+        name (str): Template name used to look it up.
+        version (str): Version label; re-registering a version with different text is an error,
+            so a version label always means the same prompt.
+        text (str): Template text.
+        style (str): 'format' or 'percent' (see PromptTemplate).
+        schema (dict or None): JSON schema of structured answers (see PromptTemplate).
+        default (bool): Make this version the default even if another was registered first.
+
+    Returns:
+        PromptTemplate: The registered template.
+    """
+    template = PromptTemplate(name, version, text, style, schema)
+    versions = PROMPT_TEMPLATES.setdefault(name, {})
+    if version in versions and versions[version].digest != template.digest:
+        raise ValueError(f"Prompt {name}@{version} is already registered with different text")
+    versions[version] = template
+    if default:
+        DEFAULT_VERSIONS[name] = version
+    else:
+        DEFAULT_VERSIONS.setdefault(name, version)
+    return template
+
+def load_prompt_file(path):
+    """
+    Register the prompt versions of a JSON file.
+
+    The file maps names to versions to either the template text or an object with 'text',
+    'style' and 'schema', e.g. {"hallucination": {"v2": "...{gt_list}...{vlm_list}"}}.
+
+    Returns:
+        list: The registered templates.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    templates = []
+    for name, versions in config.items():
+        for version, spec in versions.items():
+            if isinstance(spec, str):
+                spec = {'text': spec}
+            templates.append(register_prompt(name, version, spec['text'], spec.get('style', 'format'),
+                                             spec.get('schema')))
+    return templates
+
+def parse_prompt_versions(items):
+    """Turn ['hallucination=v2', ...] into {'hallucination': 'v2', ...}."""
+    versions = {}
+    for item in items or ():
+        name, sep, version = item.partition('=')
+        if not sep:
+            raise ValueError(f"Expected <name>=<version>, got {item}")
+        versions[name] = version
+    return versions
+
+def select_prompt_versions(versions):
+    """
+    Choose the versions get_prompt returns for this process; unnamed templates keep their default.
+
+    Args:
+        versions (dict): Template name to version label.
+    """
+    for name, version in versions.items():
+        if version not in PROMPT_TEMPLATES.get(name, {}):
+            raise ValueError(f"Unknown prompt {name}@{version}, registered: "
+                             f"{sorted(PROMPT_TEMPLATES.get(name, {}))}")
+    _active_versions.clear()
+    _active_versions.update(versions)
+
+def get_prompt(name):
+    """The selected version of a template."""
+    return PROMPT_TEMPLATES[name][_active_versions.get(name, DEFAULT_VERSIONS[name])]
+
+def active_prompts(names=None, versions=None):
+    """
+    {name: 'name@version:digest'} of the selected templates (all registered names by default).
+
+    ``versions`` ({name: version}) overrides the selection, e.g. to describe an older run.
+    """
+    versions = versions or {}
+    return {name: PROMPT_TEMPLATES[name][versions[name]].key if name in versions else get_prompt(name).key
+            for name in sorted(names or PROMPT_TEMPLATES)}
+
+def prompts_digest(names=None, versions=None):
+    """One hash of the selected templates (or of ``versions``), identifying the prompts a run used."""
+    return hashlib.sha256(json.dumps(active_prompts(names, versions)).encode('utf-8')).hexdigest()[:16]
+
+def find_prompt_versions(names, digest):
+    """
+    The registered versions of the named templates whose prompts_digest is digest, e.g. to
+    resume a run with the prompts its journal was written with; None if no combination matches.
+    """
+    names = sorted(names)
+    for combination in itertools.product(*(sorted(PROMPT_TEMPLATES[name]) for name in names)):
+        versions = dict(zip(names, combination))
+        if prompts_digest(names, versions) == digest:
+            return versions
+    return None
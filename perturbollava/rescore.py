@@ -0,0 +1,113 @@
+import json
+import argparse
+
+import numpy as np
+
+from perturbollava.scoring import (
+    aggregate_scores, count_concepts, f_beta, parse_analysis, parse_graph, precision_recall
+)
+
+REQUIRED_KEYS = ('response_gt', 'response_vlm')
+
+def load_journal(path):
+    """Per-image records of an eval.py journal, skipping summary lines and failed images."""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'image' in record and all(key in record for key in REQUIRED_KEYS):
+                records.append(record)
+    return records
+
+def flagged_serials(record, analysis_key, idx_key, reparse=True):
+    analysis = record.get(analysis_key)
+    if reparse and isinstance(analysis, str):
+        return parse_analysis(analysis)
+    return list(record.get(idx_key, []))
+
+def image_counts(record, categories=None, strict=False, reparse=True):
+    """
+    Concept counts of one image: (vlm concepts, hallucinated, gt concepts, omitted).
+
+    By default the counts follow eval.py exactly. ``strict`` ignores repeated serial numbers
+    and numbers that are not entries of the graph; ``categories`` keeps only entries of the
+    given kinds ('object', 'relationship') and implies strict counting.
+    """
+    hallucinated = flagged_serials(record, 'hallucination_analysis_list', 'hallusion_concepts_idx', reparse)
+    omitted = flagged_serials(record, 'omission_caption_analysis_list', 'gt_omission_concepts_idx', reparse)
+    if categories is None and not strict:
+        return (count_concepts(record['response_vlm']), len(hallucinated),
+                count_concepts(record['response_gt']), len(omitted))
+    vlm_serials = {entry.serial for entry in parse_graph(record['response_vlm'])
+                   if categories is None or entry.kind in categories}
+    gt_serials = {entry.serial for entry in parse_graph(record['response_gt'])
+                  if categories is None or entry.kind in categories}
+    return (len(vlm_serials), len(vlm_serials & set(hallucinated)),
+            len(gt_serials), len(gt_serials & set(omitted)))
+
+def rescore_records(records, aggregation='micro', beta=1.0, categories=None, strict=False, reparse=True):
+    """
+    Recompute per-image and aggregate scores from stored judge outputs, without API calls.
+
+    Per-image scores are written back into the records.
+
+    Returns:
+        dict: The aggregate scores plus the number of images and the settings used.
+    """
+    counts = np.array([image_counts(record, categories, strict, reparse) for record in records],
+                      dtype=np.float64).reshape(-1, 4)
+    vlm, hallucinated, gt, omitted = counts.T
+    halusion_scores, quality_scores = precision_recall(vlm, hallucinated, gt, omitted)
+    f_scores = f_beta(halusion_scores, quality_scores, beta)
+    for i, record in enumerate(records):
+        record['vlm_num_concepts'] = int(vlm[i])
+        record['vlm_hallusion_concepts_num'] = int(hallucinated[i])
+        record['gt_num_concepts'] = int(gt[i])
+        record['gt_omission_concepts_num'] = int(omitted[i])
+        record['halusion_score'] = float(halusion_scores[i])
+        record['quality_score'] = float(quality_scores[i])
+        record['f_score'] = float(f_scores[i])
+    summary = aggregate_scores(vlm, hallucinated, gt, omitted, aggregation=aggregation, beta=beta)
+    summary.update({
+        'num_images': len(records),
+        'aggregation': aggregation,
+        'beta': beta,
+        'categories': sorted(categories) if categories else None,
+        'strict': strict,
+    })
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute HalFScore metrics from stored judge outputs.")
+    parser.add_argument('journals', nargs='+', help="eval.py result journals (--save_path files)")
+    parser.add_argument('--aggregation', choices=['micro', 'macro'], default='micro',
+                        help="micro pools concept counts (HalFScore), macro averages per-image scores")
+    parser.add_argument('--beta', type=float, default=1.0, help="F-beta weight of recall")
+    parser.add_argument('--categories', nargs='*', default=None, help="Only count these entry kinds, e.g. object")
+    parser.add_argument('--strict', action='store_true',
+                        help="Ignore repeated serial numbers and numbers that are not graph entries")
+    parser.add_argument('--no_reparse', action='store_true',
+                        help="Use the stored index lists instead of re-parsing the judge analyses")
+    parser.add_argument('--output', default=None,
+                        help="Write the rescored journal here (only with a single input journal)")
+    args = parser.parse_args(argv)
+    if args.output and len(args.journals) > 1:
+        parser.error("--output needs a single input journal")
+
+    categories = set(args.categories) if args.categories else None
+    for path in args.journals:
+        records = load_journal(path)
+        summary = rescore_records(records, aggregation=args.aggregation, beta=args.beta, categories=categories,
+                                  strict=args.strict, reparse=not args.no_reparse)
+        print(json.dumps(dict(summary, journal=path)))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+                f.write(json.dumps({key: summary[key] for key in ('hallucination_score', 'recall_score', 'f_score')})
+                        + '\n')
+
+if __name__ == "__main__":
+    main()
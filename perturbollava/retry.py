@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Operating system errors repeating the call cannot fix: missing or unreadable files.
+PERMANENT_OS_ERRORS = (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)
+
+class RetryableError(Exception):
+    """A transient failure; the call may succeed if repeated."""
+
+class PermanentError(Exception):
+    """A failure that repeating the call cannot fix (bad request, bad image, unparsable output)."""
+
+class RetryError(Exception):
+    """Raised when a call failed permanently or exhausted its attempts or deadline."""
+
+    def __init__(self, message, last_exception, attempts, retryable):
+        super().__init__(message)
+        self.last_exception = last_exception
+        self.attempts = attempts
+        self.retryable = retryable
+
+def is_retryable(exc):
+    """
+    Classify an exception raised by an API call.
+
+    Timeouts, connection errors (including the built-in TimeoutError and ConnectionError
+    family), 429 and 5xx responses are retryable; other 4xx responses, missing or unreadable
+    image files and malformed responses are permanent.
+    """
+    if isinstance(exc, RetryableError):
+        return True
+    if isinstance(exc, PermanentError):
+        return False
+    # requests is imported lazily by the backends, so its errors only exist once it is loaded.
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+            return True
+        if isinstance(exc, requests.exceptions.HTTPError):
+            status_code = getattr(exc.response, 'status_code', None)
+            return status_code is None or status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        # Socket timeouts, resets and broken pipes of the non-requests backends.
+        return True
+    if isinstance(exc, (ValueError, KeyError, TypeError) + PERMANENT_OS_ERRORS):
+        # Parse errors (including JSONDecodeError) and missing or unreadable image files.
+        return False
+    return True
+
+def retry_after(exc):
+    """Seconds requested by a Retry-After header on an HTTP error, if any."""
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter for retryable errors.
+
+    Args:
+        max_attempts (int): Maximum number of calls, including the first one.
+        base_delay (float): Backoff scale in seconds; attempt n waits up to base_delay * 2 ** n.
+        max_delay (float): Upper bound of a single backoff in seconds.
+        deadline (float or None): Overall time budget in seconds for one call including retries.
+        call_timeout (float or None): Per-request timeout in seconds, passed to the API clients.
+        classify (callable): Returns whether an exception is retryable.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, deadline=600.0, call_timeout=120.0,
+                 classify=is_retryable):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.call_timeout = call_timeout
+        self.classify = classify
+
+    def backoff(self, attempt, exc=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(exc)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func, retrying retryable errors.
+
+        Raises:
+            RetryError: On a permanent error, or once attempts or the deadline are exhausted.
+        """
+        start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            try:
+                return func(*args, **kwargs)
+            except Exception as exc:
+                name = getattr(func, '__name__', type(func).__name__)
+                if not self.classify(exc):
+                    raise RetryError(f"{name} failed permanently: {exc!r}", exc, attempt + 1, False) from exc
+                if attempt + 1 == self.max_attempts:
+                    raise RetryError(f"{name} still failed after {attempt + 1} attempts: {exc!r}",
+                                     exc, attempt + 1, True) from exc
+                delay = self.backoff(attempt, exc)
+                if self.deadline is not None and time.monotonic() - start + delay > self.deadline:
+                    raise RetryError(f"{name} exceeded its {self.deadline}s deadline: {exc!r}",
+                                     exc, attempt + 1, True) from exc
+                print(f"An error occurred: {exc!r}, retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+def describe_error(exc):
+    """JSON-serializable summary of a failed call for the dead-letter file."""
+    return {
+        'error': repr(getattr(exc, 'last_exception', None) or exc),
+        'attempts': getattr(exc, 'attempts', 1),
+        'retryable': getattr(exc, 'retryable', None),
+    }
+
+class DeadLetterLog(object):
+    """
+    Append-only JSON Lines file of records that could not be processed.
+
+    Writes take an exclusive file lock, so several worker processes can share one file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, key, **fields):
+        """Append one entry; fields usually come from describe_error."""
+        entry = {'key': key, 'time': time.time()}
+        entry.update(fields)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def keys(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return {json.loads(line)['key'] for line in f if line.strip()}
@@ -0,0 +1,176 @@
+import re
+import json
+from collections import namedtuple
+
+import numpy as np
+
+SERIAL_PATTERN = re.compile(r'(\d+)\.')
+TUPLE_PATTERN = re.compile(r'^\s*(\d+)\.\s*\((.*)\)\s*$', re.MULTILINE)
+DELIMITER_PATTERN = re.compile(r'\{tuple_delimiter\}|<\|>')
+
+GraphEntry = namedtuple('GraphEntry', ['serial', 'kind', 'fields'])
+
+def count_concepts(response):
+    """Number of numbered entries in an extracted graph, counted as HalFScore always has."""
+    return len(SERIAL_PATTERN.findall(response or ''))
+
+def parse_graph(response):
+    """
+    Parse the numbered tuples of an extracted graph.
+
+    Args:
+        response (str): Output of ENTITY_RELATIONSHIPS_GENERATION_PROMPT.
+
+    Returns:
+        list: GraphEntry(serial, kind, fields) per tuple; kind is 'object' or 'relationship'
+            and fields are the remaining delimited values.
+    """
+    entries = []
+    for serial, body in TUPLE_PATTERN.findall(response or ''):
+        fields = [field.strip().strip('"').strip() for field in DELIMITER_PATTERN.split(body)]
+        if not fields:
+            continue
+        entries.append(GraphEntry(int(serial), fields[0].lower(), fields[1:]))
+    return entries
+
+def parse_serial_numbers(analysis):
+    """Serial numbers listed after the last 'Serial Numbers:' marker of a judge analysis."""
+    index = analysis.rfind('Serial Numbers:')
+    return [int(num) for num in re.findall(r'\d+', analysis[index:])]
+
+# Answer of the structured analysis prompts: the flagged serial numbers, each with a short reason.
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'serial_numbers': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {'serial': {'type': 'integer'}, 'reason': {'type': 'string'}},
+                'required': ['serial', 'reason'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['serial_numbers'],
+    'additionalProperties': False,
+}
+FENCE_PATTERN = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+class JudgeOutputError(ValueError):
+    """A judge answer that does not follow the output schema of its prompt."""
+
+def parse_structured_serials(analysis, valid_serials=None):
+    """
+    Validate a structured analysis answer (ANALYSIS_SCHEMA) and return its serial numbers.
+
+    Only a Markdown code fence around the JSON object is tolerated; anything else that is not
+    the schema is an error rather than a guess. Repeated serial numbers count once.
+
+    Args:
+        analysis (str): The judge answer.
+        valid_serials (set or None): Serial numbers of the judged graph; a flagged number
+            outside it is an error.
+
+    Returns:
+        list: Flagged serial numbers in answer order.
+
+    Raises:
+        JudgeOutputError: The answer breaks the schema.
+    """
+    text = (analysis or '').strip()
+    fenced = FENCE_PATTERN.match(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        answer = json.loads(text)
+    except ValueError as exc:
+        raise JudgeOutputError(f"not a JSON object: {exc}") from None
+    if not isinstance(answer, dict) or not isinstance(answer.get('serial_numbers'), list):
+        raise JudgeOutputError("expected an object with a 'serial_numbers' list")
+    serials = []
+    for item in answer['serial_numbers']:
+        serial = item.get('serial') if isinstance(item, dict) else None
+        if type(serial) is not int or not isinstance(item.get('reason'), str):
+            raise JudgeOutputError(f"expected {{\"serial\": <int>, \"reason\": <str>}}, got {json.dumps(item)}")
+        if valid_serials is not None and serial not in valid_serials:
+            raise JudgeOutputError(f"serial number {serial} is not an entry of the list")
+        if serial not in serials:
+            serials.append(serial)
+    return serials
+
+def parse_analysis(analysis):
+    """Serial numbers of a stored analysis, structured or in the 'Serial Numbers:' text format."""
+    if (analysis or '').lstrip().startswith(('{', '```')):
+        try:
+            return parse_structured_serials(analysis)
+        except JudgeOutputError:
+            pass
+    return parse_serial_numbers(analysis or '')
+
+def graph_serials(response):
+    """Serial numbers of an extracted graph, as counted by count_concepts."""
+    return {int(serial) for serial in SERIAL_PATTERN.findall(response or '')}
+
+def precision_recall(vlm_num_concepts, vlm_hallusion_concepts_num, gt_num_concepts, gt_omission_concepts_num):
+    """
+    Hallucination (precision-like) and quality (recall-like) scores; works on scalars and arrays.
+
+    A side without concepts scores 0.
+    """
+    vlm = np.asarray(vlm_num_concepts, dtype=np.float64)
+    gt = np.asarray(gt_num_concepts, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        halusion_score = np.where(vlm > 0, 1.0 - np.asarray(vlm_hallusion_concepts_num) / vlm, 0.0)
+        quality_score = np.where(gt > 0, 1.0 - np.asarray(gt_omission_concepts_num) / gt, 0.0)
+    return halusion_score, quality_score
+
+def f_beta(halusion_score, quality_score, beta=1.0):
+    """F-beta of the two scores (beta > 1 weighs recall more); 0 when both are 0."""
+    h = np.asarray(halusion_score, dtype=np.float64)
+    q = np.asarray(quality_score, dtype=np.float64)
+    denominator = beta ** 2 * h + q
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, (1 + beta ** 2) * h * q / denominator, 0.0)
+
+def score_image(single_eval, beta=1.0):
+    """Fill in the per-image scores of a journal record from its concept counts."""
+    halusion_score, quality_score = precision_recall(
+        single_eval['vlm_num_concepts'], single_eval['vlm_hallusion_concepts_num'],
+        single_eval['gt_num_concepts'], single_eval['gt_omission_concepts_num'],
+    )
+    single_eval['halusion_score'] = float(halusion_score)
+    single_eval['quality_score'] = float(quality_score)
+    single_eval['f_score'] = float(f_beta(halusion_score, quality_score, beta))
+    return single_eval
+
+def aggregate_scores(vlm_num_concepts, vlm_hallusion_concepts_num, gt_num_concepts, gt_omission_concepts_num,
+                     aggregation='micro', beta=1.0):
+    """
+    Benchmark-level scores from per-image concept counts.
+
+    Args:
+        aggregation (str): 'micro' pools the concept counts of all images (the HalFScore
+            definition); 'macro' averages the per-image scores.
+        beta (float): F-beta weight of recall.
+
+    Returns:
+        dict: hallucination_score, recall_score and f_score.
+    """
+    counts = [np.asarray(values, dtype=np.float64) for values in (
+        vlm_num_concepts, vlm_hallusion_concepts_num, gt_num_concepts, gt_omission_concepts_num)]
+    if aggregation == 'micro':
+        halusion_score, quality_score = precision_recall(*[values.sum() for values in counts])
+        f_score = f_beta(halusion_score, quality_score, beta)
+    elif aggregation == 'macro':
+        halusion_scores, quality_scores = precision_recall(*counts)
+        halusion_score = halusion_scores.mean() if len(halusion_scores) else 0.0
+        quality_score = quality_scores.mean() if len(quality_scores) else 0.0
+        f_score = f_beta(halusion_scores, quality_scores, beta).mean() if len(halusion_scores) else 0.0
+    else:
+        raise ValueError(f"Unknown aggregation {aggregation}, expected 'micro' or 'macro'")
+    return {
+        'hallucination_score': float(halusion_score),
+        'recall_score': float(quality_score),
+        'f_score': float(f_score),
+    }
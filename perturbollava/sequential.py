@@ -0,0 +1,96 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from perturbollava.scoring import f_beta, precision_recall
+
+def f_score_influence(counts, beta=1.0):
+    """
+    Micro F-score of a set of images and each image's influence on it.
+
+    The F-score is a smooth function of two ratios of sums, so by the delta method its
+    sampling variance is approximately var(influence) / n.
+
+    Args:
+        counts (np.ndarray): (n, 4) concept counts per image: vlm concepts, hallucinated,
+            gt concepts, omitted.
+
+    Returns:
+        tuple: (f_score, influence) with influence of shape (n,).
+    """
+    counts = np.asarray(counts, dtype=np.float64).reshape(-1, 4)
+    vlm, hallucinated, gt, omitted = counts.T
+    totals = counts.sum(axis=0)
+    h, r = precision_recall(*totals)
+    f = float(f_beta(h, r, beta))
+    mean_vlm = max(vlm.mean(), 1e-12) if len(vlm) else 1.0
+    mean_gt = max(gt.mean(), 1e-12) if len(gt) else 1.0
+    # Influence of each image on H = 1 - sum(hallucinated) / sum(vlm) and R likewise.
+    influence_h = -(hallucinated - (1 - h) * vlm) / mean_vlm
+    influence_r = -(omitted - (1 - r) * gt) / mean_gt
+    denominator = (beta ** 2 * h + r) ** 2
+    if denominator == 0:
+        return f, np.zeros(len(counts))
+    df_dh = (1 + beta ** 2) * r ** 2 / denominator
+    df_dr = (1 + beta ** 2) * beta ** 2 * h ** 2 / denominator
+    return f, df_dh * influence_h + df_dr * influence_r
+
+class SequentialMonitor(object):
+    """
+    Running confidence interval on a model's F-score, or on the paired F-score difference of
+    two models, that decides when an evaluation in random image order can stop.
+
+    The interval is rebuilt at every look; look k uses significance alpha / (k * (k + 1)),
+    which sums to alpha over any number of looks, so stopping on the first satisfied rule
+    keeps the overall error rate below alpha.
+
+    Args:
+        alpha (float): Overall significance level.
+        precision (float or None): Stop once the interval half-width is at most this.
+        target (float or None): Single model: stop once the interval excludes this F-score.
+            With two models the interval is tested against 0 (no difference) instead.
+        min_images (int): Never stop before this many images.
+        beta (float): F-beta weight of recall.
+    """
+
+    def __init__(self, alpha=0.05, precision=None, target=None, min_images=50, beta=1.0):
+        self.alpha = alpha
+        self.precision = precision
+        self.target = target
+        self.min_images = min_images
+        self.beta = beta
+        self.looks = 0
+
+    def update(self, counts_a, counts_b=None):
+        """
+        Look at the images evaluated so far (paired rows when comparing two models).
+
+        Returns:
+            dict: images, estimate, lower, upper, half_width, stop and reason.
+        """
+        self.looks += 1
+        f_a, influence = f_score_influence(counts_a, self.beta)
+        estimate, null = f_a, self.target
+        if counts_b is not None:
+            f_b, influence_b = f_score_influence(counts_b, self.beta)
+            estimate, influence, null = f_a - f_b, influence - influence_b, 0.0
+        n = len(influence)
+        alpha_k = self.alpha / (self.looks * (self.looks + 1))
+        z = NormalDist().inv_cdf(1 - alpha_k / 2)
+        half_width = z * influence.std(ddof=1) / np.sqrt(n) if n > 1 else float('inf')
+        lower, upper = estimate - half_width, estimate + half_width
+        reason = None
+        if n >= self.min_images:
+            if self.precision is not None and half_width <= self.precision:
+                reason = 'precision'
+            elif null is not None and (lower > null or upper < null):
+                reason = 'significant'
+        return {
+            'images': n,
+            'estimate': estimate,
+            'lower': lower,
+            'upper': upper,
+            'half_width': half_width,
+            'stop': reason is not None,
+            'reason': reason,
+        }
@@ -0,0 +1,47 @@
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+
+def prompt_key(messages, model=None, response_format=None):
+    """Stable hash of a chat request, used to recognize identical prompts."""
+    request = {'model': model, 'messages': messages}
+    if response_format is not None:
+        request['response_format'] = response_format
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SingleFlight(object):
+    """
+    Coalesce identical calls made concurrently by threads or worker processes.
+
+    The first caller of a key takes an exclusive file lock in ``lock_dir`` and makes the
+    upstream call; callers arriving meanwhile block on the lock and then read the stored
+    result instead of calling again. Results live as long as ``lock_dir``, so the directory
+    should be scoped to one run. A failed call stores nothing and the next caller retries.
+
+    Args:
+        lock_dir (str): Directory shared by all workers of the run.
+    """
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, func, *args, **kwargs):
+        result_path = os.path.join(self.lock_dir, key + '.json')
+        with open(os.path.join(self.lock_dir, key + '.lock'), 'a+') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(result_path):
+                    with open(result_path, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+                result = func(*args, **kwargs)
+                fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(result, f, ensure_ascii=False)
+                os.replace(tmp_path, result_path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,193 @@
+import json
+import argparse
+import warnings
+
+import numpy as np
+
+from perturbollava.rescore import load_journal
+from perturbollava.sequential import f_score_influence
+
+COUNT_KEYS = ('vlm_num_concepts', 'vlm_hallusion_concepts_num', 'gt_num_concepts', 'gt_omission_concepts_num')
+
+def quantile_bins(values, num_bins):
+    """Bin index of each value by quantiles; ties stay in one bin."""
+    values = np.asarray(values, dtype=np.float64)
+    if num_bins <= 1 or len(values) == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, num_bins + 1)[1:-1]))
+    return np.searchsorted(edges, values, side='right')
+
+def journal_counts(image_ids, journals):
+    """
+    Concept counts of every image in every journal.
+
+    Returns:
+        np.ndarray: (num_journals, num_images, 4) counts; NaN where a journal lacks an image.
+    """
+    counts = np.full((len(journals), len(image_ids), 4), np.nan)
+    position = {image_id: i for i, image_id in enumerate(image_ids)}
+    for j, records in enumerate(journals):
+        for record in records:
+            i = position.get(record['image'])
+            if i is not None and all(key in record for key in COUNT_KEYS):
+                counts[j, i] = [record[key] for key in COUNT_KEYS]
+    return counts
+
+def journal_f_scores(image_ids, journals):
+    """(num_journals, num_images) per-image f_scores; NaN where a journal lacks an image."""
+    scores = np.full((len(journals), len(image_ids)), np.nan)
+    position = {image_id: i for i, image_id in enumerate(image_ids)}
+    for j, records in enumerate(journals):
+        for record in records:
+            i = position.get(record['image'])
+            if i is not None and record.get('f_score') is not None:
+                scores[j, i] = record['f_score']
+    return scores
+
+def influence_matrix(counts):
+    """Per-journal influence of each image on the micro F-score (see f_score_influence)."""
+    influence = np.full(counts.shape[:2], np.nan)
+    for j in range(counts.shape[0]):
+        known = ~np.isnan(counts[j]).any(axis=1)
+        if known.any():
+            influence[j, known] = f_score_influence(counts[j, known])[1]
+    return influence
+
+def allocate(stratum_sizes, stratum_spread, n, min_per_stratum=2):
+    """
+    Neyman allocation of n samples over strata: n_h proportional to N_h * S_h.
+
+    Every stratum gets at least min(min_per_stratum, N_h) samples and at most N_h; without
+    spread information the allocation is proportional. The floor is lowered so the allocation
+    never exceeds n; below one sample per stratum some strata stay unsampled and the weighted
+    estimates no longer cover them, which is warned about.
+    """
+    sizes = np.asarray(stratum_sizes, dtype=np.int64)
+    spread = np.nan_to_num(np.asarray(stratum_spread, dtype=np.float64))
+    if n >= sizes.sum():
+        return sizes.copy()
+    score = sizes * spread if spread.sum() > 0 else sizes.astype(np.float64)
+    num_strata = int((sizes > 0).sum())
+    if n < num_strata:
+        warnings.warn(f"Subset size {n} is below the number of strata {num_strata}; some strata are not sampled, "
+                      "use fewer bins for unbiased estimates")
+    allocation = np.minimum(sizes, min(min_per_stratum, n // num_strata))
+    while allocation.sum() < n:
+        open_strata = allocation < sizes
+        # Give the next sample to the stratum furthest below its Neyman share.
+        share = np.where(open_strata, score / (allocation + 1), -np.inf)
+        if not np.isfinite(share).any() or share.max() <= 0:
+            share = np.where(open_strata, sizes / (allocation + 1), -np.inf)
+        allocation[np.argmax(share)] += 1
+    return allocation
+
+def stratified_variance(influence, strata, allocation):
+    """Variance of the stratified estimate of the mean influence (with finite population correction)."""
+    total = len(influence)
+    variance = 0.0
+    for h, n_h in enumerate(allocation):
+        values = influence[strata == h]
+        if len(values) > 1 and n_h > 0:
+            variance += (len(values) / total) ** 2 * max(0.0, 1 - n_h / len(values)) * values.var(ddof=1) / n_h
+    return variance
+
+def uniform_variance(influence, n):
+    total = len(influence)
+    return (1 - n / total) * influence.var(ddof=1) / n if total > 1 else 0.0
+
+def build_subset(annotations, journals=(), n=100, length_bins=3, concept_bins=3, difficulty_bins=3, seed=0):
+    """
+    Draw a stratified subset of the benchmark with Horvitz-Thompson weights.
+
+    Images are stratified by GT caption length and, when past journals are given, by their
+    mean GT concept count and mean per-image f_score (difficulty). Samples are allocated by
+    Neyman allocation on the spread of the images' influence on the F-score in those journals.
+    Each sampled image carries weight N_h / n_h, so weighted concept counts estimate the
+    full-benchmark totals without bias and the weighted micro F-score estimates the full one.
+
+    Returns:
+        tuple: (subset, report); subset is annotation items with 'weight' and 'stratum' added.
+    """
+    image_ids = [item['image'] for item in annotations]
+    features = [quantile_bins([len(item['caption'].split()) for item in annotations], length_bins)]
+    counts = journal_counts(image_ids, journals)
+    influence = None
+    if len(journals):
+        with warnings.catch_warnings():
+            # Images missing from every journal are binned at the median.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            concepts = np.nanmean(counts[:, :, 2], axis=0)
+            difficulty = np.nanmean(journal_f_scores(image_ids, journals), axis=0)
+        for values, num_bins in ((concepts, concept_bins), (difficulty, difficulty_bins)):
+            if not np.isnan(values).all():
+                features.append(quantile_bins(np.nan_to_num(values, nan=np.nanmedian(values)), num_bins))
+        influence = influence_matrix(counts)
+    keys = [tuple(int(feature[i]) for feature in features) for i in range(len(image_ids))]
+    stratum_keys = sorted(set(keys))
+    strata = np.array([stratum_keys.index(key) for key in keys])
+    sizes = np.bincount(strata, minlength=len(stratum_keys))
+
+    spread = np.zeros(len(stratum_keys))
+    if influence is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean_influence = np.nan_to_num(np.nanmean(influence, axis=0))
+        for h in range(len(stratum_keys)):
+            values = mean_influence[strata == h]
+            spread[h] = values.std(ddof=1) if len(values) > 1 else 0.0
+    allocation = allocate(sizes, spread, min(n, len(image_ids)))
+
+    rng = np.random.default_rng(seed)
+    subset = []
+    for h, n_h in enumerate(allocation):
+        members = np.flatnonzero(strata == h)
+        for i in sorted(rng.choice(members, size=n_h, replace=False)):
+            subset.append(dict(annotations[i], weight=float(sizes[h] / n_h), stratum=list(stratum_keys[h])))
+
+    report = {
+        'population': len(image_ids),
+        'subset': int(allocation.sum()),
+        'strata': len(stratum_keys),
+        'journals': len(journals),
+    }
+    if influence is not None:
+        per_journal = []
+        for j in range(len(journals)):
+            known = ~np.isnan(influence[j])
+            if known.sum() < 2:
+                continue
+            stratified = stratified_variance(influence[j][known], strata[known], allocation)
+            uniform = uniform_variance(influence[j][known], allocation.sum())
+            per_journal.append((stratified, uniform))
+        if per_journal:
+            stratified, uniform = np.mean(per_journal, axis=0)
+            report.update({
+                'f_score_std_stratified': float(np.sqrt(stratified)),
+                'f_score_std_uniform': float(np.sqrt(uniform)),
+                'variance_reduction': float(1 - stratified / uniform) if uniform > 0 else 0.0,
+            })
+    return subset, report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a stratified, importance-weighted fast-eval subset.")
+    parser.add_argument('--cap_file', default='HalFScore/annotation.json', help="Benchmark annotation file")
+    parser.add_argument('--journals', nargs='*', default=[], help="Past eval.py journals for concept counts and difficulty")
+    parser.add_argument('-n', type=int, default=100, help="Subset size")
+    parser.add_argument('--length_bins', type=int, default=3)
+    parser.add_argument('--concept_bins', type=int, default=3)
+    parser.add_argument('--difficulty_bins', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True, help="Subset annotation file, usable as eval.py --cap_file")
+    args = parser.parse_args(argv)
+
+    with open(args.cap_file, 'r', encoding='utf-8') as f:
+        annotations = json.load(f)
+    journals = [load_journal(path) for path in args.journals]
+    subset, report = build_subset(annotations, journals, n=args.n, length_bins=args.length_bins,
+                                  concept_bins=args.concept_bins, difficulty_bins=args.difficulty_bins, seed=args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(subset, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
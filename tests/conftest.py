@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+# eval.py and the packages live at the repository root, which is not installed.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from perturbollava.judge import JudgeBackend
+
+# Extracted graph every caption gets from ScriptedJudge: three numbered entries.
+SCRIPTED_GRAPH = '1. ("object"<|>car<|>red)\n2. ("object"<|>street<|>quiet)\n3. ("relationship"<|>car<|>street<|>on<|>8)'
+SCRIPTED_USAGE = {'prompt_tokens': 10, 'completion_tokens': 5}
+
+
+class ScriptedJudge(JudgeBackend):
+    """
+    Judge backend answering eval.py prompts locally and recording every call.
+
+    Extractions get SCRIPTED_GRAPH and analyses flag ``flagged`` in the format their prompt
+    asks for; answers queued in ``script`` are returned first, one per call.
+    """
+
+    def __init__(self, flagged=(1,), **kwargs):
+        super().__init__(model='scripted-judge', **kwargs)
+        self.flagged = list(flagged)
+        self.script = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def prompt_name(self, messages):
+        import eval as halfscore
+        from perturbollava.prompts import get_prompt
+
+        for name in halfscore.EVAL_PROMPTS:
+            if messages[0]['content'].startswith(get_prompt(name).render_empty()[:100]):
+                return name
+        raise AssertionError('not an eval prompt')
+
+    def __call__(self, messages, response_format=None):
+        name = self.prompt_name(messages)
+        with self.lock:
+            self.calls.append((name, messages, response_format))
+            if self.script:
+                return {'response': self.script.pop(0), 'usage': dict(SCRIPTED_USAGE)}
+        if name == 'extraction':
+            answer = SCRIPTED_GRAPH
+        elif response_format is not None:
+            answer = json.dumps({'serial_numbers': [{'serial': serial, 'reason': 'scripted'}
+                                                    for serial in self.flagged]})
+        else:
+            answer = 'Analysis.\nSerial Numbers: ' + ', '.join(str(serial) for serial in self.flagged)
+        return {'response': answer, 'usage': dict(SCRIPTED_USAGE)}
+
+
+@pytest.fixture
+def judge(monkeypatch):
+    """A ScriptedJudge installed as eval.py's judge, without call sharing or analysis memo."""
+    import eval as halfscore
+
+    judge = ScriptedJudge()
+    monkeypatch.setattr(halfscore, '_judge', judge)
+    monkeypatch.setattr(halfscore, '_single_flight', None)
+    monkeypatch.setattr(halfscore, '_analysis_cache', None)
+    halfscore.take_paid_usage()
+    return judge
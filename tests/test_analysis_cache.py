@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+
+import pytest
+
+import eval as halfscore
+from perturbollava import analysis_cache
+from perturbollava.analysis_cache import AnalysisCache, canonical_graph, pair_key
+
+GT = '1. ("object"<|>car<|>red)\n2. ("object"<|>street<|>quiet)'
+VLM = '1. ("object"<|>car<|>blue)'
+
+
+def test_pair_keys_ignore_whitespace_but_not_order_prompt_or_model():
+    assert canonical_graph('  1. a   b \r\n\n2. c\n') == '1. a b\n2. c'
+    key = pair_key('hallucination@v1:x', 'gpt', GT, VLM)
+    assert pair_key('hallucination@v1:x', 'gpt', GT.replace('\n', '  \r\n') + '\n', ' ' + VLM) == key
+    assert pair_key('hallucination@v1:x', 'gpt', '\n'.join(GT.splitlines()[::-1]), VLM) != key
+    assert pair_key('hallucination@v2:y', 'gpt', GT, VLM) != key
+    assert pair_key('hallucination@v1:x', 'other', GT, VLM) != key
+    assert pair_key('hallucination@v1:x', 'gpt', VLM, GT) != key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path / 'memo.sqlite'))
+    yield cache
+    cache.close()
+
+
+def test_the_first_answer_wins_and_lookups_are_counted(cache, tmp_path):
+    assert cache.get('hallucination', 'h@v1', 'gpt', GT, VLM) is None
+    cache.put('hallucination', 'h@v1', 'gpt', GT, VLM, 'first')
+    cache.put('hallucination', 'h@v1', 'gpt', GT, VLM, 'second')
+    assert cache.get('hallucination', 'h@v1', 'gpt', GT, VLM) == 'first'
+    cache.put('omission', 'o@v1', 'gpt', GT, VLM, 'missing')
+    stats = cache.stats()
+    assert stats['analyses']['hallucination'] == {'lookups': 2, 'hits': 1, 'hit_rate': 0.5, 'entries': 1}
+    assert stats['analyses']['omission'] == {'lookups': 0, 'hits': 0, 'hit_rate': 0.0, 'entries': 1}
+    assert stats['total'] == {'lookups': 2, 'hits': 1, 'hit_rate': 0.5, 'entries': 2}
+    assert stats['process'] == {'hits': 1, 'misses': 1}
+
+    # Another connection sees the entries and the lookups of every run.
+    other = AnalysisCache(cache.path)
+    try:
+        assert other.get('omission', 'o@v1', 'gpt', GT, VLM) == 'missing'
+        assert other.stats()['total']['hits'] == 2 and other.stats()['process'] == {'hits': 1, 'misses': 0}
+    finally:
+        other.close()
+
+
+def test_prune_keeps_only_the_named_prompts(cache):
+    for prompt in ('h@v1', 'h@v2', 'o@v1'):
+        cache.put(prompt[0], prompt, 'gpt', GT, VLM, 'answer')
+    cache.get('h', 'h@v2', 'gpt', GT, VLM)
+    assert cache.prompts() == [{'prompt': 'h@v1', 'model': 'gpt', 'entries': 1, 'hits': 0},
+                               {'prompt': 'h@v2', 'model': 'gpt', 'entries': 1, 'hits': 1},
+                               {'prompt': 'o@v1', 'model': 'gpt', 'entries': 1, 'hits': 0}]
+    assert cache.prune(['h@v2', 'o@v1']) == 1
+    assert cache.get('h', 'h@v1', 'gpt', GT, VLM) is None
+    assert cache.prune([]) == 2
+
+
+def put_answers(path, worker):
+    cache = AnalysisCache(path)
+    for i in range(20):
+        cache.put('hallucination', 'h@v1', 'gpt', GT, f'{i}. entry', f'worker {worker}')
+    cache.close()
+
+
+def test_processes_share_one_file(tmp_path):
+    path = str(tmp_path / 'memo.sqlite')
+    with multiprocessing.Pool(3) as pool:
+        pool.starmap(put_answers, [(path, worker) for worker in range(3)])
+    cache = AnalysisCache(path)
+    try:
+        assert cache.stats()['total']['entries'] == 20
+        assert cache.get('hallucination', 'h@v1', 'gpt', GT, '7. entry').startswith('worker ')
+    finally:
+        cache.close()
+
+
+def test_cli_reports_and_prunes(cache, capsys):
+    cache.put('hallucination', 'h@v1', 'gpt', GT, VLM, 'answer')
+    analysis_cache.main([cache.path, 'stats'])
+    assert json.loads(capsys.readouterr().out)['total']['entries'] == 1
+    analysis_cache.main([cache.path, 'prune', 'h@v2'])
+    assert capsys.readouterr().out.strip() == 'Dropped 1 answers.'
+
+
+def test_memoized_analyses_skip_the_judge(judge, cache, monkeypatch):
+    monkeypatch.setattr(halfscore, '_analysis_cache', cache)
+    gt, vlm = halfscore.generate_response('A red car.'), halfscore.generate_response('A blue car.')
+    judge.script = ['no json']
+    first = halfscore.call_analysis('hallucination', gt, vlm)
+    calls = len(judge.calls)
+    # Only the valid answer after the re-ask is stored.
+    assert halfscore.call_analysis('hallucination', gt, vlm) == first and len(judge.calls) == calls
+    assert json.loads(first)['serial_numbers'][0]['serial'] == 1
+    assert cache.stats()['process'] == {'hits': 1, 'misses': 1}
+    # Another judge model is not answered from the memo.
+    monkeypatch.setattr(judge, 'model', 'other-judge')
+    halfscore.call_analysis('hallucination', gt, vlm)
+    assert len(judge.calls) == calls + 1
@@ -0,0 +1,114 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import eval as halfscore
+from perturbollava import batch
+from perturbollava.batch import BATCH_DISCOUNT, BatchStore, read_jsonl, run_local, write_batch_requests
+from perturbollava.budget import usage_cost
+
+
+def response_line(custom_id, content=None, status_code=200, error=None):
+    body = {'choices': [{'message': {'content': content}}], 'usage': {'prompt_tokens': 1000, 'completion_tokens': 100}}
+    return {'custom_id': custom_id, 'error': error,
+            'response': None if error else {'status_code': status_code, 'body': body if status_code == 200 else {}}}
+
+
+def write_lines(path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def test_store_ingests_answers_and_errors(tmp_path):
+    responses = tmp_path / 'responses.jsonl'
+    write_lines(responses, [response_line('a', 'answer a'), response_line('b', status_code=500),
+                            response_line('c', error={'code': 'expired'})])
+    store = BatchStore(str(tmp_path / 'store.jsonl'))
+    stats = store.ingest(str(responses))
+    assert (stats['answers'], stats['errors']) == (1, 2)
+    assert stats['failed'] == {'b': 'status 500', 'c': '{"code": "expired"}'}
+    assert stats['cost_usd'] == round(usage_cost({'prompt_tokens': 1000, 'completion_tokens': 100}) * BATCH_DISCOUNT, 4)
+    assert store.answer('a') == 'answer a' and store.answer('b') is None and store.answer('missing') is None
+
+    # A retried request replaces its error; a later error does not replace an answer.
+    write_lines(responses, [response_line('b', 'answer b'), response_line('a', status_code=500)])
+    store.ingest(str(responses))
+    reopened = BatchStore(str(tmp_path / 'store.jsonl'))
+    assert [reopened.answer(custom_id) for custom_id in 'abc'] == ['answer a', 'answer b', None]
+
+
+class Recorder(object):
+    model = 'recorder'
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, messages, response_format=None):
+        self.calls.append((messages, response_format))
+        if messages[0]['content'] == 'bad':
+            raise ValueError('bad request')
+        return {'response': messages[0]['content'].upper(), 'usage': {'prompt_tokens': 3, 'completion_tokens': 1}}
+
+
+def test_run_local_answers_a_request_file(tmp_path):
+    requests, responses = str(tmp_path / 'requests.jsonl'), str(tmp_path / 'responses.jsonl')
+    response_format = {'type': 'json_object'}
+    assert write_batch_requests(requests, [
+        ('1', {'model': 'm', 'messages': [{'role': 'user', 'content': 'hi'}], 'response_format': response_format}),
+        ('2', {'model': 'm', 'messages': [{'role': 'user', 'content': 'bad'}]}),
+    ]) == 2
+    assert next(read_jsonl(requests))['url'] == batch.BATCH_ENDPOINT
+    backend = Recorder()
+    run_local(requests, responses, backend)
+    assert [response_format for _, response_format in backend.calls] == [response_format, None]
+    store = BatchStore(str(tmp_path / 'store.jsonl'))
+    stats = store.ingest(responses)
+    assert store.answer('1') == 'HI'
+    assert (stats['answers'], stats['errors']) == (1, 1) and 'bad request' in stats['failed']['2']
+
+
+def eval_args(tmp_path, ingest=None):
+    return SimpleNamespace(save_path=str(tmp_path / 'journal.jsonl'), batch_store=None, dead_letter_path=None,
+                           batch_ingest=ingest, batch_export=str(tmp_path / 'requests.jsonl'))
+
+
+def test_eval_batch_rounds_match_live_evaluation(judge, tmp_path):
+    args_list = [(0, 'a.jpg', 'A red car on a street.', 'A car.', None, None),
+                 (1, 'b.jpg', 'A tall tree.', '', None, None)]
+    # Round 1 exports the three extractions, round 2 the two analyses, round 3 completes.
+    assert not halfscore.run_batch_round(eval_args(tmp_path), args_list, judge)
+    exported = [record['custom_id'].split(':')[1].split('@')[0] for record in read_jsonl(str(tmp_path / 'requests.jsonl'))]
+    assert exported == ['extract_gt', 'extract_vlm', 'extract_gt']
+    pending = args_list
+    for round_idx in range(2):
+        responses = str(tmp_path / f'responses{round_idx}.jsonl')
+        run_local(str(tmp_path / 'requests.jsonl'), responses, judge)
+        done = halfscore.run_batch_round(eval_args(tmp_path, responses), pending, judge)
+        # Like eval.py's main, later rounds skip the images already in the journal; the empty
+        # caption needs no analyses, so its image completes a round earlier.
+        scored = halfscore.load_scored_records(str(tmp_path / 'journal.jsonl'))
+        pending = [args for args in pending if args[1] not in scored]
+    assert done and pending == []
+    journal = sorted((json.loads(line) for line in open(tmp_path / 'journal.jsonl')), key=lambda record: record['image'])
+    live = [halfscore.process_single_image(args[:4] + (str(tmp_path / 'live.jsonl'), str(tmp_path / 'dead.jsonl')))[0]
+            for args in args_list]
+    assert journal == live
+
+
+def test_eval_batch_reasks_broken_analyses(judge, tmp_path):
+    args_list = [(0, 'a.jpg', 'A red car on a street.', 'A car.', None, None)]
+    halfscore.run_batch_round(eval_args(tmp_path), args_list, judge)
+    responses = str(tmp_path / 'responses.jsonl')
+    run_local(str(tmp_path / 'requests.jsonl'), responses, judge)
+    halfscore.run_batch_round(eval_args(tmp_path, responses), args_list, judge)
+    judge.script = ['not json', '{"serial_numbers": []}']
+    run_local(str(tmp_path / 'requests.jsonl'), responses, judge)
+    assert not halfscore.run_batch_round(eval_args(tmp_path, responses), args_list, judge)
+    reasks = [record['custom_id'] for record in read_jsonl(str(tmp_path / 'requests.jsonl'))]
+    assert len(reasks) == 1 and reasks[0].endswith('#reask1') and ':hallucination@' in reasks[0]
+    run_local(str(tmp_path / 'requests.jsonl'), responses, judge)
+    assert halfscore.run_batch_round(eval_args(tmp_path, responses), args_list, judge)
+    record = json.loads(open(tmp_path / 'journal.jsonl').readline())
+    assert record['hallusion_concepts_idx'] == [1] and record['gt_omission_concepts_idx'] == []
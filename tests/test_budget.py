@@ -0,0 +1,102 @@
+import struct
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+import eval as halfscore
+from perturbollava.budget import (DEFAULT_PRICING, BudgetGovernor, CostEstimate, Pricing, RateLimits, call_cost,
+                                  count_tokens, image_size, image_tokens, sum_usage, usage_cost)
+
+
+def test_count_tokens_grows_with_the_text():
+    assert count_tokens('') == 0
+    assert 0 < count_tokens('A red car.') < count_tokens('A red car parked next to a tall building at night.')
+
+
+def test_image_size_from_png_and_jpeg_headers(tmp_path):
+    png = tmp_path / 'a.png'
+    png.write_bytes(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 640, 480) + b'\x08\x02')
+    jpeg = tmp_path / 'b.jpg'
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    sof0 = b'\xff\xc0' + struct.pack('>HBHH', 17, 8, 300, 200) + bytes(10)
+    jpeg.write_bytes(b'\xff\xd8' + app0 + sof0)
+    other = tmp_path / 'c.gif'
+    other.write_bytes(b'GIF89a' + bytes(20))
+    assert image_size(str(png)) == (640, 480)
+    assert image_size(str(jpeg)) == (200, 300)
+    assert image_size(str(other)) is None
+    assert image_size(str(tmp_path / 'missing.jpg')) is None
+
+
+@pytest.mark.parametrize('size, detail, tokens', [
+    ((512, 512), 'high', 85 + 170),
+    ((1024, 1024), 'high', 85 + 170 * 4),
+    (None, 'high', 85 + 170 * 4),
+    ((4096, 2048), 'high', 85 + 170 * 6),
+    ((4096, 2048), 'low', 85),
+])
+def test_image_tokens(size, detail, tokens):
+    assert image_tokens(size, detail) == tokens
+
+
+def test_cost_estimate_summary():
+    estimate = CostEstimate(Pricing(1.0, 2.0), RateLimits(requests_per_minute=2, tokens_per_minute=1000))
+    estimate.add_call(1000, 500, image_tokens=200)
+    estimate.add_call(800, 200)
+    assert estimate.summary() == {'requests': 2, 'input_tokens': 2000, 'image_tokens': 200, 'output_tokens': 700,
+                                  'cost_usd': 0.0034, 'wall_clock_hours': round(2.7 * 60 / 3600, 3)}
+
+
+def test_usage_cost_and_sum():
+    usage = sum_usage({'prompt_tokens': 1000, 'completion_tokens': 100, 'model': 'x'}, None,
+                      {'prompt_tokens': 500, 'completion_tokens': 50})
+    assert usage == {'prompt_tokens': 1500, 'completion_tokens': 150}
+    assert usage_cost(usage) == pytest.approx(call_cost(1500, 150, DEFAULT_PRICING))
+    assert usage_cost({}) == 0.0
+
+
+def test_governor_reserves_settles_and_stays_exhausted(capsys):
+    governor = BudgetGovernor(1.0)
+    assert governor.reserve(0.6)
+    assert governor.fits(0.4) and not governor.fits(0.5)
+    governor.settle(0.6, 0.2)
+    assert governor.projected == pytest.approx(0.2)
+    assert governor.reserve(0.7)
+    assert not governor.reserve(0.2)
+    assert governor.exhausted and 'Budget cap' in capsys.readouterr().out
+    assert not governor.reserve(0.0) and not governor.fits(0.0)
+    unlimited = BudgetGovernor()
+    assert unlimited.reserve(1e9) and unlimited.fits(1e9)
+
+
+def run_images(monkeypatch, max_cost, actual_fraction, num_images=20, max_inflight=1):
+    gt, vlm = 'A red car is parked on a quiet street.', 'A car on a street.'
+    estimate = halfscore.estimate_image_cost(gt, vlm, DEFAULT_PRICING)
+    # Usage whose cost is actual_fraction of the estimate; None stands for a backend that reports none.
+    tokens = None if actual_fraction is None else int(estimate * actual_fraction * 1e6 / DEFAULT_PRICING.input_per_million)
+    monkeypatch.setattr(halfscore, 'process_image_wrapper', lambda args: (
+        {'image': args[1]}, None if tokens is None else {'prompt_tokens': tokens, 'completion_tokens': 0}))
+    args_list = [(i, f'{i}.jpg', gt, vlm, 'journal.jsonl', 'dead.jsonl') for i in range(num_images)]
+    governor = BudgetGovernor(max_cost * estimate)
+    with ThreadPool(2) as pool:
+        done = list(halfscore.run_within_budget(pool, args_list, governor, DEFAULT_PRICING, max_inflight))
+    return [record['image'] for record in done], governor
+
+
+def test_budget_follows_the_reported_spend(monkeypatch):
+    # Each image reserves its estimate but spends only a quarter of it: images keep being
+    # submitted while the settled spend plus one estimate fits into 2.5 estimates.
+    done, governor = run_images(monkeypatch, 2.5, 0.25)
+    assert done == [f'{i}.jpg' for i in range(7)]
+    assert governor.exhausted
+
+
+def test_reservations_stand_without_usage(monkeypatch):
+    done, _ = run_images(monkeypatch, 2.5, None)
+    assert len(done) == 2
+
+
+def test_unbounded_budget_runs_every_image(monkeypatch):
+    done, governor = run_images(monkeypatch, float('inf'), 1.0, max_inflight=4)
+    assert sorted(done, key=lambda image: int(image.split('.')[0])) == [f'{i}.jpg' for i in range(20)]
+    assert not governor.exhausted
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import eval as halfscore
+from perturbollava.captions import (CAPTION_TEMPLATES, CaptionNormalizer, cap_tokens, flatten_caption,
+                                    register_caption_template)
+
+
+@pytest.mark.parametrize('caption, cleaned', [
+    ('User:<image>Please describe this image in detail.\nAssistant: A red car.<end_of_utterance>', 'A red car.'),
+    ('USER: <image>\nDescribe the image. ASSISTANT: A red car.</s>', 'A red car.'),
+    ('<|im_start|>system\nYou are helpful.<|im_end|>\n<|im_start|>user\nDescribe.<|im_end|>\n'
+     '<|im_start|>assistant\nA red car.<|im_end|>', 'A red car.'),
+    ('<s>[INST] Describe the image. [/INST] A red car. </s>', 'A red car.'),
+    ('  A red   car.\n\n\n\nIt is   parked.  ', 'A red car.\n\nIt is parked.'),
+])
+def test_chat_scaffolding_and_whitespace_are_removed(caption, cleaned):
+    assert CaptionNormalizer()(caption) == cleaned
+
+
+def test_templates_are_selectable():
+    chatml = '<|im_start|>assistant\nA red car.<|im_end|>'
+    assert CaptionNormalizer('none')(chatml) == chatml
+    assert CaptionNormalizer(['vicuna'])(chatml) == chatml
+    assert CaptionNormalizer('chatml')(chatml) == 'A red car.'
+    with pytest.raises(ValueError, match='Unknown caption templates'):
+        CaptionNormalizer(['missing'])
+
+
+def test_registered_templates_are_stripped(monkeypatch):
+    # Unregistered again after the test.
+    monkeypatch.setitem(CAPTION_TEMPLATES, 'test', None)
+    register_caption_template('test', r'^Answer:\s*')
+    assert CaptionNormalizer('test')('Answer: A red car.') == 'A red car.'
+
+
+def test_flatten_nested_generations():
+    assert flatten_caption(['A red car.', ['', 'It is parked.'], None]) == 'A red car.\nIt is parked.'
+    assert flatten_caption(None) == ''
+
+
+def test_boilerplate_and_token_cap():
+    caption = ('A red car is parked. A man walks by.\n'
+               'This detailed description provides a comprehensive understanding of the image.')
+    assert CaptionNormalizer()(caption) == caption
+    assert CaptionNormalizer(strip_boilerplate=True)(caption) == 'A red car is parked. A man walks by.'
+    assert cap_tokens('A red car is parked. A man walks by the car at night.', 7) == 'A red car is parked.'
+    assert cap_tokens('One very long sentence without an end', 1) == 'One very long sentence without an end'
+
+
+def test_report_counts_saved_tokens():
+    normalizer = CaptionNormalizer()
+    normalizer('A red car.')
+    normalizer('USER: Describe. ASSISTANT: A red car.</s>')
+    report = normalizer.report()
+    assert report['captions'] == 2 and report['captions_changed'] == 1
+    assert report['caption_tokens_saved'] == report['caption_tokens_before'] - report['caption_tokens_after'] > 0
+    assert CaptionNormalizer().report()['caption_tokens_saved_pct'] == 0.0
+
+
+def test_eval_loads_normalized_captions(tmp_path):
+    path = tmp_path / 'captions.jsonl'
+    path.write_text(json.dumps({'image': 'a.jpg', 'caption': ['USER: Describe. ASSISTANT: A red car.</s>']}) + '\n')
+    assert halfscore.load_vlm_captions(str(path), CaptionNormalizer()) == {'a.jpg': 'A red car.'}
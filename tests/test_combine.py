@@ -0,0 +1,207 @@
+import json
+
+import pytest
+
+from augmentation import combine
+
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def make_record(record_id, **fields):
+    record = {'image': f'{record_id}.jpg', 'conversations': [{'from': 'human', 'value': '<image>\nDescribe the image.'},
+                                                            {'from': 'gpt', 'value': 'A photo.'}]}
+    if record_id is not None:
+        record['id'] = record_id
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """A main file and two perturbation shards, each with one record lacking an id."""
+    total = [make_record(i) for i in range(30)] + [make_record(None)]
+    shards = tmp_path / 'shards'
+    shards.mkdir()
+    write_json(shards / 'a.json', [make_record(i, perturbation_text=f'text {i}') for i in range(0, 20)]
+               + [make_record(None, perturbation_text='no id')])
+    write_json(shards / 'b.json', [make_record(i, perturbation_text=f'later {i}') for i in range(15, 25)])
+    write_json(tmp_path / 'total.json', total)
+    return tmp_path
+
+
+def run_main(root, name, num_workers, *extra):
+    output = root / name
+    combine.main(['--json_root', str(root / 'shards'), '--total_json_path', str(root / 'total.json'),
+                  '--save_json_path', str(output), '--ratio', '0.5', '--num_workers', str(num_workers), *extra])
+    return output
+
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_records_without_id_are_passed_through(dataset, num_workers):
+    output = json.loads(run_main(dataset, 'out.json', num_workers).read_text())
+    assert len(output) == 31
+    assert 'id' not in output[-1]
+    assert output[-1] == make_record(None)
+    # Later shards override earlier ones for duplicate ids.
+    assert output[16]['perturbation_text'] == 'later 16'
+    assert output[3]['perturbation_text'] == 'text 3'
+    assert 'perturbation_text' not in output[27]
+
+
+
+TRICKY_RECORDS = [
+    {'id': 1, 'text': 'brackets ] [ and , commas', 'nested': {'list': [1, 2.5, -3e2, None, True]}},
+    {'id': 'two', 'text': 'escaped \\" quote and \\\\ backslash\nnewline', 'unicode': 'café ☃'},
+    12345678901234567890,
+    'a bare string',
+    [],
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_iter_json_records_streams_arrays_in_any_chunking(tmp_path, chunk_size):
+    path = tmp_path / 'records.json'
+    path.write_text(json.dumps(TRICKY_RECORDS, indent=2, ensure_ascii=False), encoding='utf-8')
+    assert list(combine.iter_json_records(str(path), chunk_size=chunk_size)) == TRICKY_RECORDS
+
+
+def test_iter_json_records_reads_json_lines_and_returns_source_text(tmp_path):
+    path = tmp_path / 'records.jsonl'
+    lines = [json.dumps(record, ensure_ascii=False) for record in TRICKY_RECORDS]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    pairs = list(combine.iter_json_records(str(path), chunk_size=5, with_text=True))
+    assert [record for record, _ in pairs] == TRICKY_RECORDS
+    assert [text for _, text in pairs] == lines
+
+
+def test_iter_json_records_rejects_an_unterminated_array(tmp_path):
+    path = tmp_path / 'broken.json'
+    path.write_text('[{"id": 1}, {"id": 2}')
+    with pytest.raises(ValueError):
+        list(combine.iter_json_records(str(path)))
+
+
+@pytest.mark.parametrize('indent,jsonl', [(None, False), (4, False), (None, True)])
+@pytest.mark.parametrize('records', [[], TRICKY_RECORDS])
+def test_json_record_writer_round_trips(tmp_path, indent, jsonl, records):
+    path = tmp_path / 'out.json'
+    with combine.JsonRecordWriter(str(path), indent=indent, jsonl=jsonl) as writer:
+        for record in records:
+            writer.write(record)
+    text = path.read_text(encoding='utf-8')
+    if jsonl:
+        assert [json.loads(line) for line in text.splitlines()] == records
+    else:
+        assert json.loads(text) == records
+    if indent is not None and records:
+        assert json.loads(text) == json.loads(json.dumps(records, indent=indent))
+
+
+def test_stream_combine_keeps_a_requested_index(dataset):
+    index = dataset / 'index.sqlite'
+    combine.stream_combine(str(dataset / 'shards'), str(dataset / 'total.json'), str(dataset / 'out.json'),
+                           ratio=1.0, index_path=str(index))
+    assert index.exists()
+    output = json.loads((dataset / 'out.json').read_text())
+    assert [record.get('id') for record in output] == list(range(30)) + [None]
+    assert all(output[i]['conversations'][0]['value'].startswith('<image>\n') for i in range(25))
+    assert all('perturbation_text' in output[i] for i in range(25))
+    # ratio 1.0 inserts every perturbation text, the later shard's for duplicate ids.
+    assert 'text 3' in output[3]['conversations'][0]['value']
+    assert 'later 20' in output[20]['conversations'][0]['value']
+    assert output[27]['conversations'][0]['value'] == '<image>\nDescribe the image.'
+
+
+def test_record_uniforms_depend_only_on_seed_and_id():
+    ids = list(range(200)) + ['a', 'b', 'c']
+    uniforms = combine.record_uniforms(ids, seed=3, num_streams=4)
+    assert uniforms.shape == (203, 4)
+    assert ((uniforms >= 0) & (uniforms < 1)).all()
+    shuffled = ids[::-1]
+    assert (combine.record_uniforms(shuffled, seed=3, num_streams=4) == uniforms[::-1]).all()
+    assert (combine.record_uniforms(ids[:10], seed=3, num_streams=4) == uniforms[:10]).all()
+    assert not (combine.record_uniforms(ids, seed=4, num_streams=4) == uniforms).any()
+    # Streams of one record are not copies of each other.
+    assert len({tuple(column) for column in uniforms.T}) == 4
+
+
+def test_record_uniforms_streams_are_roughly_uniform_and_namespaced():
+    ids = list(range(20000))
+    uniforms = combine.record_uniforms(ids, seed=0)[:, 0]
+    assert abs(uniforms.mean() - 0.5) < 0.01
+    assert abs((uniforms < 0.3).mean() - 0.3) < 0.015
+    image = combine.record_uniforms(ids, seed=0, namespace='image')[:, 0]
+    both = ((uniforms < 0.3) & (image < 0.5)).mean()
+    assert abs(both - 0.15) < 0.015
+
+
+def perturbation_records(count):
+    return [make_record(i, perturbation_text=f'text {i}') for i in range(count)]
+
+
+def test_perturb_records_mixes_the_ratio_reproducibly():
+    records = perturbation_records(1000)
+    count = combine.perturb_records(records, combine_type='version2', ratio=0.3, seed=7)
+    assert 250 < count < 350
+    perturbed = [record['conversations'][0]['value'] for record in records]
+    assert sum(f'text {i} ' in value for i, value in enumerate(perturbed)) == count
+    assert all(value.startswith('<image>\n') and value.endswith('Describe the image.') for value in perturbed)
+
+    again = perturbation_records(1000)[::-1]
+    combine.perturb_records(again, combine_type='version2', ratio=0.3, seed=7)
+    assert [record['conversations'][0]['value'] for record in again[::-1]] == perturbed
+
+
+def test_perturb_records_fills_every_description_slot():
+    records = perturbation_records(50)
+    assert combine.perturb_records(records, combine_type='version1', ratio=1.0) == 50
+    pools = combine.COMBINE_TEMPLATES['version1'].description_pools
+    for i, record in enumerate(records):
+        value = record['conversations'][0]['value']
+        assert any(description in value for description in pools[0])
+        assert any(description in value for description in pools[1])
+        assert value.endswith(f'text {i} ' + next(d for d in pools[1] if d in value) + ' Describe the image.')
+
+
+def test_perturb_records_rejects_unknown_combine_types():
+    with pytest.raises(ValueError, match='Unknown combine type'):
+        combine.perturb_records(perturbation_records(1), combine_type='version9')
+
+
+def test_registered_combine_templates_are_selectable():
+    template = combine.register_combine_template('test-prefix', 'PREFIX {perturbation} | {instruction}')
+    try:
+        records = perturbation_records(3)
+        assert combine.perturb_records(records, combine_type='test-prefix') == 3
+        assert records[0]['conversations'][0]['value'] == '<image>\nPREFIX text 0 | Describe the image.'
+    finally:
+        del combine.COMBINE_TEMPLATES[template.name]
+
+
+@pytest.mark.parametrize('extra', [(), ('--indent', '4'), ('--jsonl',), ('--combine_type', 'version1', '--seed', '5')])
+@pytest.mark.parametrize('num_workers', [2, 3])
+def test_streaming_and_parallel_outputs_match(dataset, extra, num_workers):
+    streamed = run_main(dataset, 'stream.out', 1, *extra).read_bytes()
+    assert run_main(dataset, 'parallel.out', num_workers, *extra).read_bytes() == streamed
+
+
+def test_partition_json_records_splits_by_id_hash(tmp_path):
+    path = tmp_path / 'records.json'
+    write_json(path, [make_record(i) for i in range(40)] + [make_record(None)])
+    parts = [str(tmp_path / f'part_{k}.jsonl') for k in range(3)]
+    assert combine.partition_json_records([str(path)], parts, with_position=True) == 41
+    seen = []
+    for k, part in enumerate(parts):
+        with open(part) as f:
+            for line in f:
+                position, text = line.split('\t', 1)
+                record = json.loads(text)
+                if 'id' in record:
+                    assert combine.partition_of(record['id'], 3) == k
+                else:
+                    assert k == 0
+                seen.append(int(position))
+    assert sorted(seen) == list(range(41))
@@ -0,0 +1,87 @@
+import random
+
+import numpy as np
+import pytest
+
+from augmentation.dedup import DiversityStats, MinHashLSH, shingle_hashes
+
+WORDS = [f'word{i}' for i in range(500)]
+
+
+def random_text(rng, length=80):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def jaccard(a, b):
+    a, b = set(a.tolist()), set(b.tolist())
+    return len(a & b) / len(a | b)
+
+
+def test_shingles_are_case_insensitive_word_ngrams():
+    assert (shingle_hashes('The Red  BOX, on the table') == shingle_hashes('the red box on THE table!')).all()
+    assert len(shingle_hashes('one two three four')) == 2
+    assert len(shingle_hashes('two words')) == 1
+    assert len(shingle_hashes('  ')) == 0
+    assert shingle_hashes('a b c a b c').dtype == np.uint64
+
+
+def test_signature_similarity_estimates_jaccard():
+    rng = random.Random(0)
+    index = MinHashLSH(num_perm=256, bands=32)
+    for _ in range(20):
+        base = random_text(rng).split()
+        edited = base[:]
+        for position in rng.sample(range(len(edited)), rng.randint(1, 20)):
+            edited[position] = rng.choice(WORDS)
+        a, b = shingle_hashes(' '.join(base)), shingle_hashes(' '.join(edited))
+        estimate = (index.signature(a) == index.signature(b)).mean()
+        assert abs(estimate - jaccard(a, b)) < 0.12
+
+
+def test_near_duplicates_are_found_and_distinct_texts_are_not():
+    rng = random.Random(1)
+    index = MinHashLSH(threshold=0.7)
+    texts = [random_text(rng) for _ in range(1500)]
+    for i, text in enumerate(texts):
+        assert index.query(index.signature(shingle_hashes(text))) == []
+        index.insert(i, index.signature(shingle_hashes(text)))
+    assert len(index) == 1500
+    near = texts[1234].split()
+    near[40] = 'changed'
+    matches = index.query(index.signature(shingle_hashes(' '.join(near))))
+    assert matches[0][0] == 1234 and matches[0][1] >= 0.7
+    assert len(matches) == 1
+
+
+def test_bands_must_divide_the_permutations():
+    with pytest.raises(ValueError, match='must divide'):
+        MinHashLSH(num_perm=100, bands=16)
+
+
+def test_diversity_stats_report():
+    stats = DiversityStats()
+    stats.add(shingle_hashes('a b c d'), False)
+    stats.add(shingle_hashes('a b c d'), True)
+    assert stats.report() == {'num_texts': 2, 'near_duplicates': 1, 'near_duplicate_rate': 0.5,
+                              'distinct_ngram_ratio': 0.5}
+    assert DiversityStats().report()['near_duplicate_rate'] == 0.0
+
+
+def test_cli_reports_near_duplicates_across_files(tmp_path, capsys):
+    import json
+
+    from augmentation import dedup
+
+    rng = random.Random(2)
+    text = random_text(rng)
+    first, second = tmp_path / 'a.jsonl', tmp_path / 'b.json'
+    first.write_text('\n'.join(json.dumps({'id': i, 'perturbation_text': t})
+                               for i, t in enumerate([text, random_text(rng), 'no text'])) + '\n')
+    second.write_text(json.dumps([{'id': 'copy', 'perturbation_text': text}, {'id': 'other'}]))
+    dedup.main([str(first), str(second), '--show', '5'])
+    out = capsys.readouterr().out
+    assert 'copy ~ 0 (1.00)' in out
+    reports = json.loads(out[out.index('{'):])
+    assert reports[str(first)]['num_texts'] == 3 and reports[str(first)]['near_duplicates'] == 0
+    assert reports[str(second)] == {'num_texts': 1, 'near_duplicates': 1, 'near_duplicate_rate': 1.0,
+                                    'distinct_ngram_ratio': 1.0}
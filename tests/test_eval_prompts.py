@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import eval as halfscore
+from perturbollava.prompts import DEFAULT_VERSIONS, get_prompt, prompts_digest, select_prompt_versions
+
+
+@pytest.fixture(autouse=True)
+def default_prompts():
+    select_prompt_versions({})
+    yield
+    select_prompt_versions({})
+
+
+def journal_record(image, **fields):
+    record = {'image': image, 'gt_caption': 'gt', 'vlm_caption': 'vlm', 'vlm_num_concepts': 4,
+              'vlm_hallusion_concepts_num': 1, 'gt_num_concepts': 5, 'gt_omission_concepts_num': 2}
+    record.update(fields)
+    return record
+
+
+def write_lines(path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def test_defaults_are_the_structured_analyses():
+    assert DEFAULT_VERSIONS['hallucination'] == DEFAULT_VERSIONS['omission'] == 'v2-json'
+    assert halfscore.eval_prompts_digest() != prompts_digest(halfscore.EVAL_PROMPTS, halfscore.LEGACY_PROMPT_VERSIONS)
+
+
+def test_structured_example_answer_is_only_json():
+    text = get_prompt('hallucination').render(gt_list='', vlm_list='')
+    assert 'Reasoning' not in text and 'Analysis:' not in text
+    example = text.split('exactly as it should be output:\n', 1)[1].split('\n', 1)[0]
+    assert [item['serial'] for item in json.loads(example)['serial_numbers']] == [2, 5, 8, 12, 13]
+
+
+def test_legacy_journal_resumes_with_v1(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    write_lines(path, [journal_record('a.jpg'), journal_record('b.jpg')])
+    assert halfscore.journal_prompt_versions(str(path)) == halfscore.LEGACY_PROMPT_VERSIONS
+
+
+def test_journal_versions_follow_the_majority_digest(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    digest = halfscore.eval_prompts_digest()
+    write_lines(path, [journal_record('a.jpg'), journal_record('b.jpg', prompt_digest=digest),
+                       journal_record('c.jpg', prompt_digest=digest), {'summary': True}])
+    expected = {name: DEFAULT_VERSIONS[name] for name in halfscore.EVAL_PROMPTS}
+    assert halfscore.journal_prompt_versions(str(path)) == expected
+
+
+def test_missing_or_unknown_journal_prompts(tmp_path):
+    assert halfscore.journal_prompt_versions(str(tmp_path / 'missing.jsonl')) is None
+    path = tmp_path / 'journal.jsonl'
+    write_lines(path, [journal_record('a.jpg', prompt_digest='0123456789abcdef')])
+    with pytest.raises(ValueError, match='not registered'):
+        halfscore.journal_prompt_versions(str(path))
+
+
+def run_dry(tmp_path, capsys, *extra):
+    annotations = tmp_path / 'annotations.json'
+    annotations.write_text(json.dumps([{'image': f'{i}.jpg', 'caption': f'A cat number {i}.'} for i in range(3)]))
+    captions = tmp_path / 'captions.jsonl'
+    write_lines(captions, [{'image': f'{i}.jpg', 'caption': 'A dog.'} for i in range(3)])
+    halfscore.main(halfscore.parse_args(['--cap_file', str(annotations), '--cap_file_result', str(captions),
+                                         '--save_path', str(tmp_path / 'journal.jsonl'), '--dry_run', *extra]))
+    output = capsys.readouterr().out
+    return output, json.loads(output[output.index('{\n'):])
+
+
+def test_resume_keeps_the_prompts_of_a_v1_journal(tmp_path, capsys):
+    write_lines(tmp_path / 'journal.jsonl', [journal_record('0.jpg'), journal_record('1.jpg')])
+    output, estimate = run_dry(tmp_path, capsys)
+    assert 'Resuming' in output
+    assert estimate['images'] == 1
+    assert halfscore.eval_prompts_digest() == halfscore.record_prompts_digest(journal_record('0.jpg'))
+
+
+def test_explicit_versions_judge_a_v1_journal_again(tmp_path, capsys):
+    write_lines(tmp_path / 'journal.jsonl', [journal_record('0.jpg'), journal_record('1.jpg')])
+    output, estimate = run_dry(tmp_path, capsys, '--prompt_versions', 'hallucination=v2-json', 'omission=v2-json')
+    assert 'Resuming' not in output
+    assert estimate['images'] == 3
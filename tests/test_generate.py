@@ -0,0 +1,145 @@
+import json
+import random
+import hashlib
+
+from augmentation import generate
+
+VOCABULARY = ('red', 'blue', 'tall', 'small', 'river', 'mountain', 'street', 'window', 'garden', 'bridge', 'cloud',
+              'train', 'market', 'lamp', 'tower', 'field', 'boat', 'forest', 'road', 'roof', 'door', 'stone', 'bird',
+              'horse', 'table', 'chair', 'glass', 'paper', 'light', 'shadow', 'morning', 'evening', 'winter')
+
+
+class FakeJudge(object):
+    """Judge backend answering every turn with text derived from the prompt, so records get distinct perturbations."""
+
+    cooldown = 0.0
+    model = 'fake-judge'
+
+    def encode_image(self, path):
+        return ''
+
+    def payload(self, messages, response_format=None):
+        return {'model': self.model, 'messages': messages}
+
+    def __call__(self, messages, response_format=None):
+        seed = hashlib.sha256(json.dumps(messages).encode('utf-8')).hexdigest()
+        words = random.Random(seed).choices(VOCABULARY, k=40)
+        return {'response': '(Perturbation): ' + ' '.join(words).capitalize() + '.',
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 50}}
+
+
+def make_record(record_id, **fields):
+    record = {'id': record_id, 'image': f'{record_id}.jpg', 'conversations': [
+        {'from': 'human', 'value': f'<image>\nWhat is shown in picture {record_id}?'},
+        {'from': 'gpt', 'value': f'Picture {record_id} shows a scene.'}]}
+    record.update(fields)
+    return record
+
+
+def write_shards(root, shards):
+    root.mkdir()
+    for name, records in shards.items():
+        (root / name).write_text(json.dumps(records))
+
+
+def read_shard(path):
+    return json.loads(path.read_text())
+
+
+def test_every_shard_is_written_in_order_through_one_pool(tmp_path):
+    done = make_record('b2', perturbation_text=' '.join(VOCABULARY) + '.')
+    write_shards(tmp_path / 'src', {
+        'a.json': [make_record(f'a{i}') for i in range(5)],
+        'b.json': [make_record('b0'), make_record('b1'), done],
+        'c.json': [],
+    })
+    out = tmp_path / 'out'
+    out.mkdir()
+    generate.main(FakeJudge(), str(tmp_path / 'src'), str(out), max_threads=2, max_inflight=3)
+
+    shard_a, shard_b = read_shard(out / 'a.json'), read_shard(out / 'b.json')
+    assert [record['id'] for record in shard_a] == [f'a{i}' for i in range(5)]
+    assert all(record['perturbation_text'] for record in shard_a + shard_b)
+    assert shard_b[2] == done
+    assert read_shard(out / 'c.json') == []
+    reports = [json.loads(line) for line in (out / generate.RUN_REPORT_NAME).read_text().splitlines()]
+    assert sorted(report['shard'] for report in reports) == ['a.json', 'b.json', 'c.json']
+    assert {report['shard']: report['num_perturbed'] for report in reports} == {'a.json': 5, 'b.json': 3, 'c.json': 0}
+
+
+class ConstantJudge(FakeJudge):
+    """Judge backend giving every record the same perturbation."""
+
+    def __call__(self, messages, response_format=None):
+        return {'response': '(Perturbation): ' + ' '.join(VOCABULARY).capitalize() + '.',
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 50}}
+
+
+def test_near_duplicates_are_flagged_or_regenerated(tmp_path):
+    write_shards(tmp_path / 'src', {'a.json': [make_record(f'a{i}') for i in range(4)]})
+    for policy in ('flag', 'regenerate'):
+        out = tmp_path / policy
+        out.mkdir()
+        generate.main(ConstantJudge(), str(tmp_path / 'src'), str(out), max_threads=2,
+                      duplicate_policy=policy, max_regenerations=1)
+        shard = read_shard(out / 'a.json')
+        # Whichever record finished first is kept as the original; the rest point at it.
+        originals = [record['id'] for record in shard if 'perturbation_near_duplicate_of' not in record]
+        assert len(originals) == 1
+        assert all(record['perturbation_near_duplicate_of'] == originals[0]
+                   for record in shard if record['id'] not in originals)
+        report = json.loads((out / generate.RUN_REPORT_NAME).read_text())
+        assert report['diversity']['near_duplicates'] == 3
+        assert report['near_duplicates_regenerated'] == (3 if policy == 'regenerate' else 0)
+
+
+def test_dry_run_projects_only_missing_records(tmp_path, capsys):
+    write_shards(tmp_path / 'src', {'a.json': [make_record('a0'), make_record('a1', perturbation_text='Done.')]})
+    summary = generate.dry_run(str(tmp_path / 'src'))
+    assert summary['requests'] == 2 and summary['records_already_done'] == 1
+    estimate = generate.estimate_record_cost(make_record('a0'))
+    assert summary['cost_usd'] == round(estimate, 4) and estimate > 0
+    assert generate.estimate_record_cost(make_record('a1', perturbation_text='Done.')) == 0.0
+
+
+def test_budget_cap_passes_the_rest_of_the_shard_through(tmp_path):
+    write_shards(tmp_path / 'src', {'a.json': [make_record(f'a{i}') for i in range(12)],
+                                    'b.json': [make_record('b0')]})
+    out = tmp_path / 'out'
+    out.mkdir()
+    estimate = generate.estimate_record_cost(make_record('a0'))
+    spent = 2 * generate.usage_cost({'prompt_tokens': 100, 'completion_tokens': 50})
+    # One record in flight: each reserves its estimate and settles at what FakeJudge reports.
+    max_cost = estimate + 5.5 * spent
+    expected = 0
+    while expected * spent + estimate <= max_cost:
+        expected += 1
+    assert expected == 6
+    generate.main(FakeJudge(), str(tmp_path / 'src'), str(out), max_threads=1, max_inflight=1, max_cost=max_cost)
+    shard = read_shard(out / 'a.json')
+    assert len(shard) == 12
+    assert [('perturbation_text' in record) for record in shard] == [True] * expected + [False] * (12 - expected)
+    assert not (out / 'b.json').exists()
+
+
+def test_batch_rounds_match_live_generation(tmp_path):
+    from perturbollava.batch import run_local
+
+    write_shards(tmp_path / 'src', {'a.json': [make_record(f'a{i}') for i in range(3)],
+                                    'b.json': [make_record('b0', perturbation_text=' '.join(VOCABULARY) + '.')]})
+    live, out = tmp_path / 'live', tmp_path / 'out'
+    live.mkdir()
+    out.mkdir()
+    generate.main(FakeJudge(), str(tmp_path / 'src'), str(live), max_threads=1)
+
+    requests, responses, store = (str(tmp_path / name) for name in ('requests.jsonl', 'responses.jsonl', 'store.jsonl'))
+    # The first round exports the first turns, the second round the second turns.
+    for turn in (1, 2):
+        assert generate.export_batch(FakeJudge(), str(tmp_path / 'src'), requests, store) == 3
+        assert all(record['custom_id'].split(':')[2].startswith(f'turn{turn}@')
+                   for record in map(json.loads, open(requests)))
+        run_local(requests, responses, FakeJudge())
+        generate.ingest_batch(str(tmp_path / 'src'), str(out), responses, store)
+    assert generate.export_batch(FakeJudge(), str(tmp_path / 'src'), requests, store) == 0
+    for name in ('a.json', 'b.json'):
+        assert read_shard(out / name) == read_shard(live / name)
@@ -0,0 +1,108 @@
+import json
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from perturbollava import graph_store
+from perturbollava.graph_store import MAX_STRENGTH, GraphStore
+
+GT = ('1. ("object"<|>Red  car<|>shiny)\n2. ("object"<|>street<|>quiet)\n'
+      '3. ("relationship"<|>red car<|>street<|>parked on<|>8)')
+VLM = '1. ("object"<|>RED CAR<|>blue)\n2. ("object"<|>tree<|>tall)\n3. ("relationship"<|>tree<|>car<|>near<|>99999)'
+
+
+def record(image, hallucinated, omitted, **fields):
+    item = {'image': image, 'response_gt': GT, 'response_vlm': VLM,
+            'hallucination_analysis_list': 'Serial Numbers: ' + ', '.join(map(str, hallucinated)),
+            'omission_caption_analysis_list': 'Serial Numbers: ' + ', '.join(map(str, omitted))}
+    item.update(fields)
+    return item
+
+
+@pytest.fixture
+def journals():
+    return {
+        'model_a': [record('1.jpg', [2], [3]), record('2.jpg', [2, 3], [], response_vlm='')],
+        'model_b': [record('1.jpg', [], [1, 2], hallusion_concepts_idx=[1], gt_omission_concepts_idx=[1, 2])],
+    }
+
+
+def test_graphs_and_entries(journals):
+    store = GraphStore.from_journals(journals)
+    assert len(store) == 6 and store.runs.tolist() == ['model_a', 'model_b']
+    graph = store.find('model_a', '1.jpg', 'gt')
+    entries = list(store.graph_entries(graph))
+    assert store.entry_serial[entries].tolist() == [1, 2, 3]
+    assert store.entry_kind[entries].tolist() == [0, 0, 1]
+    assert store.entry_flag[entries].tolist() == [False, False, True]
+    assert [store.names[i] for i in store.entry_src[entries]] == ['RED CAR', 'STREET', 'RED CAR']
+    assert store.names[store.entry_dst[entries[2]]] == 'STREET'
+    assert store.texts[store.entry_text[entries[2]]] == 'parked on' and store.entry_strength[entries[2]] == 8
+    # Empty graphs keep their slot; stored index lists win over re-parsing the analyses.
+    assert len(store.graph_entries(store.find('model_a', '2.jpg', 'vlm'))) == 0
+    vlm = list(store.graph_entries(store.find('model_b', '1.jpg', 'vlm')))
+    assert store.entry_flag[vlm].tolist() == [True, False, False]
+    assert store.find('model_c', '1.jpg', 'gt') is None and store.find('model_a', '9.jpg', 'gt') is None
+
+
+def test_strengths_are_clipped_to_the_column():
+    store = GraphStore.from_journals({'run': [record('1.jpg', [], [])]})
+    vlm = list(store.graph_entries(store.find('run', '1.jpg', 'vlm')))
+    assert store.entry_strength.dtype == np.int16
+    assert store.entry_strength[vlm].tolist() == [-1, -1, MAX_STRENGTH]
+
+
+def test_save_and_load_round_trip(journals, tmp_path):
+    store = GraphStore.from_journals(journals)
+    store.save(str(tmp_path / 'store.npz'))
+    loaded = GraphStore.load(str(tmp_path / 'store.npz'))
+    for key in GraphStore.ARRAYS + GraphStore.TABLES:
+        assert np.array_equal(getattr(loaded, key), getattr(store, key)), key
+        assert getattr(loaded, key).dtype == getattr(store, key).dtype
+    assert loaded.find('model_b', '1.jpg', 'gt') == store.find('model_b', '1.jpg', 'gt')
+
+
+def test_entity_counts_and_top_entities(journals):
+    store = GraphStore.from_journals(journals)
+    names = store.names.tolist()
+    counts = store.entity_counts(side='gt', kind='object')
+    assert counts[names.index('RED CAR')] == 3 and counts[names.index('STREET')] == 3
+    assert store.entity_counts(side='gt', flagged=True, run='model_b')[names.index('RED CAR')] == 1
+    assert store.top_entities(side='vlm') == [{'name': 'RED CAR', 'flagged': 1, 'total': 2, 'rate': 0.5},
+                                              {'name': 'TREE', 'flagged': 1, 'total': 2, 'rate': 0.5}]
+    assert store.top_entities(side='vlm', run='model_a') == [{'name': 'TREE', 'flagged': 1, 'total': 1, 'rate': 1.0}]
+    assert store.top_entities(side='gt', kind='relationship') == [
+        {'name': 'RED CAR', 'flagged': 1, 'total': 3, 'rate': 1 / 3}]
+
+
+def test_exports(journals, tmp_path):
+    store = GraphStore.from_journals(journals)
+    graph = store.to_json_graph(store.find('model_a', '1.jpg', 'gt'))['graph']
+    assert graph['label'] == 'model_a/1.jpg/gt'
+    assert graph['nodes']['RED CAR']['metadata'] == {'attributes': ['shiny'], 'serials': [1], 'flagged': False}
+    assert graph['edges'] == [{'source': 'RED CAR', 'target': 'STREET', 'relation': 'parked on',
+                               'metadata': {'strength': 8, 'serial': 3, 'flagged': True}}]
+    path = tmp_path / 'graph.graphml'
+    store.write_graphml(store.find('model_a', '1.jpg', 'vlm'), str(path))
+    namespace = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+    root = ET.parse(path).getroot()
+    assert sorted(node.get('id') for node in root.iterfind('.//g:node', namespace)) == ['CAR', 'RED CAR', 'TREE']
+    assert [(edge.get('source'), edge.get('target')) for edge in root.iterfind('.//g:edge', namespace)] == [('TREE', 'CAR')]
+
+
+def test_cli(journals, tmp_path, capsys):
+    results = tmp_path / 'results'
+    results.mkdir()
+    for run, records in journals.items():
+        (results / f'{run}.jsonl').write_text(''.join(json.dumps(item) + '\n' for item in records))
+    (results / 'captions.jsonl').write_text(json.dumps({'image': '1.jpg', 'caption': 'A car.'}) + '\n')
+    store_path = str(tmp_path / 'store.npz')
+    graph_store.main(['build', str(results), '--output', store_path])
+    assert json.loads(capsys.readouterr().out)['graphs'] == 6
+    graph_store.main(['top', store_path, '--side', 'vlm', '--run', 'model_a'])
+    assert json.loads(capsys.readouterr().out)['name'] == 'TREE'
+    graph_store.main(['export', store_path, 'model_b', '1.jpg', '--output', str(tmp_path / 'graph.json')])
+    assert json.loads((tmp_path / 'graph.json').read_text())['graph']['label'] == 'model_b/1.jpg/vlm'
+    with pytest.raises(SystemExit):
+        graph_store.main(['export', store_path, 'model_b', '2.jpg', '--output', str(tmp_path / 'missing.json')])
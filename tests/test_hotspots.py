@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from perturbollava import hotspots
+from perturbollava.graph_store import GraphStore
+from perturbollava.hotspots import CATEGORIES, attribute_category, entry_categories, normalize_entity
+
+VLM = ('1. ("object"<|>dog<|>two)\n2. ("object"<|>dog<|>brown)\n3. ("object"<|>cat<|>black)\n'
+       '4. ("object"<|>ball<|>red)\n5. ("object"<|>ball<|>on the left)\n6. ("relationship"<|>dog<|>ball<|>chasing<|>7)')
+GT = '1. ("object"<|>Dogs<|>brown)\n2. ("object"<|>ball<|>red)'
+
+
+def journal_record(image, hallucinated, omitted=()):
+    return {'image': image, 'response_gt': GT, 'response_vlm': VLM, 'hallusion_concepts_idx': list(hallucinated),
+            'gt_omission_concepts_idx': list(omitted)}
+
+
+@pytest.fixture
+def store():
+    return GraphStore.from_journals({
+        'model_a': [journal_record('1.jpg', [1, 3, 5, 6], [2])],
+        'model_b': [journal_record('1.jpg', [3], [1]), journal_record('2.jpg', [3, 1])],
+    })
+
+
+@pytest.mark.parametrize('name, entity', [('The Dogs', 'dog'), ('puppies', 'puppy'), ('Boxes', 'box'),
+                                          ('glass', 'glass'), ('bus', 'bus'), ('an  old  Bench', 'old bench'),
+                                          ('the', 'the'), ('', '')])
+def test_normalize_entity(name, entity):
+    assert normalize_entity(name) == entity
+
+
+@pytest.mark.parametrize('text, category', [('two', 'counting'), ('3 of them', 'counting'), ('on the left', 'position'),
+                                            ('in the background', 'position'), ('brown', 'attribute')])
+def test_attribute_category(text, category):
+    assert CATEGORIES[attribute_category(text)] == category
+
+
+def test_entry_categories(store):
+    graph = store.find('model_a', '1.jpg', 'vlm')
+    categories = entry_categories(store)[list(store.graph_entries(graph))]
+    # The flagged count of a dog with an unflagged colour is a counting error; the cat is
+    # wrong as a whole; the ball's flagged position is a position error.
+    assert [CATEGORIES[c] for c in categories] == ['counting', 'attribute', 'object', 'attribute', 'position',
+                                                   'relationship']
+
+
+def test_hotspot_tables(store):
+    tables = hotspots.hotspots(store, side='vlm')
+    assert tables['categories']['model_a'] == {'object': 1, 'attribute': 0, 'counting': 1, 'position': 1,
+                                               'relationship': 1, 'entries': 6}
+    assert tables['categories']['model_b'] == {'object': 2, 'attribute': 0, 'counting': 1, 'position': 0,
+                                               'relationship': 0, 'entries': 12}
+    # Equally often flagged entities rank by how often they occur.
+    assert tables['entities'][:2] == [{'entity': 'dog', 'flagged': 3, 'total': 9, 'rate': 1 / 3, 'runs': 2},
+                                      {'entity': 'cat', 'flagged': 3, 'total': 3, 'rate': 1.0, 'runs': 2}]
+    assert tables['entities'][2]['entity'] == 'ball'
+    assert tables['entity_categories'][:2] == [{'entity': 'cat', 'category': 'object', 'flagged': 3},
+                                               {'entity': 'dog', 'category': 'counting', 'flagged': 2}]
+    assert [row['entity'] for row in hotspots.hotspots(store, side='vlm', min_total=7)['entities']] == ['dog']
+    # The GT graphs name the dog 'Dogs'.
+    omissions = hotspots.hotspots(store, side='gt')
+    assert omissions['entities'] == [{'entity': 'ball', 'flagged': 1, 'total': 3, 'rate': 1 / 3, 'runs': 1},
+                                     {'entity': 'dog', 'flagged': 1, 'total': 3, 'rate': 1 / 3, 'runs': 1}]
+
+
+def test_cli(store, tmp_path, capsys):
+    store.save(str(tmp_path / 'store.npz'))
+    output = tmp_path / 'hotspots.json'
+    hotspots.main(['--store', str(tmp_path / 'store.npz'), '--min_total', '1', '--output', str(output)])
+    printed = capsys.readouterr().out
+    assert printed.splitlines()[0].split() == ['run', 'entries'] + list(CATEGORIES)
+    assert json.loads(output.read_text()) == json.loads(json.dumps(hotspots.hotspots(store, k=30)))
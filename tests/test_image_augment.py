@@ -0,0 +1,89 @@
+import json
+import os
+import tarfile
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+import numpy as np
+
+from augmentation import combine, image_augment
+from augmentation.image_augment import IMAGE_AUGMENTATIONS, augment_batch, synthetic_batch
+
+
+def test_draws_depend_only_on_record_id_and_seed():
+    images = synthetic_batch(6, 32, seed=1)
+    ids = [f'r{i}' for i in range(6)]
+    first, second = images.copy(), images.copy()
+    ops = augment_batch(first, ids, seed=3)
+    assert augment_batch(second, ids, seed=3) == ops and np.array_equal(first, second)
+    # An image is perturbed the same way in any batch.
+    alone = images[4:5].copy()
+    assert augment_batch(alone, ids[4:5], seed=3) == ops[4:5] and np.array_equal(alone[0], first[4])
+    assert augment_batch(images.copy(), ids, seed=4) != ops
+    for record_ops, before, after in zip(ops, images, first):
+        assert [op['op'] for op in record_ops] == [name for name in IMAGE_AUGMENTATIONS
+                                                    if name in {op['op'] for op in record_ops}]
+        assert np.array_equal(before, after) == (record_ops == [])
+
+
+def test_augmentations_follow_their_probabilities():
+    ids = list(range(2000))
+    ops = augment_batch(np.zeros((len(ids), 8, 8, 3), dtype=np.uint8), ids, seed=0)
+    for name, augmentation in IMAGE_AUGMENTATIONS.items():
+        rate = np.mean([any(op['op'] == name for op in record_ops) for record_ops in ops])
+        assert abs(rate - augmentation.probability) < 0.05, name
+    only_blur = augment_batch(np.zeros((len(ids), 8, 8, 3), dtype=np.uint8), ids, augmentations=('blur',))
+    assert {op['op'] for record_ops in only_blur for op in record_ops} == {'blur'}
+
+
+def test_occlusion_paints_the_described_box():
+    batch = np.zeros((1, 64, 64, 3), dtype=np.uint8)
+    params = np.array([[0.5, 0.25, 0.75, 0.1, 0.5, 0.9]])
+    (description,) = image_augment.occlusion_patch(batch, np.array([0]), params)
+    left, top, width, height = description['box']
+    assert (batch[0, top:top + height, left:left + width] == description['color']).all()
+    assert batch[0].any(axis=2).sum() == width * height
+
+
+def test_square_image_pads_with_the_mean_color():
+    image = np.full((20, 40, 3), 100, dtype=np.uint8)
+    image[:, :20] = 50
+    squared = image_augment.square_image(image, 40)
+    assert squared.shape == (40, 40, 3)
+    assert (squared[0, 0] == 75).all() and (squared[20, 5] == 50).all()
+
+
+def test_augment_images_writes_tar_shards_for_combine(tmp_path):
+    image_root, json_root, output_root = tmp_path / 'images', tmp_path / 'json', tmp_path / 'out'
+    image_root.mkdir()
+    json_root.mkdir()
+    for i, image in enumerate(synthetic_batch(8, 48, seed=2)):
+        cv2.imwrite(str(image_root / f'{i}.jpg'), image[:, :40])
+    records = [{'id': f'r{i}', 'image': f'{i}.jpg', 'conversations': [{'from': 'human', 'value': '<image>\nWhat?'}]}
+               for i in range(8)]
+    records.append({'id': 'missing', 'image': 'missing.jpg', 'conversations': [{'from': 'human', 'value': 'What?'}]})
+    records.append({'image': '0.jpg', 'conversations': [{'from': 'human', 'value': 'No id?'}]})
+    (json_root / 'a.json').write_text(json.dumps(records))
+    (json_root / 'b.json').write_text('[]')
+
+    manifest = image_augment.augment_images(str(json_root), str(output_root), str(image_root), image_size=32,
+                                            batch_size=3, seed=1, num_workers=2)
+    shard = json.loads((output_root / 'a.json').read_text())
+    augmented = [record for record in shard if 'perturbation_image' in record]
+    assert manifest['records'] == 10 and manifest['missing'] == 1 and manifest['augmented'] == len(augmented) > 0
+    assert shard[-2:] == records[-2:]
+    assert json.loads((output_root / 'b.json').read_text()) == []
+    with tarfile.open(output_root / 'images' / 'a.tar') as tar:
+        assert sorted(tar.getnames()) == sorted(record['perturbation_image'] for record in augmented)
+    assert image_augment.extract_images(str(output_root), str(image_root)) == len(augmented)
+    first = augmented[0]
+    assert cv2.imread(str(image_root / first['perturbation_image'])).shape == (32, 32, 3)
+    assert all(record['perturbation_image_ops'] for record in augmented)
+    assert {op['op'] for record in augmented for op in record['perturbation_image_ops']} <= set(IMAGE_AUGMENTATIONS)
+
+    # combine.py swaps the perturbed image in; id-less records are skipped.
+    assert combine.perturb_records(shard, combine_type='image') == len(augmented)
+    assert {record['image'] for record in shard if record.get('id') in {r['id'] for r in augmented}} == \
+        {record['perturbation_image'] for record in augmented}
+    assert os.path.exists(image_root / shard[0]['image'])
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from perturbollava.judge import (JUDGE_BACKENDS, JudgeBackend, OpenAICompatibleBackend, SignedHeaderBackend,
+                                 build_judge_backend)
+from perturbollava.retry import is_retryable
+
+MESSAGES = [{'role': 'user', 'content': 'Describe the image.'}]
+RESPONSE_FORMAT = {'type': 'json_schema', 'json_schema': {'name': 'analysis', 'schema': {'type': 'object'}}}
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions with the request echoed back; status 429 when asked to."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append({'path': self.path, 'headers': dict(self.headers), 'body': body})
+        status = 429 if body['messages'][-1]['content'] == 'busy' else 200
+        reply = json.dumps({'choices': [{'message': {'content': body['messages'][-1]['content'].upper()}}],
+                            'usage': {'prompt_tokens': 7, 'completion_tokens': 3}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    pytest.importorskip('requests')
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ChatCompletionsHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_openai_compatible_backend(server):
+    url = f'http://127.0.0.1:{server.server_address[1]}/v1/'
+    judge = build_judge_backend('openai', base_url=url, api_key='secret', model='local-model', temperature=0.0)
+    assert judge(MESSAGES, RESPONSE_FORMAT) == {'response': 'DESCRIBE THE IMAGE.',
+                                                 'usage': {'prompt_tokens': 7, 'completion_tokens': 3}}
+    request = server.requests[0]
+    assert request['path'] == '/v1/chat/completions'
+    assert request['headers']['Authorization'] == 'Bearer secret'
+    assert request['body'] == {'model': 'local-model', 'messages': MESSAGES, 'max_tokens': 4096, 'temperature': 0.0,
+                               'response_format': RESPONSE_FORMAT}
+
+
+def test_rate_limited_answers_are_retryable(server, monkeypatch):
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    judge = OpenAICompatibleBackend(base_url=f'http://127.0.0.1:{server.server_address[1]}/v1')
+    with pytest.raises(Exception) as info:
+        judge([{'role': 'user', 'content': 'busy'}])
+    assert is_retryable(info.value)
+    assert 'Authorization' not in server.requests[0]['headers']
+
+
+def test_payload_options():
+    judge = JudgeBackend(model='m', max_tokens=10, structured_outputs=False)
+    assert judge.payload(MESSAGES, RESPONSE_FORMAT) == {'model': 'm', 'messages': MESSAGES, 'max_tokens': 10}
+
+
+class SlowEcho(JudgeBackend):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, messages, response_format=None):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.02 * (5 - messages))
+        with self.lock:
+            self.active -= 1
+        return messages * 10
+
+
+def test_batch_keeps_the_request_order():
+    judge = SlowEcho(max_batch_size=3)
+    assert judge.batch([0, 1, 2, 3, 4]) == [0, 10, 20, 30, 40]
+    assert judge.peak == 3
+    assert judge.batch([1, 2], call=lambda request: -request) == [-1, -2]
+    serial = SlowEcho(max_batch_size=1)
+    assert serial.batch([0, 1, 2]) == [0, 10, 20] and serial.peak == 1
+
+
+def test_batch_reraises_failures():
+    def call(request):
+        if request == 2:
+            raise TimeoutError()
+        return request
+
+    with pytest.raises(TimeoutError):
+        JudgeBackend().batch([1, 2, 3], call=call)
+
+
+def test_registry():
+    # eval.py registers its configured gateway under the same name.
+    assert issubclass(JUDGE_BACKENDS['signed'], SignedHeaderBackend)
+    judge = SignedHeaderBackend(url='http://gateway', configs=[{'appid': 'a', 'source': 's', 'appkey': 'k'}])
+    assert judge.cooldown == 2.0 and judge.model == 'gpt-4o'
+    assert len(judge.calcAuthorization(judge.configs[0])[0]) == 64
+    with pytest.raises(ValueError, match='Unknown judge backend'):
+        build_judge_backend('missing')
+
+
+def test_eval_sends_structured_analyses_through_the_backend(judge, tmp_path):
+    import eval as halfscore
+
+    args = (0, 'a.jpg', 'A red car on a street.', 'A car.', str(tmp_path / 'journal.jsonl'), str(tmp_path / 'dead.jsonl'))
+    record, usage = halfscore.process_single_image(args)
+    calls = {name: [response_format for called, _, response_format in judge.calls if called == name]
+             for name in halfscore.EVAL_PROMPTS}
+    assert calls['extraction'] == [None, None]
+    assert calls['hallucination'][0]['type'] == calls['omission'][0]['type'] == 'json_schema'
+    assert usage == {'prompt_tokens': 40, 'completion_tokens': 20}
+    assert record['hallusion_concepts_idx'] == record['gt_omission_concepts_idx'] == [1]
@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+
+from perturbollava import leaderboard
+from perturbollava.leaderboard import LeaderboardIndex
+from perturbollava.scoring import score_image
+
+
+def image_record(image, vlm, hallucinated, gt, omitted):
+    return score_image({'image': image, 'vlm_num_concepts': vlm, 'vlm_hallusion_concepts_num': hallucinated,
+                        'gt_num_concepts': gt, 'gt_omission_concepts_num': omitted})
+
+
+def write_lines(path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        for record in records:
+            f.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+
+
+@pytest.fixture
+def results(tmp_path):
+    root = tmp_path / 'results'
+    write_lines(root / 'model_a' / 'eval.jsonl', [
+        image_record('1.jpg', 4, 0, 4, 0), image_record('2.jpg', 4, 2, 4, 2), 'not json',
+        {'hallucination_score': 0.0, 'recall_score': 0.0, 'f_score': 0.0}])
+    write_lines(root / 'model_b' / 'eval.jsonl', [image_record('1.jpg', 4, 2, 4, 1), image_record('2.jpg', 4, 0, 4, 0)])
+    write_lines(root / 'model_c' / 'score.jsonl', [{'hallucination_score': 0.9, 'recall_score': 0.9, 'f_score': 0.9}])
+    write_lines(root / 'captions.jsonl', [{'image': '1.jpg', 'caption': 'A car.'}])
+    index = LeaderboardIndex(str(tmp_path / 'index.sqlite'), str(root))
+    yield root, index
+    index.close()
+
+
+def test_journals_are_ingested_once_until_they_change(results):
+    root, index = results
+    assert index.update() == 4
+    assert index.update() == 0
+    assert index.runs() == ['model_a/eval', 'model_b/eval', 'model_c/score']
+    write_lines(root / 'model_b' / 'eval.jsonl', [image_record('1.jpg', 4, 0, 4, 0)])
+    assert index.update() == 1
+    assert [row['image'] for row in index.worst('model_b/eval')] == ['1.jpg']
+    os.remove(root / 'model_c' / 'score.jsonl')
+    assert index.update() == 0
+    assert index.runs() == ['model_a/eval', 'model_b/eval']
+
+
+def test_leaderboard_aggregates_image_counts(results):
+    _, index = results
+    index.update()
+    rows = {row['run']: row for row in index.leaderboard()}
+    assert [row['run'] for row in index.leaderboard()] == ['model_c/score', 'model_b/eval', 'model_a/eval']
+    # Per-image counts win over a stale summary line.
+    assert rows['model_a/eval']['source'] == 'images' and rows['model_a/eval']['images'] == 2
+    assert rows['model_a/eval']['hallucination_score'] == pytest.approx(0.75)
+    assert rows['model_b/eval']['recall_score'] == pytest.approx(1 - 1 / 8)
+    assert rows['model_c/score'] == {'hallucination_score': 0.9, 'recall_score': 0.9, 'f_score': 0.9,
+                                     'run': 'model_c/score', 'images': None, 'source': 'summary'}
+
+
+def test_diff_worst_and_run_names(results):
+    _, index = results
+    index.update()
+    diff = index.diff('model_a/eval', 'model_b/eval')
+    assert [(row['image'], row['delta']) for row in diff] == [('2.jpg', pytest.approx(0.5)), ('1.jpg', pytest.approx(-0.4))]
+    assert [row['image'] for row in index.worst('model_a/eval', k=1)] == ['2.jpg']
+    with pytest.raises(ValueError):
+        index.worst('model_a/eval', key='vlm_num_concepts')
+    assert index.resolve_run('model_b') == 'model_b/eval'
+    with pytest.raises(ValueError, match='matches'):
+        index.resolve_run('eval')
+
+
+def test_cli(results, capsys):
+    root, _ = results
+    leaderboard.main(['--results_dir', str(root), 'worst', 'model_a', '-k', '1'])
+    assert json.loads(capsys.readouterr().out)['image'] == '2.jpg'
+    assert os.path.exists(root / '.halfscore_index.sqlite')
+    with pytest.raises(SystemExit):
+        leaderboard.main(['--results_dir', str(root), 'diff', 'eval', 'model_b'])
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from augmentation import generate
+from augmentation.priority import HotspotPrioritizer
+
+TABLES = {
+    'side': 'vlm',
+    'categories': {'model_a': {'object': 6, 'attribute': 0, 'counting': 3, 'position': 1, 'relationship': 0,
+                               'entries': 100}},
+    'entities': [{'entity': 'dog', 'flagged': 4}, {'entity': 'fire hydrant', 'flagged': 2}, {'entity': '', 'flagged': 9}],
+}
+
+
+def make_record(record_id, question, answer='It is there.', **fields):
+    record = {'id': record_id, 'image': f'{record_id}.jpg', 'conversations': [
+        {'from': 'human', 'value': f'<image>\n{question}'}, {'from': 'gpt', 'value': answer}]}
+    record.update(fields)
+    return record
+
+
+def test_scores_follow_the_hotspots():
+    prioritizer = HotspotPrioritizer(TABLES)
+    assert prioritizer.entity_weights == {'dog': 1.0, 'fire hydrant': 0.5}
+    assert prioritizer.category_weights == {'object': 0.6, 'attribute': 0.0, 'counting': 0.3, 'position': 0.1,
+                                            'relationship': 0.0}
+    assert prioritizer('What is in the sky?') == 0.0
+    assert prioritizer('What color are the dogs?') == pytest.approx(1.0 + 0.6)
+    assert prioritizer('How many dogs are near the fire hydrant?') == pytest.approx(1.5 + 0.6 + 0.3 + 0.1)
+    assert prioritizer('What is this?', 'A dog.') == pytest.approx(1.6)
+    assert HotspotPrioritizer(TABLES, category_weight=0.0)('How many dogs?') == pytest.approx(1.0)
+
+
+def test_prioritizer_from_file(tmp_path):
+    path = tmp_path / 'hotspots.json'
+    path.write_text(json.dumps(TABLES))
+    assert HotspotPrioritizer.from_file(str(path)).entity_weights['dog'] == 1.0
+    assert HotspotPrioritizer({'entities': []})('How many dogs?') == 0.0
+
+
+@pytest.fixture
+def shards(tmp_path):
+    root = tmp_path / 'src'
+    root.mkdir()
+    (root / 'a.json').write_text(json.dumps([make_record('a0', 'What is in the sky?'),
+                                             make_record('a1', 'Is there a fire hydrant?'),
+                                             make_record('a2', 'What is the dog doing?', perturbation_text='Done.')]))
+    (root / 'b.json').write_text(json.dumps([make_record('b0', 'How many dogs are there?'),
+                                             make_record('b1', 'What is on the table?')]))
+    return generate.get_sorted_json_filepaths(str(root))
+
+
+def test_plan_selects_the_best_records(shards):
+    plan = generate.plan_generation(shards, HotspotPrioritizer(TABLES), max_records=2)
+    assert plan['selected'] == {(1, 0), (0, 1)}
+    assert plan['shard_order'] == [1, 0]
+    assert plan['record_order'] == {0: [1, 0, 2], 1: [0, 1]}
+    assert plan['report']['candidates'] == 4 and plan['report']['selected_on_hotspots'] == 2
+    assert plan['report']['projected_cost'] is None
+
+
+def test_plan_stays_within_the_budget(shards):
+    cost = generate.estimate_record_cost(make_record('b0', 'How many dogs are there?'))
+    plan = generate.plan_generation(shards, HotspotPrioritizer(TABLES), max_cost=cost * 1.5)
+    assert plan['selected'] == {(1, 0)}
+    assert plan['report']['projected_cost'] == round(cost, 4)
+    everything = generate.plan_generation(shards, HotspotPrioritizer(TABLES))
+    assert len(everything['selected']) == 4
+
+
+def test_generate_only_perturbs_selected_records(shards, tmp_path):
+    from test_generate import FakeJudge
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    generate.main(FakeJudge(), str(tmp_path / 'src'), str(out), max_threads=1,
+                  prioritizer=HotspotPrioritizer(TABLES), max_records=2)
+    perturbed = {record['id'] for name in ('a.json', 'b.json') for record in json.loads((out / name).read_text())
+                 if 'perturbation_text' in record}
+    assert perturbed == {'a1', 'a2', 'b0'}
+    assert [record['id'] for record in json.loads((out / 'a.json').read_text())] == ['a0', 'a1', 'a2']
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from perturbollava import prompts
+from perturbollava.prompts import PromptTemplate, register_prompt
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty prompt registry, so test registrations do not leak."""
+    monkeypatch.setattr(prompts, 'PROMPT_TEMPLATES', {})
+    monkeypatch.setattr(prompts, 'DEFAULT_VERSIONS', {})
+    monkeypatch.setattr(prompts, '_active_versions', {})
+    return prompts
+
+
+@pytest.mark.parametrize('text,style,args,kwargs,expected', [
+    ('Hi {name}, {{literal}} {name}!', 'format', (), {'name': 'Ann'}, 'Hi Ann, {literal} Ann!'),
+    ('%s is 100%% %s', 'percent', ('tea', 'hot'), {}, 'tea is 100% hot'),
+    ('no slots {{}}', 'format', (), {}, 'no slots {}'),
+])
+def test_render_matches_python_formatting(text, style, args, kwargs, expected):
+    template = PromptTemplate('t', 'v1', text, style)
+    assert template.render(*args, **kwargs) == expected
+    assert expected == (text % args if style == 'percent' else text.format(**kwargs))
+
+
+def test_static_prefix_and_empty_rendering():
+    template = PromptTemplate('t', 'v1', 'Rules {{json}}.\nGT: {gt}\nVLM: {vlm}', 'format')
+    assert template.slots == ['gt', 'vlm']
+    assert template.static_prefix == 'Rules {json}.\nGT: '
+    assert template.render_empty() == 'Rules {json}.\nGT: \nVLM: '
+    with pytest.raises(TypeError):
+        PromptTemplate('t', 'v1', '%s and %s', 'percent').render('one')
+
+
+@pytest.mark.parametrize('text,style', [('{0}', 'format'), ('{name!r}', 'format'), ('{a.b}', 'format'),
+                                        ('{name:>4}', 'format'), ('plain', 'jinja')])
+def test_unsupported_templates_are_rejected(text, style):
+    with pytest.raises(ValueError):
+        PromptTemplate('t', 'v1', text, style)
+
+
+def test_digest_follows_text_style_and_schema():
+    base = PromptTemplate('t', 'v1', 'Hello {x}')
+    assert PromptTemplate('t', 'v9', 'Hello {x}').digest == base.digest
+    assert PromptTemplate('t', 'v1', 'Hello {y}').digest != base.digest
+    assert PromptTemplate('t', 'v1', 'Hello {x}', schema={'type': 'object'}).digest != base.digest
+    assert base.key == f't@v1:{base.digest}'
+    assert base.response_format() is None
+    assert PromptTemplate('t', 'v1', 'x', schema={'type': 'object'}).response_format()['json_schema']['strict']
+
+
+def test_registry_defaults_and_selection(registry):
+    first = register_prompt('greet', 'v1', 'Hello {name}')
+    second = register_prompt('greet', 'v2', 'Hi {name}')
+    assert register_prompt('greet', 'v1', 'Hello {name}').key == first.key
+    with pytest.raises(ValueError, match='different text'):
+        register_prompt('greet', 'v1', 'Howdy {name}')
+    assert registry.get_prompt('greet').key == first.key
+    digest = registry.prompts_digest()
+
+    registry.select_prompt_versions({'greet': 'v2'})
+    assert registry.get_prompt('greet').key == second.key
+    assert registry.active_prompts() == {'greet': second.key}
+    assert registry.prompts_digest() != digest
+    assert registry.prompts_digest(versions={'greet': 'v1'}) == digest
+    with pytest.raises(ValueError, match='Unknown prompt'):
+        registry.select_prompt_versions({'greet': 'v3'})
+
+    register_prompt('greet', 'v3', 'Yo {name}', default=True)
+    registry.select_prompt_versions({})
+    assert registry.get_prompt('greet').version == 'v3'
+
+
+def test_find_prompt_versions_recovers_a_digest(registry):
+    for name in ('a', 'b'):
+        for version in ('v1', 'v2'):
+            register_prompt(name, version, f'{name} {version} {{x}}')
+    digest = registry.prompts_digest(['a', 'b'], {'a': 'v2', 'b': 'v1'})
+    assert registry.find_prompt_versions(['b', 'a'], digest) == {'a': 'v2', 'b': 'v1'}
+    assert registry.find_prompt_versions(['a', 'b'], 'not-a-digest') is None
+
+
+def test_prompt_files_and_command_line_versions(registry, tmp_path):
+    path = tmp_path / 'prompts.json'
+    path.write_text(json.dumps({'greet': {'v1': 'Hello {name}',
+                                          'v2': {'text': 'Hi %s', 'style': 'percent', 'schema': {'type': 'object'}}}}))
+    templates = registry.load_prompt_file(str(path))
+    assert [template.key.split(':')[0] for template in templates] == ['greet@v1', 'greet@v2']
+    assert templates[1].render('Ann') == 'Hi Ann' and templates[1].schema == {'type': 'object'}
+    assert registry.parse_prompt_versions(['greet=v2', 'other=v1']) == {'greet': 'v2', 'other': 'v1'}
+    assert registry.parse_prompt_versions(None) == {}
+    with pytest.raises(ValueError):
+        registry.parse_prompt_versions(['greet'])
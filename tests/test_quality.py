@@ -0,0 +1,39 @@
+import pytest
+
+from augmentation.generate import check_quality, ShardWriter
+from augmentation.quality import QualityFilter
+
+BODY = ' '.join(f'word{i}' for i in range(40))
+
+
+@pytest.mark.parametrize('text, answer, reasons', [
+    (BODY + '.', None, []),
+    ('"' + BODY + '."', None, []),
+    ('  \n ', None, ['empty']),
+    ('Too short.', None, ['too_short']),
+    (BODY, None, ['truncated']),
+    ("I'm sorry, " + BODY + '.', None, ['refusal']),
+    ('As an AI I cannot help with that ' + BODY + '.', None, ['refusal']),
+    ('The red car is parked by the old bridge. ' + BODY + '.', 'The red car is parked by the old bridge', ['answer_leak']),
+    ('The red car. ' + BODY + '.', 'The red car is parked by the old bridge', []),
+    (BODY + '.', 'Yes', []),
+])
+def test_filter_reasons(text, answer, reasons):
+    assert QualityFilter()(text, answer) == reasons
+
+
+def test_limits_are_configurable():
+    quality_filter = QualityFilter(min_words=1, max_words=5, max_answer_overlap=0.9)
+    assert quality_filter('one two three four five six') == ['too_long', 'truncated']
+    assert quality_filter('one two three.', 'one two three four') == []
+
+
+def test_check_quality_counts_on_the_shard(tmp_path):
+    writer = ShardWriter('shard.json', str(tmp_path), 2)
+    record = {'image': 'a.jpg', 'conversations': [{'from': 'human', 'value': '<image>\nWhat is it?'},
+                                               {'from': 'gpt', 'value': 'The red car is parked by the old bridge'}]}
+    assert check_quality(QualityFilter(), writer, dict(record, perturbation_text=BODY + '.')) == []
+    leaked = dict(record, perturbation_text='The red car is parked by the old bridge, ' + BODY)
+    assert check_quality(QualityFilter(), writer, leaked) == ['truncated', 'answer_leak']
+    assert writer.stats['quality_passed'] == writer.stats['quality_failed'] == 1
+    assert writer.quality_failures == {'truncated': 1, 'answer_leak': 1}
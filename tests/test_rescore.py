@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import eval as halfscore
+from perturbollava import rescore
+from perturbollava.prompts import select_prompt_versions
+from perturbollava.scoring import aggregate_scores, f_beta, parse_analysis, precision_recall
+
+GT = '1. ("object"<|>car<|>red)\n2. ("object"<|>street<|>quiet)\n3. ("relationship"<|>car<|>street<|>on<|>8)'
+VLM = '1. ("object"<|>car<|>blue)\n2. ("object"<|>tree<|>tall)'
+
+
+@pytest.fixture(autouse=True)
+def legacy_prompts():
+    # Journals of the free-text prompts, whose answers may list repeated or unknown serials.
+    select_prompt_versions(halfscore.LEGACY_PROMPT_VERSIONS)
+    yield
+    select_prompt_versions({})
+
+
+def record(image, hallucination, omission, response_gt=GT, response_vlm=VLM):
+    return halfscore.build_eval_record(image, 'gt caption', 'vlm caption', response_gt, response_vlm,
+                                       hallucination, omission)
+
+
+def write_journal(path, records):
+    with open(path, 'w') as f:
+        for item in records:
+            f.write(json.dumps(item) + '\n')
+        f.write(json.dumps({'hallucination_score': 0.5}) + '\n')
+        f.write(json.dumps({'image': 'failed.jpg', 'gt_caption': 'gt', 'vlm_caption': 'vlm'}) + '\n')
+
+
+def test_precision_recall_and_f_beta():
+    h, q = precision_recall([4, 0], [1, 0], [5, 2], [2, 2])
+    assert h.tolist() == [0.75, 0.0] and q.tolist() == [0.6, 0.0]
+    assert f_beta(0.75, 0.6) == pytest.approx(2 * 0.75 * 0.6 / 1.35)
+    assert f_beta(0.0, 0.0) == 0.0
+    assert f_beta(0.5, 1.0, beta=2) == pytest.approx(5 * 0.5 / (4 * 0.5 + 1))
+
+
+def test_micro_pools_counts_and_macro_averages_images():
+    micro = aggregate_scores([4, 1], [2, 0], [4, 1], [0, 1])
+    assert micro['hallucination_score'] == pytest.approx(1 - 2 / 5)
+    assert micro['recall_score'] == pytest.approx(1 - 1 / 5)
+    macro = aggregate_scores([4, 1], [2, 0], [4, 1], [0, 1], aggregation='macro')
+    assert macro['hallucination_score'] == pytest.approx(0.75)
+    assert macro['recall_score'] == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        aggregate_scores([1], [0], [1], [0], aggregation='median')
+
+
+def test_parse_analysis_reads_both_formats():
+    assert parse_analysis('Entry 2 is wrong.\nIncorrect Serial Numbers: 1, 3') == [1, 3]
+    assert parse_analysis('{"serial_numbers": [{"serial": 2, "reason": "x"}, {"serial": 2, "reason": "y"}]}') == [2]
+    assert parse_analysis(None) == []
+
+
+def test_rescoring_reproduces_eval_scores(tmp_path):
+    records = [record('a.jpg', 'Serial Numbers: 1', 'Serial Numbers: 2, 3'),
+               record('b.jpg', 'Serial Numbers: ', 'Serial Numbers: 1'),
+               record('c.jpg', 'Serial Numbers: 2', 'Serial Numbers: ', response_vlm='')]
+    path = tmp_path / 'journal.jsonl'
+    write_journal(path, records)
+    loaded = rescore.load_journal(str(path))
+    assert [item['image'] for item in loaded] == ['a.jpg', 'b.jpg', 'c.jpg']
+    expected = [(item['halusion_score'], item['quality_score'], item['f_score']) for item in records]
+    summary = rescore.rescore_records(loaded)
+    assert [(item['halusion_score'], item['quality_score'], item['f_score']) for item in loaded] == expected
+    assert summary['num_images'] == 3
+    assert summary['hallucination_score'] == pytest.approx(1 - 2 / 4)
+    assert summary['recall_score'] == pytest.approx(1 - 3 / 9)
+
+
+def test_strict_and_category_counts():
+    # Serial 2 is repeated and 9 is not an entry of the VLM graph.
+    item = record('a.jpg', 'Serial Numbers: 2, 2, 9', 'Serial Numbers: 1, 3')
+    assert rescore.image_counts(item) == (2, 3, 3, 2)
+    assert rescore.image_counts(item, strict=True) == (2, 1, 3, 2)
+    assert rescore.image_counts(item, categories={'object'}) == (2, 1, 2, 1)
+    assert rescore.image_counts(item, categories={'relationship'}) == (0, 0, 1, 1)
+
+
+def test_stored_indices_are_used_without_reparsing():
+    item = record('a.jpg', 'Serial Numbers: 1', 'Serial Numbers: 1')
+    item['hallusion_concepts_idx'] = [1, 2]
+    assert rescore.image_counts(item, reparse=False) == (2, 2, 3, 1)
+    assert rescore.image_counts(item) == (2, 1, 3, 1)
+
+
+def test_cli_writes_the_rescored_journal(tmp_path, capsys):
+    path, output = tmp_path / 'journal.jsonl', tmp_path / 'rescored.jsonl'
+    write_journal(path, [record('a.jpg', 'Serial Numbers: 1', 'Serial Numbers: 2')])
+    rescore.main([str(path), '--aggregation', 'macro', '--beta', '2', '--output', str(output)])
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['journal'] == str(path) and summary['aggregation'] == 'macro' and summary['beta'] == 2.0
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert lines[0]['image'] == 'a.jpg'
+    assert lines[1] == {key: summary[key] for key in ('hallucination_score', 'recall_score', 'f_score')}
+    with pytest.raises(SystemExit):
+        rescore.main([str(path), str(path), '--output', str(output)])
@@ -0,0 +1,121 @@
+import json
+import socket
+from multiprocessing import Pool
+
+import pytest
+
+from perturbollava import retry
+from perturbollava.retry import (DeadLetterLog, PermanentError, RetryableError, RetryError, RetryPolicy,
+                                 describe_error, is_retryable)
+
+
+def http_error(status_code, headers=None):
+    requests = pytest.importorskip('requests')
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.exceptions.HTTPError(response=response)
+
+
+@pytest.mark.parametrize('exc', [
+    RetryableError(), TimeoutError(), socket.timeout(), ConnectionResetError(), BrokenPipeError(),
+    OSError('network is unreachable'), RuntimeError('unknown'),
+])
+def test_transient_errors_are_retryable(exc):
+    assert is_retryable(exc)
+
+
+@pytest.mark.parametrize('exc', [
+    PermanentError(), FileNotFoundError(), PermissionError(), IsADirectoryError(), ValueError(), KeyError('choices'),
+    json.JSONDecodeError('Expecting value', '', 0),
+])
+def test_permanent_errors_are_not_retried(exc):
+    assert not is_retryable(exc)
+
+
+@pytest.mark.parametrize('status_code, retryable', [(429, True), (500, True), (503, True), (520, True),
+                                                    (400, False), (401, False), (404, False)])
+def test_http_errors_by_status(status_code, retryable):
+    assert is_retryable(http_error(status_code)) == retryable
+
+
+def test_requests_timeouts_are_retryable():
+    requests = pytest.importorskip('requests')
+    assert is_retryable(requests.exceptions.ReadTimeout())
+    assert is_retryable(requests.exceptions.ConnectionError())
+
+
+class Flaky(object):
+
+    def __init__(self, errors, result='ok'):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(retry.time, 'sleep', delays.append)
+    return delays
+
+
+def test_retries_until_success(sleeps):
+    func = Flaky([TimeoutError(), ConnectionResetError()])
+    assert RetryPolicy(base_delay=1.0).call(func) == 'ok'
+    assert func.calls == 3
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+def test_permanent_error_stops_at_once(sleeps):
+    func = Flaky([FileNotFoundError('missing.jpg')])
+    with pytest.raises(RetryError) as info:
+        RetryPolicy().call(func)
+    assert (info.value.attempts, info.value.retryable) == (1, False)
+    assert isinstance(info.value.last_exception, FileNotFoundError)
+    assert func.calls == 1 and sleeps == []
+
+
+def test_attempts_are_bounded(sleeps):
+    func = Flaky([TimeoutError()] * 10)
+    with pytest.raises(RetryError, match='after 3 attempts') as info:
+        RetryPolicy(max_attempts=3).call(func)
+    assert (info.value.attempts, info.value.retryable) == (3, True)
+    assert func.calls == 3 and len(sleeps) == 2
+
+
+def test_deadline_stops_before_sleeping_past_it(sleeps):
+    func = Flaky([TimeoutError()] * 10)
+    with pytest.raises(RetryError, match='deadline'):
+        RetryPolicy(base_delay=100.0, max_delay=100.0, deadline=0.0).call(func)
+    assert func.calls == 1 and sleeps == []
+
+
+def test_retry_after_sets_the_minimum_delay(sleeps):
+    func = Flaky([http_error(429, {'Retry-After': '7'})])
+    assert RetryPolicy(base_delay=0.001, max_delay=10.0).call(func) == 'ok'
+    assert sleeps == [7.0]
+    assert RetryPolicy(max_delay=5.0).backoff(0, http_error(429, {'Retry-After': '30'})) == 5.0
+
+
+def write_entry(args):
+    path, key = args
+    DeadLetterLog(path).write(key, **describe_error(RetryError('failed', TimeoutError(), 6, True)))
+
+
+def test_dead_letter_log_is_shared_by_processes(tmp_path):
+    path = str(tmp_path / 'nested' / 'dead_letter.jsonl')
+    assert DeadLetterLog(path).keys() == set()
+    with Pool(4) as pool:
+        pool.map(write_entry, [(path, f'image{i}') for i in range(40)])
+    assert DeadLetterLog(path).keys() == {f'image{i}' for i in range(40)}
+    with open(path) as f:
+        entry = json.loads(f.readline())
+    assert entry['error'] == 'TimeoutError()' and entry['attempts'] == 6 and entry['retryable'] is True
+    assert describe_error(ValueError('bad')) == {'error': "ValueError('bad')", 'attempts': 1, 'retryable': None}
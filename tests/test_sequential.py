@@ -0,0 +1,92 @@
+import json
+import random
+from multiprocessing.pool import ThreadPool
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import eval as halfscore
+from perturbollava.budget import DEFAULT_PRICING, BudgetGovernor
+from perturbollava.scoring import aggregate_scores, score_image
+from perturbollava.sequential import SequentialMonitor, f_score_influence
+
+
+def population(n, hallucination_rate, omission_rate, seed):
+    rng = np.random.default_rng(seed)
+    vlm = rng.integers(5, 30, n)
+    gt = rng.integers(10, 40, n)
+    return np.stack([vlm, rng.binomial(vlm, hallucination_rate), gt, rng.binomial(gt, omission_rate)], axis=1)
+
+
+def test_influence_is_the_jackknife_slope():
+    counts = population(400, 0.2, 0.4, seed=0)
+    f, influence = f_score_influence(counts)
+    assert f == pytest.approx(aggregate_scores(*counts.T)['f_score'])
+    assert influence.sum() == pytest.approx(0.0, abs=1e-9)
+    for i in range(5):
+        f_without = f_score_influence(np.delete(counts, i, axis=0))[0]
+        assert (f - f_without) * (len(counts) - 1) == pytest.approx(influence[i], rel=0.05, abs=1e-3)
+
+
+def test_interval_covers_the_population_score():
+    counts = population(20000, 0.25, 0.35, seed=1)
+    truth = f_score_influence(counts)[0]
+    rng = np.random.default_rng(2)
+    covered = 0
+    for _ in range(200):
+        decision = SequentialMonitor(alpha=0.1, min_images=1).update(counts[rng.choice(len(counts), 150)])
+        covered += decision['lower'] <= truth <= decision['upper']
+    # The first look uses alpha / 2, so the interval should cover at least 1 - alpha of the time.
+    assert covered >= 180
+
+
+def test_stopping_rules():
+    counts = population(400, 0.2, 0.4, seed=3)
+    monitor = SequentialMonitor(precision=0.05, min_images=50)
+    assert monitor.update(counts[:20])['reason'] is None
+    decision = monitor.update(counts)
+    assert decision['stop'] and decision['reason'] == 'precision' and decision['half_width'] <= 0.05
+    assert SequentialMonitor(min_images=10).update(counts)['stop'] is False
+    assert SequentialMonitor(target=0.2, min_images=10).update(counts)['reason'] == 'significant'
+    assert SequentialMonitor(target=decision['estimate'], min_images=10).update(counts)['stop'] is False
+
+
+def test_paired_difference():
+    better = population(300, 0.1, 0.3, seed=4)
+    worse = better.copy()
+    worse[:, 1] = np.minimum(worse[:, 0], worse[:, 1] + 3)
+    decision = SequentialMonitor(min_images=10).update(better, worse)
+    assert decision['reason'] == 'significant' and decision['lower'] > 0
+    assert SequentialMonitor(min_images=10).update(better, better)['stop'] is False
+    assert SequentialMonitor(min_images=10).update(better[:1])['half_width'] == float('inf')
+
+
+def test_eval_stops_once_precise_enough(monkeypatch, tmp_path):
+    counts = {f'{i}.jpg': row for i, row in enumerate(population(500, 0.2, 0.4, seed=5))}
+    evaluated = []
+
+    def judge_image(args):
+        image_id, save_path = args[1], args[4]
+        vlm, hallucinated, gt, omitted = (int(value) for value in counts[image_id])
+        record = score_image({'image': image_id, 'vlm_num_concepts': vlm, 'vlm_hallusion_concepts_num': hallucinated,
+                              'gt_num_concepts': gt, 'gt_omission_concepts_num': omitted,
+                              'prompt_digest': halfscore.eval_prompts_digest()})
+        with open(save_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        evaluated.append(image_id)
+        return record, None
+
+    monkeypatch.setattr(halfscore, 'process_image_wrapper', judge_image)
+    save_path = str(tmp_path / 'journal.jsonl')
+    work = {image_id: (0, image_id, 'gt', 'vlm', save_path, None) for image_id in counts}
+    args = SimpleNamespace(alpha=0.05, precision=0.04, target_f_score=None, min_images=40, seed=7,
+                           sequential_chunk=20, num_workers=2)
+    with ThreadPool(2) as pool:
+        decision = halfscore.run_sequential(args, pool, list(counts), [work], [save_path], BudgetGovernor(),
+                                            DEFAULT_PRICING)
+    assert decision['stop'] and decision['reason'] == 'precision'
+    assert decision['images'] == len(evaluated) < len(counts)
+    order = list(counts)
+    random.Random(7).shuffle(order)
+    assert sorted(evaluated) == sorted(order[:len(evaluated)])
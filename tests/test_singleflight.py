@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import eval as halfscore
+from perturbollava.singleflight import SingleFlight, prompt_key
+
+MESSAGES = [{'role': 'user', 'content': 'Describe the image.'}]
+
+
+def test_prompt_key_identifies_the_request():
+    assert prompt_key(MESSAGES, 'gpt-4o') == prompt_key([{'content': 'Describe the image.', 'role': 'user'}], 'gpt-4o')
+    assert prompt_key(MESSAGES, 'gpt-4o') != prompt_key(MESSAGES, 'other-model')
+    assert prompt_key(MESSAGES, 'gpt-4o') != prompt_key(MESSAGES, 'gpt-4o', response_format={'type': 'json_object'})
+    assert prompt_key(MESSAGES, 'gpt-4o', response_format=None) == prompt_key(MESSAGES, 'gpt-4o')
+
+
+def test_concurrent_identical_calls_run_once(tmp_path):
+    flight = SingleFlight(str(tmp_path / 'flight'))
+    calls = []
+    lock = threading.Lock()
+
+    def slow_call(value):
+        with lock:
+            calls.append(value)
+        time.sleep(0.05)
+        return {'response': value}
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda i: flight.do('same', slow_call, 'first'), range(8)))
+    assert calls == ['first']
+    assert results == [{'response': 'first'}] * 8
+    assert flight.do('other', slow_call, 'second') == {'response': 'second'}
+    assert calls == ['first', 'second']
+
+
+def test_failed_calls_are_not_stored(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+
+    def fail():
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'ok') == 'ok'
+    assert flight.do('key', fail) == 'ok'
+
+
+def test_shared_judge_calls_are_paid_once(judge, monkeypatch, tmp_path):
+    monkeypatch.setattr(halfscore, '_single_flight', SingleFlight(str(tmp_path)))
+    messages = halfscore.extraction_messages('A red car.')
+    answers = [halfscore.call_judge(messages) for _ in range(3)]
+    assert len(set(answers)) == 1 and len(judge.calls) == 1
+    assert halfscore.take_paid_usage() == {'prompt_tokens': 10, 'completion_tokens': 5}
+    assert halfscore.take_paid_usage() == {}
+
+
+@pytest.mark.parametrize('caption, empty', [('', True), ('  \n', True), (None, True), (['', ' '], True),
+                                            ('A car.', False), (['', 'A car.'], False)])
+def test_is_empty_caption(caption, empty):
+    assert halfscore.is_empty_caption(caption) == empty
+
+
+def test_empty_caption_only_extracts_the_gt(judge, tmp_path):
+    args = (0, 'a.jpg', 'A red car on a quiet street.', '', str(tmp_path / 'journal.jsonl'), str(tmp_path / 'dead.jsonl'))
+    record, usage = halfscore.process_single_image(args)
+    assert [name for name, _, _ in judge.calls] == ['extraction']
+    assert usage == {'prompt_tokens': 10, 'completion_tokens': 5}
+    assert record['vlm_num_concepts'] == record['vlm_hallusion_concepts_num'] == 0
+    assert record['gt_num_concepts'] == record['gt_omission_concepts_num'] == 3
+    assert record['quality_score'] == record['f_score'] == 0.0
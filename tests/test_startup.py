@@ -0,0 +1,43 @@
+import importlib
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(module):
+    code = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout
+    return set(output.split())
+
+
+def test_generate_workers_do_not_import_numpy_or_stage_helpers():
+    modules = imported_modules('augmentation.generate')
+    assert not {'numpy', 'augmentation.dedup', 'augmentation.priority', 'perturbollava.batch'} & modules
+
+
+def test_cli_dispatcher_imports_no_command():
+    modules = imported_modules('perturbollava.__main__')
+    assert not {'eval', 'augmentation.generate', 'augmentation.combine', 'numpy'} & modules
+
+
+def test_cli_dispatcher_runs_the_chosen_command():
+    run = subprocess.run([sys.executable, '-m', 'perturbollava', 'rescore', '--help'], cwd=REPO_ROOT,
+                         capture_output=True, text=True)
+    assert run.returncode == 0 and run.stdout.startswith('usage: python -m perturbollava rescore')
+    listing = subprocess.run([sys.executable, '-m', 'perturbollava', '--help'], cwd=REPO_ROOT,
+                             check=True, capture_output=True, text=True).stdout
+    assert all(f'  {name} ' in listing for name in ('eval', 'generate', 'combine', 'bench-startup'))
+    unknown = subprocess.run([sys.executable, '-m', 'perturbollava', 'bench-startup', 'nope'], cwd=REPO_ROOT,
+                             capture_output=True, text=True)
+    assert unknown.returncode == 2 and 'unknown commands' in unknown.stderr
+
+
+def test_every_command_entry_point_exists():
+    from perturbollava.__main__ import COMMANDS, bench_startup
+
+    for module_name, function_name, _ in COMMANDS.values():
+        assert callable(getattr(importlib.import_module(module_name), function_name))
+    (result,) = bench_startup(['rescore'], repeat=1, budget_ms=float('inf'))
+    assert result['module'] == 'perturbollava.rescore' and result['within_budget']
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from augmentation import storage
+
+RECORDS = [
+    {'id': 0, 'image': '0.jpg', 'conversations': [{'from': 'human', 'value': '<image>\nHi'}]},
+    {'id': 1, 'image': '1.jpg', 'perturbation_text': 'café ☃ with\nnewline'},
+    {'id': 2, 'image': None},
+    {'id': 3},
+    {'id': 4, 'image': '4.jpg', 'weight': 0.5, 'tags': []},
+    {'id': 5, 'late_column': {'nested': [1, 2]}},
+    {},
+]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    manifest = storage.export_dataset(iter(RECORDS), str(tmp_path / 'dataset'), shard_size=3)
+    dataset = storage.ColumnarDataset(str(tmp_path / 'dataset'))
+    yield manifest, dataset
+    dataset.close()
+
+
+def test_export_writes_a_sharded_manifest(dataset):
+    manifest, _ = dataset
+    assert manifest['format'] == storage.FORMAT_NAME
+    assert manifest['num_records'] == len(RECORDS)
+    assert [shard['num_records'] for shard in manifest['shards']] == [3, 3, 1]
+    assert set(manifest['columns']) == {'id', 'image', 'conversations', 'perturbation_text', 'weight', 'tags',
+                                        'late_column'}
+
+
+def test_records_round_trip_with_random_access(dataset):
+    _, data = dataset
+    assert len(data) == len(RECORDS)
+    assert [data[i] for i in range(len(data))] == RECORDS
+    assert list(data.iter_records()) == RECORDS
+    assert data[-2] == RECORDS[-2]
+    assert data.get(4, columns=['weight', 'missing_here']) == {'weight': 0.5}
+    with pytest.raises(IndexError):
+        data[len(RECORDS)]
+
+
+def test_columns_read_without_touching_other_columns(dataset):
+    _, data = dataset
+    assert data.read_column('id') == [0, 1, 2, 3, 4, 5, None]
+    # A null value is kept; a missing key yields the default.
+    assert data.read_column('image', default='-') == ['0.jpg', '1.jpg', None, '-', '4.jpg', '-', '-']
+    assert data.read_column('late_column') == [None] * 5 + [{'nested': [1, 2]}, None]
+    assert set(data._mapped) == {(shard, name) for shard in range(3) for name in ('id', 'image', 'late_column')}
+
+
+def test_import_converts_back_to_json_and_json_lines(dataset, tmp_path):
+    source = str(tmp_path / 'dataset')
+    storage.import_dataset(source, str(tmp_path / 'out.json'), indent=2)
+    assert json.loads((tmp_path / 'out.json').read_text(encoding='utf-8')) == RECORDS
+    storage.import_dataset(source, str(tmp_path / 'out.jsonl'), jsonl=True)
+    lines = (tmp_path / 'out.jsonl').read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == RECORDS
+
+
+def test_an_empty_export_reads_back_empty(tmp_path):
+    storage.export_dataset([], str(tmp_path / 'empty'))
+    data = storage.ColumnarDataset(str(tmp_path / 'empty'))
+    assert len(data) == 0
+    assert list(data.iter_records()) == []
+
+
+def test_other_directories_are_rejected(tmp_path):
+    (tmp_path / storage.MANIFEST_NAME).write_text(json.dumps({'format': 'something-else'}))
+    with pytest.raises(ValueError, match='not a'):
+        storage.ColumnarDataset(str(tmp_path))
+
+
+def test_parquet_export_round_trips(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    records = [{'id': i, 'image': f'{i}.jpg'} for i in range(5)]
+    storage.export_parquet(iter(records), str(tmp_path / 'out.parquet'))
+    assert pq.read_table(str(tmp_path / 'out.parquet')).to_pylist() == records
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import eval as halfscore
+from perturbollava.retry import RetryError
+from perturbollava.scoring import JudgeOutputError, parse_analysis, parse_structured_serials
+
+
+def answer(*serials):
+    return json.dumps({'serial_numbers': [{'serial': serial, 'reason': f'entry {serial}'} for serial in serials]})
+
+
+def test_structured_serials_are_read_in_answer_order_once():
+    assert parse_structured_serials(answer(3, 1, 3)) == [3, 1]
+    assert parse_structured_serials('```json\n' + answer(2) + '\n```', valid_serials={1, 2}) == [2]
+    assert parse_structured_serials(answer()) == []
+
+
+@pytest.mark.parametrize('text', [
+    'Incorrect Serial Numbers: 1, 2',
+    'Here you go: ' + answer(1),
+    '[1, 2]',
+    '{"serials": []}',
+    '{"serial_numbers": [1]}',
+    '{"serial_numbers": [{"serial": "1", "reason": "x"}]}',
+    '{"serial_numbers": [{"serial": true, "reason": "x"}]}',
+    '{"serial_numbers": [{"serial": 1}]}',
+    '',
+    None,
+])
+def test_answers_breaking_the_schema_are_errors(text):
+    with pytest.raises(JudgeOutputError):
+        parse_structured_serials(text)
+
+
+def test_flagged_serials_must_be_entries_of_the_graph():
+    with pytest.raises(JudgeOutputError, match='serial number 4'):
+        parse_structured_serials(answer(1, 4), valid_serials={1, 2, 3})
+
+
+def test_stored_analyses_parse_in_either_format():
+    assert parse_analysis(answer(2, 5)) == [2, 5]
+    # A broken JSON answer of an old journal falls back to the text marker.
+    assert parse_analysis('{broken\nSerial Numbers: 4') == [4]
+
+
+def graphs():
+    return halfscore.generate_response('A red car.'), halfscore.generate_response('A car.')
+
+
+def get_format(name):
+    return halfscore.get_prompt(name).response_format()
+
+
+def test_bad_answers_are_asked_again_in_the_same_conversation(judge):
+    gt, vlm = graphs()
+    judge.script = ['Serial Numbers: 1', answer(7), answer(2)]
+    result = halfscore.call_analysis('hallucination', gt, vlm)
+    assert result == answer(2)
+    analyses = [call for call in judge.calls if call[0] == 'hallucination']
+    assert len(analyses) == 3
+    assert all(response_format == get_format('hallucination') for _, _, response_format in analyses)
+    last_messages = analyses[-1][1]
+    assert [message['role'] for message in last_messages] == ['user', 'assistant', 'user', 'assistant', 'user']
+    assert last_messages[1]['content'] == 'Serial Numbers: 1' and last_messages[3]['content'] == answer(7)
+    assert 'serial number 7' in last_messages[4]['content']
+
+
+def test_answers_still_broken_after_the_reasks_fail_the_image(judge):
+    gt, vlm = graphs()
+    judge.script = ['no json'] * (halfscore.MAX_SCHEMA_REASKS + 1)
+    with pytest.raises(RetryError, match='still breaks its schema') as info:
+        halfscore.call_analysis('omission', gt, vlm)
+    assert isinstance(info.value.last_exception, JudgeOutputError) and not info.value.retryable
+    assert len(judge.calls) == 2 + halfscore.MAX_SCHEMA_REASKS + 1
+
+
+def test_empty_caption_analyses_follow_the_prompt_format():
+    structured = halfscore.empty_caption_analysis('omission', {3, 1})
+    assert parse_structured_serials(structured) == [1, 3]
+    halfscore.select_prompt_versions(halfscore.LEGACY_PROMPT_VERSIONS)
+    try:
+        text = halfscore.empty_caption_analysis('omission', {3, 1})
+        assert text.endswith('Missing Serial Numbers: 1, 3') and parse_analysis(text) == [1, 3]
+    finally:
+        halfscore.select_prompt_versions({})
@@ -0,0 +1,90 @@
+import json
+import warnings
+
+import numpy as np
+import pytest
+
+from perturbollava import subset
+from perturbollava.scoring import score_image
+from perturbollava.subset import allocate, build_subset, quantile_bins
+
+COUNT_KEYS = subset.COUNT_KEYS
+
+
+def benchmark(num_images=300, seed=0):
+    rng = np.random.default_rng(seed)
+    annotations, journal = [], []
+    for i in range(num_images):
+        length = int(rng.integers(5, 80))
+        annotations.append({'image': f'{i}.jpg', 'caption': ' '.join(['word'] * length)})
+        gt = length // 2 + 1
+        vlm = int(rng.integers(3, 30))
+        # Longer captions are harder: more omissions.
+        counts = [vlm, int(rng.binomial(vlm, 0.2)), gt, int(rng.binomial(gt, min(0.9, length / 100)))]
+        journal.append(score_image(dict(zip(COUNT_KEYS, counts), image=f'{i}.jpg')))
+    return annotations, journal
+
+
+def test_quantile_bins():
+    assert quantile_bins([1, 2, 3, 4, 5, 6], 3).tolist() == [0, 0, 1, 1, 2, 2]
+    tied = quantile_bins([1, 1, 1, 1, 1, 1, 2, 3, 4], 3)
+    assert len(set(tied[:6].tolist())) == 1 and tied[8] > tied[0]
+    assert quantile_bins([3, 1, 2], 1).tolist() == [0, 0, 0]
+    assert quantile_bins([], 3).tolist() == []
+
+
+def test_allocation_respects_n_and_stratum_sizes():
+    assert allocate([10, 20, 30], [0, 0, 0], 60).tolist() == [10, 20, 30]
+    assert allocate([10, 20, 30], [0, 0, 0], 12).tolist() == [2, 4, 6]
+    neyman = allocate([100, 100], [1.0, 3.0], 40)
+    assert neyman.tolist() == [10, 30]
+    capped = allocate([1, 100, 100], [10.0, 1.0, 1.0], 20, min_per_stratum=5)
+    assert capped[0] == 1 and capped.sum() == 20
+
+
+def test_small_subsets_warn_and_keep_n():
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        allocation = allocate([10, 10, 10, 10], [1, 1, 1, 1], 3)
+    assert allocation.sum() == 3 and (allocation <= 1).all()
+    assert any('below the number of strata' in str(warning.message) for warning in caught)
+
+
+def test_weights_add_up_to_the_benchmark():
+    annotations, journal = benchmark()
+    sample, report = build_subset(annotations, [journal], n=60, seed=1)
+    assert len(sample) == report['subset'] == 60 and report['population'] == 300
+    assert sum(item['weight'] for item in sample) == pytest.approx(300)
+    for stratum in {tuple(item['stratum']) for item in sample}:
+        members = [item for item in sample if tuple(item['stratum']) == stratum]
+        # Every image of a stratum has the same weight N_h / n_h.
+        assert len({item['weight'] for item in members}) == 1
+    assert len({item['image'] for item in sample}) == 60
+    assert report['f_score_std_stratified'] <= report['f_score_std_uniform']
+
+
+def test_weighted_counts_are_unbiased():
+    annotations, journal = benchmark()
+    records = {record['image']: record for record in journal}
+    totals = np.array([[record[key] for key in COUNT_KEYS] for record in journal]).sum(axis=0)
+    estimates = []
+    for seed in range(200):
+        sample, _ = build_subset(annotations, [journal], n=40, seed=seed)
+        estimates.append(sum(item['weight'] * np.array([records[item['image']][key] for key in COUNT_KEYS])
+                             for item in sample))
+    assert np.mean(estimates, axis=0) == pytest.approx(totals, rel=0.02)
+
+
+def test_without_journals_only_caption_length_stratifies(tmp_path, capsys):
+    annotations, journal = benchmark(num_images=50)
+    sample, report = build_subset(annotations, n=10, length_bins=2)
+    assert report['strata'] == 2 and 'variance_reduction' not in report
+    assert sum(item['weight'] for item in sample) == pytest.approx(50)
+
+    cap_file, journal_file, output = tmp_path / 'annotation.json', tmp_path / 'journal.jsonl', tmp_path / 'subset.json'
+    cap_file.write_text(json.dumps(annotations))
+    journal_file.write_text(''.join(json.dumps(dict(record, response_gt='', response_vlm='')) + '\n'
+                                    for record in journal))
+    subset.main(['--cap_file', str(cap_file), '--journals', str(journal_file), '-n', '20', '--output', str(output)])
+    assert json.loads(capsys.readouterr().out)['journals'] == 1
+    assert len(json.loads(output.read_text())) == 20